@@ -1,6 +1,137 @@
+import re
 import pandas as pd
 import numpy as np 
 
+WC_CODE = re.compile(r'(?P<letter>WG|WH|PK|WX|SC|OR)(?P<digit>\d)')
+AM_CODE = re.compile(r'(?P<letter>AM)(?P<digit>\d)')
+
+def parse_space(code):
+
+    """
+    Decodes one SpaceOn/SpaceOff string, e.g. "WG1,AM1,PK1", the same way create_OnOffcols used to:
+    each comma separated entry adds the digit of its first WC (or AM) code, anything else adds 0.
+
+    Args:
+    code (string): SpaceOn or SpaceOff entry, may be null
+
+    Returns:
+    (wc, am) tuple of ints
+
+    """
+
+    wc, am = 0, 0
+    try:
+        entries = code.split(",")
+    except AttributeError:
+        # null or non-string entry
+        entries = []
+    for entry in entries:
+        match = WC_CODE.search(entry)
+        if match:
+            wc += int(match.group('digit'))
+        match = AM_CODE.search(entry)
+        if match:
+            am += int(match.group('digit'))
+    return wc, am
+
+def space_counts(codes):
+
+    """
+    Args:
+    codes (array): SpaceOn or SpaceOff column
+
+    Returns:
+    (n, 2) int array of wc and am counts for each row, 0 for null rows
+
+    """
+
+    # decode each distinct string of this call once (a few hundred a day), then map back by its
+    # factorized label; nothing is kept between calls, the codes are free text from the feed
+    labels, uniques = pd.factorize(np.asarray(codes, dtype=object))
+    # nulls get label -1, which picks the (0, 0) row appended at the end
+    table = np.array([parse_space(code) for code in uniques] + [(0, 0)], dtype=int)
+    return table[labels]
+
+def time_windows(eta, schtime, activity, reqlate, windows):
+
+    """
+    Pick up and drop off windows for every row at once. Pick ups (Activity 0) get a window
+    of size windows centered on SchTime. Drop offs (Activity 1) start an hour before the ETA
+    and end an hour after it, or at ReqLate when there is a required drop off time. Every
+    other row, and drop offs with ReqLate of 0, get 0s.
+
+    Args:
+    eta, schtime, activity, reqlate (array): ETA, SchTime, Activity and ReqLate columns
+    windows (int): size of pickup/dropoff windows in seconds
+
+    Returns:
+    PickupStart, PickupEnd, DropoffStart, DropoffEnd arrays
+
+    """
+
+    eta = np.array(eta, dtype=float)
+    schtime = np.array(schtime, dtype=float)
+    activity = np.array(activity, dtype=float)
+    reqlate = np.array(reqlate, dtype=float)
+    nrow = eta.shape[0]
+    PickupStart = np.zeros(nrow); PickupEnd = np.zeros(nrow)
+    DropoffStart = np.zeros(nrow); DropoffEnd = np.zeros(nrow)
+
+    with np.errstate(invalid='ignore'):
+        #make dropoff window when there's no required drop off time
+        no_reqlate = (activity == 1) & (reqlate < 0)
+        #make dropoff window when there IS a required drop off time: 1hr before ReqLate time
+        reqlate_set = (activity == 1) & (reqlate > 0)
+    dropoff = no_reqlate | reqlate_set
+    DropoffStart[dropoff] = eta[dropoff] - 3600
+    DropoffEnd[no_reqlate] = eta[no_reqlate] + 3600
+    DropoffEnd[reqlate_set] = reqlate[reqlate_set]
+
+    #schtime is in the middle of the pick up window
+    pickup = activity == 0
+    PickupStart[pickup] = schtime[pickup] - (windows/2)
+    PickupEnd[pickup] = schtime[pickup] + (windows/2)
+
+    return PickupStart, PickupEnd, DropoffStart, DropoffEnd
+
+def onboard_counts(groups, on, off):
+
+    """
+    Passengers on board after each row for a whole day in one pass: a cumulative sum of on minus
+    off that restarts at every run (null entries count as 0), NaN wherever more have got off than on.
+    Same numbers as PassengerCounter.passenger_count_at_checkpoint on each run.
+
+    Args:
+    groups (array): run (or other grouping key) of each row, rows of a run in schedule order
+    on (array): column from df that has entries for WC/AM numbers at each time step
+    off (array): column from df that has entries for WC/AM numbers at each time step
+
+    Returns:
+    array of passengers on board, int if no count went negative, float with NaNs otherwise
+
+    """
+
+    net = np.nan_to_num(np.array(on, dtype=float)) - np.nan_to_num(np.array(off, dtype=float))
+    codes = pd.factorize(np.asarray(groups))[0]
+
+    # stable sort keeps schedule order inside each run
+    order = np.argsort(codes, kind='mergesort')
+    total = np.cumsum(net[order])
+    sorted_codes = codes[order]
+    first = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+    # subtract the running total reached before each run starts
+    start_total = (total - net[order])[first]
+    counts_sorted = total - start_total[np.cumsum(first) - 1]
+
+    counts = np.empty(len(net))
+    counts[order] = counts_sorted
+    negative = counts < 0.
+    if negative.any():
+        counts[negative] = np.nan
+        return counts
+    return counts.astype(int)
+
+
 class PassengerCounter():
 
     """ 
@@ -26,6 +157,9 @@ class PassengerCounter():
         """
         self.on = on
         self.off = off
+        # running totals, null entries count as 0: [0, on[0], on[0]+on[1], ...]
+        self.on_total = np.r_[0., np.cumsum(np.nan_to_num(np.array(on, dtype=float)))]
+        self.off_total = np.r_[0., np.cumsum(np.nan_to_num(np.array(off, dtype=float)))]
 
 
     def passenger_sum(self, thesum, iter):
@@ -63,15 +197,26 @@ class PassengerCounter():
         Difference between passengers getting on and off bus at given checkpoint (timestep) 
 
         """
-        on_count = reduce(self.passenger_sum, self.on[:checkpoint],0)
-        off_count = reduce(self.passenger_sum, self.off[:checkpoint],0)
+        on_count = self.on_total[checkpoint]
+        off_count = self.off_total[checkpoint]
 
         if on_count - off_count < 0.:
             return np.nan
     
     
         
-        return on_count - off_count
+        return int(on_count - off_count)
+
+    def passenger_counts(self):
+
+        """
+        
+        Returns:
+        array of passenger_count_at_checkpoint for checkpoints 1 to len(on), i.e. passengers on board
+        after each time step (NaN where more got off than on)
+
+        """
+        return onboard_counts(np.zeros(len(self.on)), self.on, self.off)
 
     def transactions_at_checkpoint(self, checkpoint):
 
@@ -128,32 +273,8 @@ class TimeWindowsCapacity():
         """
 
 
-        etas = self.data.ix[:,"ETA"]
-        schtime =self.data.ix[:,"SchTime"]
-        Activity = self.data.ix[:, "Activity"]
-        ReqLate = self.data.ix[:, "ReqLate"]
-
-        schtime_arr = np.array(schtime.tolist())
-        nrow = self.data.shape[0]
-        PickupStart = np.zeros(nrow); PickupEnd = np.zeros(nrow)
-        DropoffStart = np.zeros(nrow); DropoffEnd = np.zeros(nrow)
-
-        for x in range(0, nrow):
-
-            #make dropoff window when there's no required drop off time
-            if (Activity[x] == 1) & (ReqLate[x] <0):
-                DropoffStart[x] = etas[x]-3600
-                DropoffEnd[x] = etas[x]+3600
-
-            #make dropoff window when there IS a required drop off time: 1hr before ReqLate time
-            if (Activity[x] == 1) & (ReqLate[x] >0):
-                DropoffStart[x] = etas[x]-3600
-                DropoffEnd[x] = ReqLate[x]  
-
-            #schtime is in the middle of the pick up window
-            if Activity[x] == 0:
-                PickupStart[x] = schtime[x]-(windows/2)
-                PickupEnd[x] = schtime[x]+(windows/2)
+        PickupStart, PickupEnd, DropoffStart, DropoffEnd = time_windows(self.data["ETA"], self.data["SchTime"],
+            self.data["Activity"], self.data["ReqLate"], windows)
 
         self.data.insert(len(self.data.columns), 'PickupStart',  pd.Series((PickupStart), index=self.data.index))
         self.data.insert(len(self.data.columns), 'PickupEnd',  pd.Series((PickupEnd), index=self.data.index))
@@ -180,22 +301,11 @@ class TimeWindowsCapacity():
         self.data['SpaceOn'].iloc[no_shows] = np.NAN
         self.data['SpaceOff'].iloc[no_shows] = np.NAN
 
-        if wc:
-            allcols_On = [self.data['SpaceOn'].str.split(",",expand=True)[i].str.extract('(?P<letter>WG|WH|PK|WX|SC|OR)(?P<digit>\d)') for i in range(self.data['SpaceOn'].str.split(",",expand=True).shape[1])]
-            allcols_Off = [self.data['SpaceOff'].str.split(",",expand=True)[i].str.extract('(?P<letter>WG|WH|PK|WX|SC|OR)(?P<digit>\d)') for i in range(self.data['SpaceOff'].str.split(",",expand=True).shape[1])]
-        else:
-            allcols_On = [self.data['SpaceOn'].str.split(",",expand=True)[i].str.extract('(?P<letter>AM)(?P<digit>\d)') for i in range(self.data['SpaceOn'].str.split(",",expand=True).shape[1])]
-            allcols_Off = [self.data['SpaceOff'].str.split(",",expand=True)[i].str.extract('(?P<letter>AM)(?P<digit>\d)') for i in range(self.data['SpaceOff'].str.split(",",expand=True).shape[1])]
-
+        col = 0 if wc else 1
+        on = space_counts(self.data['SpaceOn'])[:, col]
+        off = space_counts(self.data['SpaceOff'])[:, col]
 
-        for i in range(len(allcols_On)):
-            allcols_On[i].digit[pd.isnull(allcols_On[i].digit)] = 0
-            allcols_On[i].digit[~pd.isnull(allcols_On[i].digit)] = [int(j) for j in allcols_On[i].digit[~pd.isnull(allcols_On[i].digit)]] 
-            allcols_Off[i].digit[pd.isnull(allcols_Off[i].digit)] = 0
-            allcols_Off[i].digit[~pd.isnull(allcols_Off[i].digit)] = [int(j) for j in allcols_Off[i].digit[~pd.isnull(allcols_Off[i].digit)]]
-
-
-        return sum([allcols_On[i].digit for i in range(len(allcols_On))]), sum([allcols_Off[i].digit for i in range(len(allcols_Off))])
+        return pd.Series(on, index=self.data.index), pd.Series(off, index=self.data.index)
 
     def add_Capacity(self, busDateCol=False, wc=True, update=False):
 
@@ -218,39 +328,54 @@ class TimeWindowsCapacity():
         if not update: 
             self.data['wcOn'], self.data['wcOff'] = self.create_OnOffcols()
             self.data['amOn'], self.data['amOff'] = self.create_OnOffcols(wc=False)
-            self.data['wcCapacity'] = ""
-            self.data['amCapacity'] = ""
-        elif update: 
-            self.data['wcCapacity'] = ""
-            self.data['amCapacity'] = ""
 
+        # one grouped pass over the whole day instead of a PassengerCounter per run
+        if busDateCol:
+            groups = self.data['ServiceDate'].astype(str) + '_' + self.data['Run'].astype(str)
+        else:
+            groups = self.data['Run']
+
+        self.data['wcCapacity'] = pd.Series(onboard_counts(groups, self.data['wcOn'], self.data['wcOff']), index=self.data.index)
+        self.data['amCapacity'] = pd.Series(onboard_counts(groups, self.data['amOn'], self.data['amOff']), index=self.data.index)
+
+        return self.data
+
+    def update_Runs(self, runs, windows=None, busDateCol=False):
+
+        """
+        Recomputes capacity, and time windows if windows is given, for the rows of the given runs only.
+        Use after all_functions.day_schedule_Update instead of add_Capacity(update=True): only the run
+        the URID left and the run it was inserted on have changed.
+
+        Args:
+        runs (list): runs whose rows changed
+        windows (int): default None, pickup/dropoff time window in seconds, leave None to keep the existing windows
+        busDateCol (bool): default False, make True if the dataframe includes different service dates as well as bus runs
+
+        Returns:
+        original dataframe with the rows of runs updated
+
+        """
+
+        rows, = np.where(self.data['Run'].isin(list(runs)))
+        labels = self.data.index[rows]
+        block = self.data.iloc[rows]
+
+        if windows is not None:
+            block_windows = time_windows(block['ETA'], block['SchTime'], block['Activity'], block['ReqLate'], windows)
+            for col, values in zip(['PickupStart', 'PickupEnd', 'DropoffStart', 'DropoffEnd'], block_windows):
+                self.data.loc[labels, col] = values
 
         if busDateCol:
-            unique_combos = self.data.drop_duplicates(['ServiceDate', 'Run'])
-            zipped = zip(unique_combos)
-            for i in range(len(zipped)):
-                this_run = self.data[(self.data['Run'] == zipped[i][1]) & (self.data['ServiceDate'] == zipped[i][0])]
-                on_wc = np.array(this_run['wcOn'])
-                off_wc = np.array(this_run['wcOff'])
-                p_wc = PassengerCounter(on_wc,off_wc)
-                on_am = np.array(this_run['amOn'])
-                off_am = np.array(this_run['amOff'])
-                p_am = PassengerCounter(on_am, off_am)
-                self.data['wcCapacity'].loc[str(run)] = [p_wc.passenger_count_at_checkpoint(i) for i in range(1,len(on_wc)+1)]
-                self.data['amCapacity'].loc[str(run)] = [p_am.passenger_count_at_checkpoint(i) for i in range(1,len(on_am)+1)]
-
-        if not busDateCol:
-            for run in np.unique(self.data['Run']):
-                this_run = self.data[(self.data['Run'] == run)]
-                on_wc = np.array(this_run['wcOn'])
-                off_wc = np.array(this_run['wcOff'])
-                p_wc = PassengerCounter(on_wc,off_wc)
-                on_am = np.array(this_run['amOn'])
-                off_am = np.array(this_run['amOff'])
-                p_am = PassengerCounter(on_am, off_am)
-                runbool = run == self.data['Run']
-                self.data['wcCapacity'].loc[runbool] = [p_wc.passenger_count_at_checkpoint(i) for i in range(1,len(on_wc)+1)]
-                self.data['amCapacity'].loc[runbool] = [p_am.passenger_count_at_checkpoint(i) for i in range(1,len(on_am)+1)]
+            groups = block['ServiceDate'].astype(str) + '_' + block['Run'].astype(str)
+        else:
+            groups = block['Run']
+
+        for col, on, off in [('wcCapacity', 'wcOn', 'wcOff'), ('amCapacity', 'amOn', 'amOff')]:
+            self.data.loc[labels, col] = onboard_counts(groups, block[on], block[off])
+            # a full add_Capacity gives ints unless some count is negative, keep the same dtype
+            if self.data[col].dtype.kind == 'f' and not self.data[col].isnull().any():
+                self.data[col] = self.data[col].astype(int)
 
         return self.data
 
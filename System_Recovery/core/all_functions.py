@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-import haversine
 import operator
 import math
 import os
@@ -10,14 +9,21 @@ import re
 import time
 import datetime
 import read_fwf
-import itertools
+import s3_listing
 import operator
+from multiprocessing.pool import ThreadPool
 import add_TimeWindowsCapacity as aTWC
 import checkCapacityInsertPts as checkCap
+import routing
+import spatial_index as spIdx
+import window_index as winIdx
+import slack_index as slckIdx
+import schedule_store as schedStore
+import qcS3data as qcS3
 from boto.s3.connection import S3Connection
 
 
-def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name = 'qc_streaming.csv'):
+def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name = 'qc_streaming.csv', return_report = False):
 
     """
     For establishing connection, use access and secret keys sent by Valentina.
@@ -26,14 +32,15 @@ def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name =
         AWS_ACCESS_KEY (string): access key for AWS
         AWS_SECRET_KEY (string): secret key AWS
         path_to_data (string): path name to directory where data lies
-        qc_file_name (string): name of file for cleaned streaming data
+        qc_file_name (string): name of file for cleaned streaming data, None to not write it
+        return_report (bool): default False, also return the report of qcS3data.qc_runs
 
     Returns:
-        cleaned and processed dataframe of streaming data
+        cleaned and processed dataframe of streaming data (and the QC report if return_report)
 
 
     """
-    if os.path.isfile(os.path.join(path_to_data, qc_file_name)):
+    if (qc_file_name is not None) and os.path.isfile(os.path.join(path_to_data, qc_file_name)):
         os.remove(os.path.join(path_to_data, qc_file_name))
 
     #STEP 1: Access S3 and download relevant streaming data file
@@ -44,78 +51,42 @@ def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name =
 
     bucket = conn.get_bucket('paratransitdata')
 
-    #print bucket contents:
-    rs = bucket.list()
+    #list only today's snapshots, and only the ones added since the last run (listing kept in path_to_data)
+    listing = s3_listing.snapshot_listing(bucket, s3_listing.day_prefix(), path = os.path.join(path_to_data, 's3_listing.json'))
 
-    #get list of streaming_data files for today's date
-    file_ls = []
-    for key in rs:
-        if re.search('streaming_data/Schedules_'+ time.strftime('%Y%m%d'),key.name.encode('ascii')):
-            file_ls.append(key.name.encode('ascii'))
-
-    if not file_ls:
+    if not listing.keys:
         print('There are no files from '+ str(time.strftime('%Y/%m/%d'))+ '!')
         return -1
 
-    #select relevant streaming_data file: watch out, hopefully the [-1] file isn't zero bytes!
-    data_key = bucket.get_key(file_ls[-1])
+    #select the newest streaming_data file that isn't zero bytes
+    newest = listing.newest()
+    if newest is None:
+        print('All {0} files from {1} are empty!'.format(len(listing.keys), time.strftime('%Y/%m/%d')))
+        return -1
+    data_key = bucket.get_key(newest)
     move_to_me = os.path.join(path_to_data,'real_time_data.tsv')
     data_key.get_contents_to_filename(move_to_me)
-    print('Saving {0} from S3 bucket.'.format(file_ls[-1]))
+    print('Saving {0} from S3 bucket.'.format(newest))
 
     #STEP 2: change this file from fixed width formatted to tab delimitted
-    data = read_fwf.read(move_to_me)
+    data = read_fwf.read_fast(move_to_me)
+    if data.empty:
+        print('{0} has no rows!'.format(newest))
+        return -1
     print('Successfully converted fwf file.')
 
     #STEP 3: QC this file a la the R QCing script
+    if not qc_file_name is None:
+        qc_file_name = os.path.join(path_to_data, qc_file_name)
+    ret, report = qcS3.qc_runs(data, qc_file_name)
+    print('QC kept {0} of {1} runs.'.format(int(report.kept.sum()), report.shape[0]))
 
-    data56 = data.loc[(data.ProviderId == 5.) | (data.ProviderId == 6.)]
-    rides = data56.Run.unique()
-    data56.loc[:,'Activity'] = data56.loc[:,'Activity'].astype('int')
-
-    #lat/lon constraints:
-    upper_right = [49.020430, -116.998768]
-    lower_left = [45.606961, -124.974842]
-    minlat = lower_left[0]; maxlat = upper_right[0]
-    minlon = lower_left[1]; maxlon = upper_right[1]
-
-
-    #Write the cleaned up data:
-    ctr = 0
-    qc_file_name = os.path.join(path_to_data, qc_file_name)
-    for ride in rides:
-        temp_ride = data56.loc[data56.Run == ride]
-        if 'ServiceDate' in temp_ride.columns:
-            temp_ride = temp_ride.drop('ServiceDate', axis = 1)
-
-        flag = 1 #1 == good, 0 == eliminate.
-        lats = temp_ride.LAT; lons = temp_ride.LON
-        #eliminate runs from roster that have bad lat/lon data:
-        if(any(lats < minlat) | any(lats>maxlat) | any(lons<minlon) | any(lons > maxlon)):
-            flag = 0
-        #eliminate runs with just 2 rows of data:
-        if temp_ride.shape[0] == 2:
-            flag = 0
-        #eliminate runs that don't move
-        if(all(lats == lats.iloc[0]) | all(lons == lons.iloc[0])):
-            flag = 0
-        #eliminate runs that don't leave a garage and return to a garage
-        if (temp_ride.Activity.iloc[0] != 4) | (temp_ride.Activity.iloc[-1] != 3):
-            flag = 0
-
-        if (ctr != 0) & (flag == 1) :
-            temp_ride.to_csv(qc_file_name, mode = 'a', header = False, index = False)
-        if (ctr == 0) & (flag == 1):
-            temp_ride.to_csv(qc_file_name, mode = 'a', header = True, index = False)
-            ctr = 1
-
-    read_me = os.path.join(path_to_data, qc_file_name)
-    ret = pd.read_csv(read_me)
-
-    #resolve indexing issues if index column is type timedate, or something else
-    if not set(ret.index)==set(range(0, ret.shape[0])):
-        ret.index = range(0, ret.shape[0])
+    if ret.empty:
+        print('No runs passed QC!')
+        return -1
 
+    if return_report:
+        return ret, report
     return ret
 
 
@@ -151,9 +122,10 @@ def humanToSeconds(hhmm):
     return(hour * 3600 + sec * 60)
 
 
-class URID:
+class URID(object):
     """
-    Creates URID objects when called in get_URIDs functions.
+    Creates URID objects when called in get_URIDs functions. Attributes are slots, so a large
+    breakdown's URIDs (and the copies made for each candidate run) don't carry a dict each.
 
     Args:
         BookingId (float): ID associated with given URID
@@ -175,6 +147,9 @@ class URID:
 
     """
 
+    __slots__ = ('BookingId', 'Run', 'PickUpCoords', 'DropOffCoords', 'PickupStart', 'PickupEnd', 'DropoffStart',
+                 'DropoffEnd', 'SpaceOn', 'MobAids', 'wcOn', 'wcOff', 'amOn', 'amOff', 'PickupInsert', 'DropoffInsert')
+
     def __init__(self, BookingId, Run, PickUpCoords, DropOffCoords, PickupStart, PickupEnd, DropoffStart, DropoffEnd, SpaceOn, MobAids, wcOn, wcOff, amOn, amOff, PickupInsert, DropoffInsert):
         self.BookingId= BookingId
         self.Run = Run
@@ -194,6 +169,63 @@ class URID:
         self.DropoffInsert = DropoffInsert
 
 
+def URIDs_from_rows(rows, BookingIds, Run = None, stranded = None):
+
+    """
+    Make URIDs for many bookings with one groupby over rows, instead of filtering rows once per BookingId.
+
+    Args:
+        rows (dataframe): schedule rows holding the bookings, a booking's pick up row before its drop off row
+        BookingIds (list): bookings to make URIDs of, in the order they are returned
+        Run (str): default None, original run of every URID, None takes the run of each pick up row
+        stranded (tuple): default None, (resched_init_time, BREAKDOWN_LOC). Bookings with only their drop off
+            row in rows are on the bus already: with stranded they are picked up at BREAKDOWN_LOC from
+            resched_init_time, without it they are left out.
+
+    Returns:
+        list of URIDs
+    """
+
+    cols = dict((col, np.asarray(rows[col])) for col in ['Run', 'LAT', 'LON', 'PickupStart', 'PickupEnd',
+        'DropoffStart', 'DropoffEnd', 'SpaceOn', 'MobAids', 'wcOn', 'wcOff', 'amOn', 'amOff'])
+    groups = rows.groupby('BookingId', sort = False).indices
+
+    saveme = []
+    for ID in BookingIds:
+        positions = groups[ID]
+        first = positions[0]
+        if positions.shape[0] == 1:
+            if stranded is None:
+                continue
+            #if person is stranded on bus, their PickUpCoords are the BREAKDOWN_LOC (global var)
+            PickUpCoords = pd.Series(data = np.array(stranded[1]), index = ["LAT", "LON"])
+            PickupStart, PickupEnd = stranded[0], stranded[0]+30*60
+            last = first
+        else:
+            PickUpCoords = np.array([cols['LAT'][first], cols['LON'][first]]) #[0] is LAT, [1] is LON
+            PickupStart, PickupEnd = int(cols['PickupStart'][first]), int(cols['PickupEnd'][first])
+            last = positions[1]
+
+        saveme.append(URID(BookingId = ID,
+            Run = cols['Run'][first] if Run is None else Run,
+            PickUpCoords = PickUpCoords,
+            DropOffCoords = np.array([cols['LAT'][last], cols['LON'][last]]),
+            PickupStart = PickupStart,
+            PickupEnd = PickupEnd,
+            DropoffStart = int(cols['DropoffStart'][last]),
+            DropoffEnd = int(cols['DropoffEnd'][last]),
+            SpaceOn = cols['SpaceOn'][first],
+            MobAids = cols['MobAids'][first],
+            wcOn = cols['wcOn'][first],
+            wcOff = cols['wcOff'][last],
+            amOn = cols['amOn'][first],
+            amOff = cols['amOff'][last],
+            PickupInsert = 0,
+            DropoffInsert = 0))
+
+    return saveme
+
+
 def get_URID_Bus(data, broken_Run, resched_init_time, add_stranded = False, BREAKDOWN_LOC = None):
 
     """
@@ -219,50 +251,10 @@ def get_URID_Bus(data, broken_Run, resched_init_time, add_stranded = False, BREA
     diffIDs = unsched.BookingId.unique()
     diffIDs = diffIDs[~np.isnan(diffIDs)]
 
-    saveme = []
-
-    #save separate URID's in a list
-    for ID in diffIDs:
-        my_info = unsched[unsched["BookingId"]==ID]
-        #if person is already on bus when breakdown occurs,
-        #need to handle URID differently:
-        if(my_info.shape[0] == 1 & add_stranded):
-            temp = URID(BookingId = ID,
-                Run = broken_Run,
-                #if person is stranded on bus, their PickUpCoords are the BREAKDOWN_LOC (global var)
-                PickUpCoords = pd.Series(data = np.array(BREAKDOWN_LOC), index = ["LAT", "LON"]),
-                DropOffCoords = my_info[["LAT", "LON"]].as_matrix()[0,:],
-                PickupStart = resched_init_time,
-                PickupEnd = resched_init_time+30*60,
-                DropoffStart = int(my_info[["DropoffStart"]].as_matrix()[0,:]), #my_info is only one row...
-                DropoffEnd = int(my_info[["DropoffEnd"]].as_matrix()[0,:]),
-                SpaceOn = my_info[["SpaceOn"]].as_matrix()[0][0],
-                MobAids = my_info[["MobAids"]].as_matrix()[0][0],
-                wcOn = my_info["wcOn"].as_matrix()[0],
-                wcOff = my_info["wcOff"].as_matrix()[1],
-                amOn = my_info["amOn"].as_matrix()[0],
-                amOff = my_info["amOff"].as_matrix()[1],
-                PickupInsert = 0,
-                DropoffInsert = 0)
-            saveme.append(temp)
-        if(my_info.shape[0] != 1):
-            temp = URID(BookingId = ID,
-                Run = broken_Run,
-                PickUpCoords = my_info[["LAT", "LON"]].as_matrix()[0,:], #[0] is LAT, [1] is LON
-                DropOffCoords = my_info[["LAT", "LON"]].as_matrix()[1,:],
-                PickupStart = int(my_info[["PickupStart"]].as_matrix()[0,:]),
-                PickupEnd = int(my_info[["PickupEnd"]].as_matrix()[0,:]),
-                DropoffStart = int(my_info[["DropoffStart"]].as_matrix()[1,:]),
-                DropoffEnd = int(my_info[["DropoffEnd"]].as_matrix()[1,:]),
-                SpaceOn = my_info[["SpaceOn"]].as_matrix()[0][0],
-                MobAids = my_info[["MobAids"]].as_matrix()[0][0],
-                wcOn = my_info["wcOn"].as_matrix()[0],
-                wcOff = my_info["wcOff"].as_matrix()[1],
-                amOn = my_info["amOn"].as_matrix()[0],
-                amOff = my_info["amOff"].as_matrix()[1],
-                PickupInsert = 0,
-                DropoffInsert = 0)
-            saveme.append(temp)
+    #save separate URID's in a list,
+    #if person is already on bus when breakdown occurs, need to handle URID differently:
+    saveme = URIDs_from_rows(unsched, diffIDs, Run = broken_Run,
+                             stranded = (resched_init_time, BREAKDOWN_LOC) if add_stranded else None)
 
     print("There are %s URIDs left to be scheduled on broken run %s" % (len(saveme), broken_Run))
     return saveme
@@ -282,41 +274,23 @@ def get_URID_BookingIds(data, BookingId_list):
         list of URIDs given BookingId list
     """
 
-    diffIDs = BookingId_list
-    saveme = []
-    for ID in diffIDs:
-        my_info = data[data["BookingId"]==ID]
-        temp = URID(BookingId = ID,
-                Run = my_info['Run'].as_matrix()[0],
-                PickUpCoords = my_info[["LAT", "LON"]].as_matrix()[0,:],
-                DropOffCoords = my_info[["LAT", "LON"]].as_matrix()[1,:],
-                PickupStart = int(my_info[["PickupStart"]].as_matrix()[0,:]),
-                PickupEnd = int(my_info[["PickupEnd"]].as_matrix()[0,:]),
-                DropoffStart = int(my_info[["DropoffStart"]].as_matrix()[1,:]),
-                DropoffEnd = int(my_info[["DropoffEnd"]].as_matrix()[1,:]),
-                SpaceOn = my_info[["SpaceOn"]].as_matrix()[0][0],
-                MobAids = my_info[["MobAids"]].as_matrix()[0][0],
-                wcOn = my_info["wcOn"].as_matrix()[0],
-                wcOff = my_info["wcOff"].as_matrix()[1],
-                amOn = my_info["amOn"].as_matrix()[0],
-                amOff = my_info["amOff"].as_matrix()[1],
-                PickupInsert = 0,
-                DropoffInsert = 0)
-
-        saveme.append(temp)
+    saveme = URIDs_from_rows(data[data["BookingId"].isin(BookingId_list)], BookingId_list)
 
     #return sorted URIDs based on PickupStart time
     return sorted(saveme, key = operator.attrgetter('PickupStart'))
 
 
 
-def time_overlap(Run_Schedule, URID, pudo = True):
+def time_overlap(Run_Schedule, URID, pudo = True, index = None, exclude_run = None):
 
     """
     Args:
         Run_Schedule (dataframe): contains any number of bus runs, must have time window columns.
         URID (object): instance of URID class
         pudo (bool): default True (pick up), False for drop off
+        index (object): window_index.WindowIndex of the day's schedule Run_Schedule was taken from.
+            default None, index Run_Schedule here.
+        exclude_run (str): default None, ignore rows of this run (e.g. the broken run)
 
     Returns:
         retDict (dict): dictionary containing indices of schedule-outbound and -inbound nodes that we need
@@ -330,106 +304,69 @@ def time_overlap(Run_Schedule, URID, pudo = True):
         Start = URID.DropoffStart
         End = URID.DropoffEnd
 
-    crossover = []
-
-    for jj in range(Run_Schedule.shape[0]):
-        #Checking if a Run's PickupWindow overlaps with URID's Window.
-        WinSt = max(Run_Schedule.PickupStart.iloc[jj], Run_Schedule.DropoffStart.iloc[jj])
-        WinEnd = max(Run_Schedule.PickupEnd.iloc[jj], Run_Schedule.DropoffEnd.iloc[jj])
-
-        #simple, unequal overlap
-        if (WinEnd > Start) & (WinSt < End):
-            crossover.append(Run_Schedule.index[jj])
-        # equal or strictly within [WinSt, WinEnd]
-        if (WinEnd <= End) & (WinSt >= Start):
-            crossover.append(Run_Schedule.index[jj])
-        # [Start, End] completely covered by [WinSt, WinEnd] and then some on both sides
-        if (WinEnd > End) & (WinSt < Start):
-            crossover.append(Run_Schedule.index[jj])
-        # [Start, End] completely covered and then some only on left side
-        if (WinEnd == End) & (WinSt < Start):
-            crossover.append(Run_Schedule.index[jj])
-        # [Start, End] completely covered and then some only on right side
-        if (WinEnd > End) & (WinSt == Start):
-            crossover.append(Run_Schedule.index[jj])
-
-    #Get rid of cases that repeat themselves:
-    crossover = list(set(crossover))
-
-    inserts = Run_Schedule.loc[crossover]; indices = Run_Schedule.index
-    lst = []; outbound = []; inbound = []
-    #Lists of continuously arranged nodes with overlap
-    for k, g in itertools.groupby(enumerate(inserts.index), lambda (i,x):i-x):
-        k = map(operator.itemgetter(1), g)
-        #save upper/lower bound where appropriate
-        lst += [min(k)]; lst+=[max(k)]
-        if len(lst) == 2:
-            outbound += k; inbound +=k
-            if Run_Schedule.Activity.loc[lst[0]] != 4:
-                outbound.append(lst[0]-1) #we have a lower bound node, heading outbound from Run_Schedule
-            else:
-                inbound.pop(0) #if first node is leave garage, can't add lower bound,
-                               #and therefore can't return from having left from lower bound
-        else:
-            outbound += k
-            inbound +=k[1:len(k)]
+    if index is None:
+        index = winIdx.WindowIndex(Run_Schedule)
+    rows = None if Run_Schedule.shape[0] == index.labels.shape[0] else Run_Schedule.index
+    crossover = index.overlap(Start, End, rows = rows, exclude_run = exclude_run).astype(int)
+
+    if crossover.shape[0] == 0:
+        return {"outbound": [], "inbound": [], "all_nodes" : []}
 
-        inbound.append(lst[-1]+1) #upper bound node for each contiguous set of overlap nodes
+    #Lists of continuously arranged nodes with overlap: split where labels stop being consecutive
+    breaks, = np.where(np.diff(crossover) != 1)
+    starts = crossover[np.r_[0, breaks + 1]]
+    ends = crossover[np.r_[breaks, crossover.shape[0] - 1]]
 
-    outbound, inbound = map(sorted, [outbound, inbound])
+    outbound = crossover
+    #a node can only be returned to if it isn't the first of its contiguous set
+    inbound = crossover[~np.in1d(crossover, starts[1:])]
+    if Run_Schedule.Activity.loc[starts[0]] != 4:
+        outbound = np.r_[starts[0] - 1, outbound] #we have a lower bound node, heading outbound from Run_Schedule
+    else:
+        inbound = inbound[1:] #if first node is leave garage, can't add lower bound,
+                              #and therefore can't return from having left from lower bound
+    inbound = np.r_[inbound, ends + 1] #upper bound node for each contiguous set of overlap nodes
+
+    outbound, inbound = map(sorted, [outbound.tolist(), inbound.tolist()])
     all_nodes = sorted(np.union1d(outbound, inbound))
 
     retDict = {"outbound": outbound, "inbound": inbound, "all_nodes" : all_nodes}
     return retDict
 
 
-def radius_Elimination(data, URID, radius):
+def radius_Elimination(data, URID, radius, index = None, win_index = None):
 
     """
     Eliminates bus routes that are further than given radius away from URID.
 
-    NOTE: you need to "> pip install haversine"
-
     Args:
         data (dataframe): day's schedule with time windows added
         URID (object): instance of URID class from get_URIDs.py
         radius (float): distance to check from URID in miles
+        index (object): spatial_index.SpatialIndex built on data. default None, build one here;
+            pass one in to reuse it for every URID on the same schedule.
+        win_index (object): window_index.WindowIndex built on data, same as index.
 
     Returns:
-        list of runs within given radius of URID. Run time_insertions.py on resultant list.
+        list of runs within given radius of URID (at most 30, radius is shrunk by 1 mile
+        until there are few enough). Run time_insertions.py on resultant list.
     """
 
-    #obviously, broken bus can't be in the list of nearby buses.
-    data_copy = data[data.Run != URID.Run]
+    if index is None:
+        index = spIdx.SpatialIndex(data)
 
     URID_loc = ([round(URID.PickUpCoords[0],6), round(URID.PickUpCoords[1],6)])
 
-    #get pd.Data.Frame of nodes that have overlap with URID's pickup or dropoff window
-    overlap_data = time_overlap(data_copy, URID)
-
-    #get row index of nodes that may have either inbound/outbound overlap with URID TW.
-    overlap_data = data.loc[overlap_data['all_nodes']]
-    overlap_LAT = overlap_data.LAT.tolist()
-    overlap_LON = overlap_data.LON.tolist()
+    #get row index of nodes that have overlap with URID's pickup or dropoff window,
+    #and may have either inbound/outbound overlap with URID TW.
+    #obviously, broken bus can't be in the list of nearby buses.
+    overlap_data = time_overlap(data, URID, index = win_index, exclude_run = URID.Run)
 
     #store list of rides that are sufficiently nearby URID's location
-    okBuses = []
-    for k in range(len(overlap_LAT)):
-        point = (round(overlap_LAT[k],6), round(overlap_LON[k],6))
-        dist = haversine.haversine(point, URID_loc, miles=True)
-        if(dist < radius):
-            okBuses.append(overlap_data.Run.iloc[k])
+    return index.nearest_runs(URID_loc, radius, rows = overlap_data['all_nodes'], max_runs = 30)
 
-        ret = list(set(okBuses))
 
-    if len(ret) > 30:
-        radius -= 1
-        ret = radius_Elimination(data, URID, radius)
-
-    return ret
-
-
-def get_busRuns(data, Run, URID):
+def get_busRuns(data, Run, URID, store = None):
 
     """
     Return specific bus run from dataframe of full day's schedule.
@@ -438,11 +375,15 @@ def get_busRuns(data, Run, URID):
         data (dataframe): full day's schedule with time windows
         Run (str): particular bus run number (can be alphanumeric)
         URID (object): instance of URID class
+        store (object): default None, schedStore.ScheduleStore of data; looks the run up instead of scanning the day
 
     Returns:
         dataframe for specific bus run from day's schedule
     """
 
+    if store is not None:
+        return store.bus_run(Run, URID)
+
     # leave garage (beginning of route index), gas (end of route index)
     # get all rides between/including leave garage and gas indices.
     dataSub = data[(data["Run"] == Run)]# & (data['ETA'] >= resched_init_time)]
@@ -467,7 +408,7 @@ def get_busRuns(data, Run, URID):
     return busRun
 
 
-def osrm (URID_location, inbound, outbound):
+def osrm (URID_location, inbound, outbound, workers = None):
 
     """
 
@@ -475,43 +416,114 @@ def osrm (URID_location, inbound, outbound):
         URID_location (list): lat/lon for URID locations both inbound and outbound
         inbound (array): stores inbound node lats and lons
         outbound (array): stores outbound node lats and lons
+        workers (int): number of route requests in flight at once. default None uses the router's
+            workers setting, 1 routes one pair after the other.
 
     Returns:
-        array of total travel times for URID between nodes
+        array of total travel times for URID between nodes, in the order of outbound
     """
 
     total_times = []
-    out_start_points = []
-    out_end_points = []
-    in_total_time = []
-    in_start_points = []
-    in_end_points = []
-    osrm_url = "http://router.project-osrm.org/route/v1/driving/"
+    router = routing.get_router()
     urid_LAT = round(URID_location[0],6)
     urid_LON = round(URID_location[1],6)
+    cache = routing.get_cache() if router.cacheable else None
+    if workers is None:
+        workers = getattr(router, 'workers', 1)
 
-    # outbound
+    #both legs (outbound -> URID, URID -> inbound) of each triple
+    all_legs = []
     for k in range(outbound.shape[0]):
-        lat_cord_O = outbound[k, 0]
-        lon_cord_O = outbound[k, 1]
-        lat_cord_I = inbound[k, 0]
-        lon_cord_I = inbound[k, 1]
-
-        route_url = osrm_url + str(round(lon_cord_O,6)) + "," + str(round(lat_cord_O,6)) + ";" + str(round(urid_LON,6)) + "," + str(round(urid_LAT, 6)) + ";" + str(round(lon_cord_I,6)) + "," + str(round(lat_cord_I,6)) + "?overview=false"
-        route_requests = requests.get(route_url)
-        print route_url
-        route_results = route_requests.json()
-        if not route_results:
+        all_legs.append([(routing.coord_key(outbound[k, 0], outbound[k, 1]), (urid_LAT, urid_LON)),
+                         ((urid_LAT, urid_LON), routing.coord_key(inbound[k, 0], inbound[k, 1]))])
+
+    #triples with both legs already routed don't need a request
+    cached = {}
+    if cache is not None:
+        cached = cache.get_many([leg for legs in all_legs for leg in legs])
+    to_route = [k for k in range(len(all_legs)) if not all([leg in cached for leg in all_legs[k]])]
+
+    def route_triple(k):
+        legs = all_legs[k]
+        try:
+            return router.route([legs[0][0], legs[0][1], legs[1][1]])
+        except requests.exceptions.RequestException as e:
+            print("ROUTE REQUEST FAILED FOR INDEX {0}: {1}".format(k, e))
+            return {}
+
+    #route requests share the router's keep-alive session; map keeps the original order
+    if (workers > 1) and (len(to_route) > 1):
+        pool = ThreadPool(min(workers, len(to_route)))
+        try:
+            routed = dict(zip(to_route, pool.map(route_triple, to_route)))
+        finally:
+            pool.close()
+    else:
+        routed = dict([(k, route_triple(k)) for k in to_route])
+
+    new_legs = []
+    for k in range(len(all_legs)):
+        legs = all_legs[k]
+        if k not in routed:
+            total_times += [cached[legs[0]][0] + cached[legs[1]][0]]
+            continue
+
+        route_results = routed[k]
+        if not route_results or not route_results.get('routes'):
             print("FOUND NO ROUTE FROM INDEX {0} to URID location".format((outbound[k,0], outbound[k,1])))
             total_times += [50000000000]
         else:
             total_times += [route_results['routes'][0]['duration']]
+            route_legs = route_results['routes'][0]['legs']
+            new_legs += [(legs[j][0], legs[j][1], route_legs[j]['duration'], route_legs[j]['distance']) for j in range(2)]
+
+    if cache is not None:
+        cache.put_many(new_legs)
 
     a = np.array([total_times])
 
     return(a.T)
 
-def original_lateness(Run_Schedule, comeback1):
+def window_bounds(Run_Schedule):
+
+    """
+
+    Args:
+        Run_Schedule (dataframe): schedule for run, contains time windows
+
+    Returns:
+        (eta, bound, active) arrays for the rows of Run_Schedule: ETA, latest on-time arrival
+        max(PickupEnd, DropoffEnd), and whether the row is a pick up or drop off (Activity 0 or 1)
+    """
+
+    eta = np.array(Run_Schedule.ETA, dtype = float)
+    bound = np.maximum(np.array(Run_Schedule.PickupEnd, dtype = float), np.array(Run_Schedule.DropoffEnd, dtype = float))
+    activity = np.array(Run_Schedule.Activity, dtype = float)
+    return eta, bound, (activity == 0) | (activity == 1)
+
+
+def late_scores(eta, bound, active, lag):
+
+    """
+
+    Args:
+        eta/bound/active (array): rows of a run, as returned by window_bounds
+        lag (float): seconds added to every ETA
+
+    Returns:
+        (break_TW, late) arrays: 1 where the lagged ETA breaks the time window, 0 otherwise, and by
+        how many seconds. Rows that aren't pick ups or drop offs are never late.
+    """
+
+    eta_future = eta + lag
+    #0 indicates TW not broken, 1 otherwise.
+    break_TW = (active & (eta_future > bound)).astype(float)
+    #if time window is broken, by how much?
+    late = np.where(active, np.maximum(0, eta_future - bound), 0.)
+    return break_TW, late
+
+
+def original_lateness(Run_Schedule, comeback1, bounds = None):
 
     """
 
@@ -520,52 +532,82 @@ def original_lateness(Run_Schedule, comeback1):
 
         comeback1 (int): row index in Run_Schedule corresponding to the dropoff index at which we
                      should start counting late rides
+        bounds (tuple): default None, window_bounds(Run_Schedule) if already computed
 
     Returns:
         dictionary of late windows and their associated total lateness
     """
 
-    bw_ctr = 0
-    lateness_ctr = 0
-    for k in range(comeback1, (Run_Schedule.index.max()+1)):
-        if (Run_Schedule.Activity.loc[k] in [0,1]):
-            bound = max(Run_Schedule.PickupEnd.loc[k], Run_Schedule.DropoffEnd.loc[k])
-            eta = Run_Schedule.ETA.loc[k]
-            #0 indicates TW not broken, 1 otherwise.
-            bw_ctr += int(eta > bound)
-            #if time window is broken, by how much?
-            lateness_ctr += max(0, eta - bound)
+    eta, bound, active = window_bounds(Run_Schedule) if bounds is None else bounds
+    start = Run_Schedule.index.get_loc(comeback1)
+    break_TW, late = late_scores(eta[start:], bound[start:], active[start:], 0)
+
+    return({'late_windows':int(np.sum(break_TW)), 'total_lateness':np.sum(late)})
+
+
+def feasibility_legs(Run_Schedule, URID, table, win_index = None):
+
+    """
+    Queue on table every leg insertFeasibility may route for this run, so that several
+    candidate runs can be resolved with one OSRM table request.
+
+    Args:
+        Run_Schedule (dataframe): schedule for run, contains time windows
+        URID (object): instance of URID class
+        table (object): instance of routing.OSRMTable
+        win_index (object): default None, window_index.WindowIndex of the day's schedule
+
+    Returns:
+        None
+    """
+
+    for pudo, coords in [(True, URID.PickUpCoords), (False, URID.DropOffCoords)]:
+        inserts = time_overlap(Run_Schedule, URID, pudo = pudo, index = win_index)
+        outbound = Run_Schedule.loc[inserts["outbound"]]
+        outbound = np.column_stack((np.array(outbound.LAT), np.array(outbound.LON)))
+        inbound = Run_Schedule.loc[filter(lambda x: x in Run_Schedule.index, inserts["inbound"])]
+        inbound = np.column_stack((np.array(inbound.LAT), np.array(inbound.LON)))
+        table.add([round(coords[0],6), round(coords[1],6)], inbound, outbound)
 
-    return({'late_windows':bw_ctr, 'total_lateness':lateness_ctr})
+    return None
 
 
-def insertFeasibility(Run_Schedule, URID):
+def insertFeasibility(Run_Schedule, URID, table = None, win_index = None):
 
     """
 
     Args:
         Run_Schedule (dataframe): schedule for run, contains time windows
         URID (object): instance of URID class
+        table (object): instance of routing.OSRMTable, possibly already holding this run's legs.
+            default None, make a new table for this run only.
+        win_index (object): default None, window_index.WindowIndex of the day's schedule
 
     Returns:
-        dictionary. Largest component of dictionary is 'score,' a pd.df with 'break_TW' (binary variable
+        dictionary. Largest component of dictionary is 'score,' a record array with 'break_TW' (binary variable
         indicating whether future stop will be late), 'late' (integer indicating how late bus will be to stop),
-        and 'node' (the index, of the node within the Run_Schedule)
+        and 'nodes' (the index, of the node within the Run_Schedule)
         Also return 'total_lag', the total number of seconds by which the bus is currently late.
         Also return 'pickup_insert' and 'dropoff_insert', i.e. indices of the best insertion point of URID on to Run_Schedule.
     """
 
+    #get pick up and drop off legs from one table request
+    if table is None:
+        table = routing.OSRMTable()
+    feasibility_legs(Run_Schedule, URID, table, win_index)
+    table.fetch()
+
     # FEASIBILITY OF PICK UP:
 
     #location from where we'll pick up given URID.
     uridLoc = [round(URID.PickUpCoords[0],6), round(URID.PickUpCoords[1],6)]
-    pickup_inserts = time_overlap(Run_Schedule, URID)
+    pickup_inserts = time_overlap(Run_Schedule, URID, index = win_index)
     outbound = Run_Schedule.loc[pickup_inserts["outbound"]]
     outbound = np.column_stack((np.array(outbound.LAT), np.array(outbound.LON)))
     inbound = Run_Schedule.loc[pickup_inserts["inbound"]]
     inbound = np.column_stack((np.array(inbound.LAT), np.array(inbound.LON)))
 
-    time_matrix_pickup = osrm(uridLoc, inbound, outbound)
+    time_matrix_pickup = table.round_trips(uridLoc, inbound, outbound)
 
     #start picking best pickup insertion:
     rt_times = sorted(enumerate(time_matrix_pickup), key=operator.itemgetter(1)) #use itemgetter(1) because (0) is index from enumerator!
@@ -579,7 +621,6 @@ def insertFeasibility(Run_Schedule, URID):
 
     #get total lag time, see if next time window is broken:
     newETA = Run_Schedule.ETA.loc[leave1] + dwell + best_rt_time_1
-    bound = max(Run_Schedule.PickupEnd.loc[comeback1], Run_Schedule.DropoffEnd.loc[comeback1])
 
     #if there's technically speedup, then no penalty for picking URID up.
     lag1 = newETA - Run_Schedule.ETA.loc[comeback1]
@@ -587,28 +628,15 @@ def insertFeasibility(Run_Schedule, URID):
         lag1 = 0
 
     #count number of broken time windows for rest of trip:
-    #to be able to count broken windows, amt by which they're broken,
-    #insert_score will contain (0) TW broken yes/no; (1) amount by which window broken
-    pickup_score = np.zeros(((Run_Schedule.index.max() - comeback1 + 1),2))
-    row_ctr = 0
-    for k in range(comeback1,(Run_Schedule.index.max()+1)):
-        if (Run_Schedule.Activity.loc[k] not in [0,1]):
-            row_ctr += 1
-        else:
-            bound = max(Run_Schedule.PickupEnd.loc[k], Run_Schedule.DropoffEnd.loc[k])
-            eta_future = Run_Schedule.ETA.loc[k] + lag1
-            #0 indicates TW not broken, 1 otherwise.
-            pickup_score[row_ctr, 0] = int(eta_future > bound)
-            #if time window is broken, by how much?
-            pickup_score[row_ctr, 1] = max(0, eta_future - bound)
-            #print(pickup_score[row_ctr,:])
-            row_ctr+=1
+    #to be able to count broken windows, amt by which they're broken
+    bounds = window_bounds(Run_Schedule)
+    eta, bound, active = bounds
+    start1 = Run_Schedule.index.get_loc(comeback1)
+    pickup_break, pickup_late = late_scores(eta[start1:], bound[start1:], active[start1:], lag1)
 
     #FEASIBILITY OF DROPOFF:
-    Run_Schedule_Lag = Run_Schedule.copy()
-    ETAlag = Run_Schedule.ETA + lag1
-    Run_Schedule_Lag.ETA = ETAlag
-    dropoff_inserts = time_overlap(Run_Schedule_Lag, URID, pudo = False)
+    #the schedule after picking up is the same, with every ETA lag1 later
+    dropoff_inserts = time_overlap(Run_Schedule, URID, pudo = False, index = win_index)
     dropoff_all_nodes = filter(lambda x: x >= comeback1, dropoff_inserts["all_nodes"])
     dropoff_outbound = filter(lambda x: x >= comeback1, dropoff_inserts["outbound"])
     # can't return to first outbound node:
@@ -624,19 +652,19 @@ def insertFeasibility(Run_Schedule, URID):
         dropoff_inbound.pop(0)
 
     #nodes from which we depart original schedule to drop URID off, and then return to og schedule
-    outbound = Run_Schedule_Lag.loc[dropoff_outbound]
+    outbound = Run_Schedule.loc[dropoff_outbound]
     outbound = np.column_stack((np.array(outbound.LAT), np.array(outbound.LON)))
     try:
-        inbound = Run_Schedule_Lag.loc[dropoff_inbound]
+        inbound = Run_Schedule.loc[dropoff_inbound]
     except KeyError:
-        print(Run_Schedule_Lag)
+        print(Run_Schedule)
         quit()
 
     inbound = np.column_stack((np.array(inbound.LAT), np.array(inbound.LON)))
 
     uridLoc = [round(URID.DropOffCoords[0],6), round(URID.DropOffCoords[1],6)]
     #second iteration of distance matrix, for drop off routing:
-    time_matrix_dropoff = osrm(uridLoc, inbound, outbound)
+    time_matrix_dropoff = table.round_trips(uridLoc, inbound, outbound)
 
     #start picking best pickup insertion:
     rt_times = sorted(enumerate(np.sum(time_matrix_dropoff, 1)), key=operator.itemgetter(1)) #use itemgetter(1) because (0) is index from enumerator!
@@ -648,37 +676,25 @@ def insertFeasibility(Run_Schedule, URID):
     comeback2 = dropoff_inbound[rt_times[0][0]] #come back to this scheduled node
 
     #get total lag time, see if next time window is broken:
-    newETA = Run_Schedule_Lag.ETA.loc[leave2] + dwell + best_rt_time_2
-    bound = max(Run_Schedule_Lag.PickupEnd.loc[comeback2], Run_Schedule_Lag.DropoffEnd.loc[comeback2])
+    newETA = Run_Schedule.ETA.loc[leave2] + lag1 + dwell + best_rt_time_2
     #total lag: lag from pickup, and then difference between lagged eta and eta for coming back from pickup
     total_lag = newETA - Run_Schedule.ETA.loc[comeback2]
     if total_lag < 0:
         total_lag = 0
 
     #count number of broken time windows from dropping off URID:
-    dropoff_score = np.zeros(((Run_Schedule_Lag.index.max() - comeback2 + 1),2))
-    row_ctr = 0
-    for k in range(comeback2,(Run_Schedule_Lag.index.max()+1)):
-        if (Run_Schedule.Activity.loc[k] not in [0,1]):
-            row_ctr += 1
-        else:
-            bound = max(Run_Schedule.PickupEnd.loc[k], Run_Schedule.DropoffEnd.loc[k])
-            eta_future = Run_Schedule.ETA.loc[k] + total_lag
-            #0 indicates TW not broken, 1 otherwise.
-            dropoff_score[row_ctr, 0] = int(eta_future > bound)
-            #if time window is broken, by how much?
-            dropoff_score[row_ctr, 1] = max(0, eta_future - bound)
-            row_ctr+=1
+    start2 = Run_Schedule.index.get_loc(comeback2)
+    dropoff_break, dropoff_late = late_scores(eta[start2:], bound[start2:], active[start2:], total_lag)
 
     #assemble output:
-    original = original_lateness(Run_Schedule, comeback1)
+    original = original_lateness(Run_Schedule, comeback1, bounds)
     og_break_TW = original['late_windows']
     og_total_lag = original['total_lateness']
 
-    pickup_df = pd.DataFrame({"nodes": range(comeback1,Run_Schedule.index.max()+1), "break_TW": pickup_score[:,0], "late": pickup_score[:,1]})
-    dropoff_df = pd.DataFrame({"nodes": range(comeback2,Run_Schedule.index.max()+1), "break_TW": dropoff_score[:,0], "late": dropoff_score[:,1]})
-    test = pickup_df[(pickup_df['nodes'] >= comeback1) & (pickup_df['nodes'] < comeback2)]
-    score = test.append(dropoff_df)
+    #rows between the pick up and drop off carry the pick up lag, rows after the drop off the total lag
+    score = np.rec.fromarrays([np.r_[pickup_break[:start2 - start1], dropoff_break],
+                               np.r_[pickup_late[:start2 - start1], dropoff_late],
+                               np.array(Run_Schedule.index[start1:])], names = 'break_TW,late,nodes')
 
     new_broken_TW = np.sum(score['break_TW']) - og_break_TW
 
@@ -691,6 +707,96 @@ def insertFeasibility(Run_Schedule, URID):
     return(ret)
 
 
+def insertPairs(Run_Schedule, URID, table = None, win_index = None, k = 1, slack_index = None):
+
+    """
+    Joint version of insertFeasibility: instead of fixing the cheapest pick up detour and then
+    looking for a drop off after it, every (pick up slot, drop off slot) pair on the run is scored
+    at once from the same table of travel times, and the best k are returned.
+
+    Args:
+        Run_Schedule (dataframe): schedule for run, contains time windows
+        URID (object): instance of URID class
+        table (object): instance of routing.OSRMTable, possibly already holding this run's legs.
+            default None, make a new table for this run only.
+        win_index (object): default None, window_index.WindowIndex of the day's schedule
+        k (int): default 1, number of insertions to return
+        slack_index (object): default None, slack_index.SlackIndex to take the run's forward slack from
+
+    Returns:
+        list of up to k dictionaries like insertFeasibility's, ordered by 'additional_time' and then
+        'additional_broken_windows'. Empty list if the URID can't be picked up and dropped off on this run.
+    """
+
+    if table is None:
+        table = routing.OSRMTable()
+    feasibility_legs(Run_Schedule, URID, table, win_index)
+    table.fetch()
+
+    dwell = 500
+    index = Run_Schedule.index
+    bounds = window_bounds(Run_Schedule)
+    eta, bound, active = bounds
+    slack = slckIdx.RunSlack(*bounds) if slack_index is None else slack_index.get(Run_Schedule, bounds)
+
+    #candidate slots: leave node outbound[j], come back to node inbound[j]
+    slots = []
+    for pudo, coords in [(True, URID.PickUpCoords), (False, URID.DropOffCoords)]:
+        inserts = time_overlap(Run_Schedule, URID, pudo = pudo, index = win_index)
+        n_slots = min(len(inserts["outbound"]), len(inserts["inbound"]))
+        leave = np.array(inserts["outbound"][:n_slots], dtype = int)
+        comeback = np.array(inserts["inbound"][:n_slots], dtype = int)
+        #positions within the run, slots leaving or returning outside of it can't be used
+        leave_pos, comeback_pos = index.get_indexer(leave), index.get_indexer(comeback)
+        ok = (leave_pos >= 0) & (comeback_pos > leave_pos)
+        leave, comeback, leave_pos, comeback_pos = leave[ok], comeback[ok], leave_pos[ok], comeback_pos[ok]
+        rt = np.zeros(0)
+        if leave.shape[0]:
+            outbound = Run_Schedule.iloc[leave_pos]
+            inbound = Run_Schedule.iloc[comeback_pos]
+            uridLoc = [round(coords[0],6), round(coords[1],6)]
+            rt = table.round_trips(uridLoc, np.column_stack((np.array(inbound.LAT), np.array(inbound.LON))),
+                                   np.column_stack((np.array(outbound.LAT), np.array(outbound.LON))))[:, 0]
+        slots.append((leave, comeback, leave_pos, comeback_pos, rt))
+
+    (leave1, comeback1, l1, c1, rt1), (leave2, comeback2, l2, c2, rt2) = slots
+    if (rt1.shape[0] == 0) or (rt2.shape[0] == 0):
+        return []
+
+    #lag after picking up, for each pick up slot, and after dropping off, for each pair
+    lag1 = np.maximum(0, eta[l1] + dwell + rt1 - eta[c1])
+    total_lag = np.maximum(0, eta[l2][None, :] + lag1[:, None] + dwell + rt2[None, :] - eta[c2][None, :])
+    additional_time = rt1[:, None] + rt2[None, :] + 1000
+    #drop off has to leave from the node the pick up comes back to, or a later one
+    valid = l2[None, :] >= c1[:, None]
+    if not valid.any():
+        return []
+
+    #broken windows: rows between the pick up and drop off are lag1 late, rows after the drop off total_lag late
+    C1, C2 = np.meshgrid(c1, c2, indexing = 'ij')
+    LAG1 = np.repeat(lag1[:, None], len(c2), 1)
+    mid = slack.broken(C1, LAG1) - slack.broken(C2, LAG1)
+    additional_broken = mid + slack.broken(C2, total_lag) - slack.broken(C1, 0)
+
+    #best pairs: least additional time, then fewest new broken windows
+    p_all, d_all = np.where(valid)
+    order = np.lexsort((additional_broken[p_all, d_all], additional_time[p_all, d_all]))[:k]
+
+    ret = []
+    for p, d in zip(p_all[order], d_all[order]):
+        pickup_break, pickup_late = late_scores(eta[c1[p]:c2[d]], bound[c1[p]:c2[d]], active[c1[p]:c2[d]], lag1[p])
+        dropoff_break, dropoff_late = late_scores(eta[c2[d]:], bound[c2[d]:], active[c2[d]:], total_lag[p, d])
+        score = np.rec.fromarrays([np.r_[pickup_break, dropoff_break], np.r_[pickup_late, dropoff_late],
+                                   np.array(index[c1[p]:])], names = 'break_TW,late,nodes')
+        ret.append({"score": score, "pickup_insert":(leave1[p], comeback1[p]), "dropoff_insert":(leave2[d], comeback2[d]),
+                    'RunID' : Run_Schedule.Run.iloc[0], 'pickup_lag' : np.array([lag1[p]]) if lag1[p] > 0 else 0,
+                    'additional_broken_windows': additional_broken[p, d],
+                    'additional_time': np.array([additional_time[p, d]]),
+                    'minRunIndex' : index[0]})
+
+    return(ret)
+
+
 def mileage (lat1, lon1, lat2, lon2):
 
     """
@@ -740,11 +846,16 @@ def getOSRMOutput (lat1, lon1, lat2, lon2):
         json object containing data about traveling between two pairs
     """
 
-    osrm_url = "http://router.project-osrm.org/route/v1/driving/"
-    route_url = osrm_url + str(lon1) + "," + str(lat1)
-    route_url = route_url + ";" + str(lon2) + "," + str(lat2) + "?overview=false"
-    route_requests = requests.get(route_url)
-    route_results = route_requests.json()
+    router = routing.get_router()
+    cache = routing.get_cache() if router.cacheable else None
+    if cache is not None:
+        cached = cache.get((lat1, lon1), (lat2, lon2), need_distance = True)
+        if cached is not None:
+            return {u'code': u'Ok', u'routes': [{u'duration': cached[0], u'distance': cached[1]}]}
+
+    route_results = router.route([(lat1, lon1), (lat2, lon2)])
+    if (cache is not None) and route_results.get('routes'):
+        cache.put((lat1, lon1), (lat2, lon2), route_results['routes'][0]['duration'], route_results['routes'][0]['distance'])
     return route_results
 
 def taxi(URID):
@@ -873,48 +984,60 @@ def preferred_options(URID_list, best_bus, delay_costs, taxi_costs, new_run_cost
     return(pd.DataFrame(np.array([bId, pref]).T, columns = ['BookingId', 'Lowest Cost Option']))
 
 
-def day_schedule_Update(data, top_Feasibility, URID):
+def day_schedule_Update(data, top_Feasibility, URID, inplace = False, log = None):
 
     """
 
     Args:
-        data (dataframe): current schedule for all day's operations
+        data (dataframe): current schedule for all day's operations, one row per position (RangeIndex)
         top_Feasibility (dict): insertion of URID on to bus resulting in min. lag.
         should be [0] element of ordered_inserts
+        inplace (bool): default False, rearrange data itself instead of a copy of it. The URID's two
+        rows are taken out and put back in on the new run (rows in between shift by one or two
+        positions), and only the new run's ETAs are shifted.
+        log (object): default None, schedStore.ScheduleLog to record the URID's rows and the ETAs
+        shifted so they can be rolled back, use with inplace
 
     Returns:
         dataframe that is updated (re-arranged) schedule with URID properly
         put on to new bus from old bus
     """
 
-    tmp = data.copy()
-    my_rows = tmp[tmp['BookingId']==URID.BookingId]
-    #make sure we change the RunID of the URID when placed on new bus!
-    tmp.ix[my_rows.index[:], 'Run'] = top_Feasibility['RunID']
+    if not inplace:
+        data = data.copy()
 
-    pickup_old = my_rows.index[0]
-    dropoff_old = my_rows.index[1]
+    run = top_Feasibility['RunID']
+    pickup_old, dropoff_old = np.flatnonzero(np.asarray(data['BookingId']) == URID.BookingId)[:2]
     pickup_new = top_Feasibility['pickup_insert'][1] #THIS IS OVERWRITING NEXT NODE
     dropoff_new = top_Feasibility['dropoff_insert'][1] #THIS WILL OVERWRITE NEXT NODE
 
-    ind = tmp.index.tolist()
-    ind.pop(pickup_old)
-    ind.pop(dropoff_old-1)
-    ind.insert(ind.index(pickup_new), pickup_old)
-    ind.insert(ind.index(dropoff_new), dropoff_old)
+    #the URID's rows go in front of pickup_new and dropoff_new, positions once they are taken out
+    rows = [pickup_old, dropoff_old]
+    shifted = lambda position: position - (position > pickup_old) - (position > dropoff_old)
+    targets = [shifted(pickup_new), shifted(dropoff_new) + 1]
+    moved = data.iloc[rows].copy() if log is not None else None
+    old_run = data['Run'].iloc[pickup_old]
 
     #move the URID into correct position in schedule
-    new_data = tmp.reindex(ind)
+    schedStore.move_rows(data, rows, targets)
 
-    #update the inserted bus's ETAs!
-    run_inserted = new_data[new_data['Run'] == top_Feasibility['RunID']]
-    run_inserted.ix[pickup_new:dropoff_new, 'ETA'] += top_Feasibility['pickup_lag']
-    run_inserted.ix[dropoff_new:, 'ETA']  += top_Feasibility['additional_time']
-    new_data.ix[run_inserted.index, 'ETA'] =  run_inserted.ix[:, 'ETA']
-
-    new_data.index = range(0, new_data.shape[0])
-
-    return new_data
+    #make sure we change the RunID of the URID when placed on new bus!
+    data.iloc[targets, data.columns.get_loc('Run')] = run
+
+    #update the inserted bus's ETAs! from pickup_new's node to the end of the run
+    runs = np.asarray(data['Run'])
+    first, last = targets[0] + 1 + (pickup_new == dropoff_new), targets[1] + 1
+    stop = last
+    while (stop < runs.shape[0]) and (runs[stop] == run):
+        stop += 1
+    eta = np.array(data['ETA'].iloc[first:stop], dtype = float)
+    if log is not None:
+        log.record(rows, moved, targets, first, stop, data['ETA'].values[first:stop].copy(), (old_run, run))
+    eta[:last - first + 1] += top_Feasibility['pickup_lag']
+    eta[last - first:] += top_Feasibility['additional_time']
+    data.iloc[first:stop, data.columns.get_loc('ETA')] = eta
+
+    return data
 
 
 def newBusRun_cost(busRun, provider):
@@ -1,4 +1,357 @@
+import copy
+from multiprocessing import Pool
 import all_functions as af
+import routing
+import spatial_index as spIdx
+import window_index as winIdx
+import slack_index as slckIdx
+import schedule_store as schedStore
+import schedule_cache as schedCache
+import streaming_schedule as streamSched
+
+
+#state the worker processes of busReschedule_run read after forking, so the day's schedule,
+#candidate runs and travel time table are shared with them without pickling
+_shared = {}
+
+def _insertions(runSchedule, URID, table, win_idx, slack_idx = None):
+
+    """
+    Args:
+        runSchedule (dataframe): schedule for the run, from all_functions.get_busRuns
+        URID (object): instance of URID class
+        table (object): instance of routing.OSRMTable
+        win_idx (object): window_index.WindowIndex of the day's schedule
+        slack_idx (object): default None, slack_index.SlackIndex of the day's schedule
+
+    Returns:
+        list of best insertions of the URID on the run: all_functions.insertPairs, or with
+        busReschedule_run(joint = False) the greedy all_functions.insertFeasibility (empty if infeasible)
+    """
+
+    if _shared.get('joint', True):
+        return af.insertPairs(runSchedule, URID, table = table, win_index = win_idx, slack_index = slack_idx)
+    insert = af.insertFeasibility(runSchedule, URID, table = table, win_index = win_idx)
+    return [insert] if insert else []
+
+
+def _evaluate_run(k):
+
+    """
+    Args:
+        k (int): position in _shared['to_route'] of the (run, runSchedule, URID) to evaluate
+
+    Returns:
+        list of best insertions of the URID on that run, from _insertions
+    """
+
+    run, runSchedule, run_URID = _shared['to_route'][k]
+    print('Testing feasibility for run ' + run)
+    inserts = _insertions(runSchedule, run_URID, _shared['table'], _shared['win_idx'], _shared['slack_idx'])
+    #pool workers exit without flushing their output
+    af.sys.stdout.flush()
+    return inserts
+
+
+def _map_runs(to_route, table, win_idx, workers = None, slack_idx = None):
+
+    """
+    Args:
+        to_route (list): (run, runSchedule, URID) tuples whose legs are already fetched into table
+        table (object): instance of routing.OSRMTable
+        win_idx (object): window_index.WindowIndex of the day's schedule
+        workers (int): default None, number of worker processes, None (or no fork) evaluates in this process
+        slack_idx (object): default None, slack_index.SlackIndex of the day's schedule
+
+    Returns:
+        list of _insertions results, in the same order as to_route
+    """
+
+    _shared.update(to_route = to_route, table = table, win_idx = win_idx, slack_idx = slack_idx)
+    if (workers is not None) and (workers > 1) and (len(to_route) > 1) and hasattr(af.os, 'fork'):
+        #build missing run slacks before forking, so workers share them and the next URID can reuse them
+        if slack_idx is not None:
+            for run, runSchedule, run_URID in to_route:
+                slack_idx.get(runSchedule, af.window_bounds(runSchedule))
+        #workers open their own connection to the travel time cache, the parent's isn't carried over
+        if routing.get_cache() is not None:
+            routing.get_cache().close()
+        pool = Pool(min(workers, len(to_route)))
+        try:
+            return pool.map(_evaluate_run, range(len(to_route)))
+        finally:
+            pool.close()
+            pool.join()
+    return map(_evaluate_run, range(len(to_route)))
+
+
+#no bus averages more than this in a straight line (m/s, about 78 mph), so straight-line travel
+#times at this speed are a lower bound on routed ones
+BOUND_SPEED = 35.
+
+#candidate runs seen, routed and skipped by _prune over the last busReschedule_run
+pruning = {'runs': 0, 'routed': 0, 'pruned': 0}
+
+def _prune(to_route, table, win_idx, keep, workers = None, slack_idx = None):
+
+    """
+    Branch and bound over one URID's candidate runs. A lower bound on each run's additional_time
+    comes from straight-line travel at BOUND_SPEED; runs are routed best bound first, keep at a
+    time, and a run is skipped once its bound is above the keep-th best additional_time routed so
+    far. The keep best insertions are the same as routing every run.
+
+    The bound is the joint all_functions.insertPairs on straight-line times whatever joint is: which
+    pairs are valid doesn't depend on travel times, so its minimum detour is below the routed one of
+    any pair, the greedy insertFeasibility's included. The greedy choice itself isn't (its pick up
+    slot, and so the drop offs it tries, can change with the travel times), so it can't bound.
+
+    Args:
+        to_route (list): (run, runSchedule, URID) tuples for one URID
+        table (object): instance of routing.OSRMTable
+        win_idx (object): window_index.WindowIndex of the day's schedule
+        keep (int): number of best runs that must come out exact
+        workers (int): default None, number of worker processes, see _map_runs
+        slack_idx (object): default None, slack_index.SlackIndex of the day's schedule
+
+    Returns:
+        list of _insertions results in to_route order, None for runs that were skipped
+    """
+
+    bound_table = routing.OSRMTable(router = routing.HaversineRouter(detour = 1., speed = BOUND_SPEED))
+    bounds = []
+    for k in range(len(to_route)):
+        bound = af.insertPairs(to_route[k][1], to_route[k][2], table = bound_table, win_index = win_idx, slack_index = slack_idx)
+        #no feasible pair whatever the travel times
+        if bound:
+            bounds.append((float(bound[0]['additional_time'][0]), k))
+    bounds.sort()
+
+    run_inserts = [None]*len(to_route)
+    times = []
+    pos = 0
+    while pos < len(bounds):
+        kth_best = sorted(times)[keep - 1] if len(times) >= keep else af.np.inf
+        batch = []
+        while (pos < len(bounds)) and (len(batch) < keep) and (bounds[pos][0] <= kth_best):
+            batch.append(bounds[pos][1])
+            pos += 1
+        if not batch:
+            break
+        for k in batch:
+            af.feasibility_legs(to_route[k][1], to_route[k][2], table, win_idx)
+        table.fetch()
+        for k, inserts in zip(batch, _map_runs([to_route[k] for k in batch], table, win_idx, workers, slack_idx)):
+            run_inserts[k] = inserts
+            if inserts:
+                times.append(float(inserts[0]['additional_time'][0]))
+
+    pruning['runs'] += len(to_route)
+    pruning['routed'] += pos
+    pruning['pruned'] += len(to_route) - pos
+    return run_inserts
+
+
+def _screen(to_route, estimator, win_idx, finalists, slack_idx = None):
+
+    """
+    Args:
+        to_route (list): (run, runSchedule, URID) tuples for one URID
+        estimator (object): offline router, e.g. routing.HaversineRouter
+        win_idx (object): window_index.WindowIndex of the day's schedule
+        finalists (int): number of runs to keep
+        slack_idx (object): default None, slack_index.SlackIndex of the day's schedule
+
+    Returns:
+        the finalists entries of to_route with the least estimated additional time, in their original order
+    """
+
+    if (finalists is None) or (len(to_route) <= finalists):
+        return to_route
+    screen_table = routing.OSRMTable(router = estimator)
+    estimates = []
+    for k in range(len(to_route)):
+        estimate = _insertions(to_route[k][1], to_route[k][2], screen_table, win_idx, slack_idx)
+        estimates.append((float(estimate[0]['additional_time']) if estimate else af.np.inf, k))
+    keep = sorted([k for est, k in sorted(estimates)[:finalists]])
+    return [to_route[k] for k in keep]
+
+
+def _candidate(store, URID, run):
+
+    """
+    Capacity check of one run for a URID, leaving the URID itself untouched.
+
+    Args:
+        store (object): schedule_store.ScheduleStore of the day's schedule with time windows and capacity
+        URID (object): instance of URID class
+        run (str): candidate run
+
+    Returns:
+        (run, runSchedule, URID copy with the insert windows) if there is room on the run, else None
+    """
+
+    run_URID = copy.copy(URID)
+    capacity_obj = af.checkCap.CapacityInsertPts(store.run(run))
+    run_URID.PickupInsert, run_URID.DropoffInsert = capacity_obj.return_inserts(run_URID)
+    if af.np.isnan(run_URID.PickupInsert):
+        return None
+    run_URID.PickupStart = run_URID.PickupInsert
+    run_URID.DropoffStart = run_URID.DropoffInsert
+    return (run, store.bus_run(run), run_URID)
+
+
+def _rebase(insert, start):
+
+    """
+    Args:
+        insert (dict): _insertions result for a run that has since moved in the day's schedule
+        start (int): row index the run now starts at
+
+    Returns:
+        the same insertion with its row indices moved to where the run now is
+    """
+
+    shift = start - insert['minRunIndex']
+    if shift == 0:
+        return insert
+    moved = dict(insert)
+    moved['pickup_insert'] = tuple(x + shift for x in insert['pickup_insert'])
+    moved['dropoff_insert'] = tuple(x + shift for x in insert['dropoff_insert'])
+    moved['score'] = insert['score'].copy()
+    moved['score']['nodes'] += shift
+    moved['minRunIndex'] = start
+    return moved
+
+
+def _regret(options):
+
+    """
+    Args:
+        options (dict): run -> best insertion of a URID on that run
+
+    Returns:
+        (regret, best): additional time of the second best run minus the best one (inf with a single
+        run), and the best additional time. None if there are no options.
+    """
+
+    times = sorted(float(insert['additional_time'][0]) for insert in options.values())
+    if not times:
+        return None
+    return (times[1] - times[0] if len(times) > 1 else af.np.inf), times[0]
+
+
+def _batch_reschedule(fullSchedule_windows, URIDs, broken_run, radius, path_to_outdir,
+                      spatial_idx, win_idx, store, estimator = None, finalists = None, workers = None, slack_idx = None,
+                      log = None):
+
+    """
+    Batch insertion for busReschedule_run: every URID is evaluated on every candidate run once,
+    then URIDs are inserted in regret order (the URID that loses the most by missing its best run
+    goes first), and only the entries for the runs an insertion changed are evaluated again.
+
+    Args:
+        fullSchedule_windows (dataframe): day's schedule with time windows and capacity
+        URIDs (list): URID class instances to insert
+        broken_run (str): name of broken run, never offered as an insertion
+        radius (float): search radius in miles for radius_Elimination
+        path_to_outdir (str): directory output files are written to
+        spatial_idx/win_idx (object): spatial_index.SpatialIndex/window_index.WindowIndex of fullSchedule_windows
+        store (object): schedule_store.ScheduleStore of fullSchedule_windows
+        estimator (object): default None, offline router to screen runs with, see busReschedule_run finalists
+        finalists (int): default None, number of runs per URID to route exactly
+        workers (int): default None, number of worker processes to evaluate runs in
+        slack_idx (object): default None, slack_index.SlackIndex of fullSchedule_windows
+        log (object): default None, schedule_store.ScheduleLog to record the updates in, they are made in place
+
+    Returns:
+        (fullSchedule_windows, delay_costs, taxi_costs, best_buses): updated schedule and, for each URID
+        in URIDs order, the same costs and best run the one-at-a-time loop gives
+    """
+
+    n = len(URIDs)
+    delay_costs = [400000]*n
+    taxi_costs = [None]*n
+    best_buses = ['NA']*n
+    osrm_table = routing.OSRMTable()
+
+    def evaluate(pairs):
+        #best insertion for each (URID, run) pair with room on the run, one table request for all of them
+        by_urid = {}
+        for i, run in pairs:
+            entry = _candidate(store, URIDs[i], run)
+            if entry is not None:
+                by_urid.setdefault(i, []).append(entry)
+        keys, to_route = [], []
+        for i in sorted(by_urid):
+            for entry in _screen(by_urid[i], estimator, win_idx, finalists, slack_idx):
+                keys.append((i, entry[0]))
+                to_route.append(entry)
+        for run, runSchedule, run_URID in to_route:
+            af.feasibility_legs(runSchedule, run_URID, osrm_table, win_idx)
+        osrm_table.fetch()
+        for (i, run), inserts in zip(keys, _map_runs(to_route, osrm_table, win_idx, workers, slack_idx)):
+            if inserts and (inserts[0]['RunID'] != broken_run):
+                options[i][run] = inserts[0]
+
+    #cost table: options[i][run] is URID i's best insertion on run
+    options = [{} for i in range(n)]
+    runs_tocheck = [af.radius_Elimination(fullSchedule_windows, URIDs[i], radius=radius, index=spatial_idx, win_index=win_idx)
+                    for i in range(n)]
+    evaluate([(i, run) for i in range(n) for run in runs_tocheck[i]])
+
+    todo = range(n)
+    while todo:
+        #URID with the largest regret, ties to the cheapest and then the first one
+        ranked = sorted((-regret, best, i) for i, (regret, best) in
+                        [(i, _regret(options[i])) for i in todo if options[i]])
+        if not ranked:
+            break
+        i = ranked[0][2]
+        todo.remove(i)
+        print('Rescheduling URID {0}'.format(i))
+
+        #rows have moved since some options were evaluated
+        ordered_inserts = sorted([_rebase(options[i][run], store.positions(run)[0]) for run in runs_tocheck[i] if run in options[i]],
+                                 key = af.operator.itemgetter('additional_time'))
+
+        delay_costs[i] = ordered_inserts[0]['additional_time'][0]*(48.09/3600) #total dollars
+        best_buses[i] = ordered_inserts[0]['RunID']
+        taxi_costs[i] = af.taxi(URIDs[i])
+        af.write_insert_data(URIDs[i], ordered_inserts[0:3], path_to_outdir, taxi_costs[i])
+
+        #UPDATE whole day's schedule:
+        fullSchedule_windows = af.day_schedule_Update(data = fullSchedule_windows, top_Feasibility = ordered_inserts[0], URID = URIDs[i],
+                                                      inplace = log is not None, log = log)
+        changed = [URIDs[i].Run, ordered_inserts[0]['RunID']]
+        fullSchedule_windows = af.aTWC.TimeWindowsCapacity(fullSchedule_windows).update_Runs(changed)
+        spatial_idx = spIdx.SpatialIndex(fullSchedule_windows)
+        win_idx = winIdx.WindowIndex(fullSchedule_windows)
+        store = schedStore.ScheduleStore(fullSchedule_windows)
+        if slack_idx is not None:
+            slack_idx.update(changed)
+
+        #SAVE just the updated run for each URID
+        store.run(ordered_inserts[0]['RunID']).to_csv(af.os.path.join(path_to_outdir, str(str(int(URIDs[i].BookingId))+'_schedule.csv')), index = False)
+
+        #only the changed runs need evaluating again
+        pairs = []
+        for j in todo:
+            nearby = af.radius_Elimination(fullSchedule_windows, URIDs[j], radius=radius, index=spatial_idx, win_index=win_idx)
+            for run in changed:
+                options[j].pop(run, None)
+                if run in nearby:
+                    pairs.append((j, run))
+                    if run not in runs_tocheck[j]:
+                        runs_tocheck[j].append(run)
+        evaluate(pairs)
+
+    #no run could take these
+    for i in todo:
+        print('Rescheduling URID {0}'.format(i))
+        taxi_costs[i] = af.taxi(URIDs[i])
+        af.write_insert_data(URIDs[i], None, path_to_outdir, taxi_costs[i])
+
+    return fullSchedule_windows, delay_costs, taxi_costs, best_buses
 
 
 def busReschedule_run(schedule_filename,
@@ -9,7 +362,16 @@ def busReschedule_run(schedule_filename,
                       resched_init_time = None,
                       bookingid = None,
                       windows = 1800.,
-                      radius = 3.):
+                      radius = 3.,
+                      travel_cache = 'travel_times.sqlite',
+                      router = None,
+                      finalists = None,
+                      workers = None,
+                      batch = False,
+                      prune = None,
+                      stream = None,
+                      schedule_cache = None,
+                      joint = True):
 
     '''
     schedule_filename (str): name of file to be used if you want to test a DEMO file. Must be a single day, QC'ed file.
@@ -22,175 +384,292 @@ def busReschedule_run(schedule_filename,
     path_to_outdir (str): path to directory where you would like to store all output files.
     radius (float): number of miles to search for close buses. Will be shrunk by increments of 1 if
               number of nearby buses is > 30.
+    travel_cache (str): name of SQLite travel time cache in path_to_outdir, shared by every rescheduling
+              run that writes to the same directory. None turns the cache off.
+    router (object): routing engine from all_functions.routing, e.g. OSRMRouter(LOCAL_OSRM_URL) for a
+              local OSRM server. None keeps the currently installed one (public OSRM server by default).
+    finalists (int): if given, screen every candidate run with the offline HaversineRouter and only route
+              this many best runs per URID with the exact router. None routes every candidate run.
+    workers (int): if given, evaluate each URID's candidate runs in this many worker processes.
+              Needs fork (not available on Windows, where runs are evaluated one after another).
+              None evaluates them in this process.
+    batch (bool): default False, evaluate every URID on its candidate runs once and insert them in regret
+              order, re-evaluating only the runs each insertion changes. False inserts URIDs one at a time
+              in the order they come in, evaluating every candidate run again for each.
+    prune (int): if given, route each URID's candidate runs best lower bound first and skip runs that
+              can't make the best prune runs (see _prune); the best prune insertions are unchanged, joint or not.
+              Not used with batch. None routes every candidate run.
+    stream (object): streaming_schedule.StreamingSchedule the caller keeps between calls, or the name of the
+              file in path_to_outdir it is kept in between runs (loaded before the day is processed and saved
+              after). The day's schedule is applied to it as a delta from the previous one, so only the runs
+              that changed are given time windows and capacity again. None processes the whole day.
+    schedule_cache (str): if given, name of the directory in path_to_outdir where processed days (time windows
+              and capacity) are kept, keyed by the contents of the source file and windows, so the same snapshot
+              is loaded instead of processed again. Not used with stream. None processes the day every time.
+    joint (bool): default True, choose each run's pick up and drop off slots together (all_functions.insertPairs).
+              False uses the greedy all_functions.insertFeasibility: cheapest pick up detour first, then the
+              cheapest drop off after it. The two can count different numbers of broken time windows.
 
     '''
 
     flag = 200 #400's are bad, 200 is good.
+    pruning.update(runs = 0, routed = 0, pruned = 0)
+    _shared['joint'] = joint
 
     if not af.os.path.exists(path_to_outdir):
         path_to_outdir = af.os.path.join(af.os.getcwd(),'data')
 
-    #get rescheduling data from the webapp/data directory
-    if schedule_filename is not None:
-        if af.os.path.isfile(af.os.path.join(path_to_outdir, schedule_filename)):
-            fullSchedule = af.pd.DataFrame.from_csv(schedule_filename, header=0, sep=',', index_col = False)
-        else:
-            print('ERROR 401: Demo file not found!')
-            flag = 401
-            return flag
-
-    if accesskey and secretkey is not None:
-        #AWS_ACCESS_KEY = raw_input("Please enter AWS access key: ")
-        #AWS_SECRET_KEY = raw_input("Please enter AWS secret key: ")
-        try:
-            fullSchedule = af.s3_data_acquire(accesskey, secretkey, path_to_outdir, qc_file_name = 'qc_streaming.csv')
-            if type(fullSchedule) == int:
-                print("ERROR 402: formatting error in streaming data.")
-                flag = 402
+    if router is not None:
+        routing.set_router(router)
+    if travel_cache is not None:
+        routing.set_cache(routing.TravelTimeCache(af.os.path.join(path_to_outdir, travel_cache)))
+
+    try:
+        cache = None
+        if (schedule_cache is not None) and (stream is None):
+            cache = schedCache.ScheduleCache(af.os.path.join(path_to_outdir, schedule_cache))
+        fullSchedule_windows = None
+
+        #get rescheduling data from the webapp/data directory
+        if schedule_filename is not None:
+            if af.os.path.isfile(af.os.path.join(path_to_outdir, schedule_filename)):
+                if cache is not None:
+                    digest = schedCache.file_digest(schedule_filename)
+                    fullSchedule_windows = cache.load(digest, windows)
+                if fullSchedule_windows is None:
+                    fullSchedule = af.pd.DataFrame.from_csv(schedule_filename, header=0, sep=',', index_col = False)
+            else:
+                print('ERROR 401: Demo file not found!')
+                flag = 401
                 return flag
 
-        except IOError: #is this the right error if s3_data_acquire fails?
-            print('ERROR 403: Could not access streaming data!')
-            flag = 403
-            return flag
+        if accesskey and secretkey is not None:
+            #AWS_ACCESS_KEY = raw_input("Please enter AWS access key: ")
+            #AWS_SECRET_KEY = raw_input("Please enter AWS secret key: ")
+            try:
+                fullSchedule = af.s3_data_acquire(accesskey, secretkey, path_to_outdir, qc_file_name = 'qc_streaming.csv')
+                if type(fullSchedule) == int:
+                    print("ERROR 402: formatting error in streaming data.")
+                    flag = 402
+                    return flag
+                fullSchedule_windows = None
+                if cache is not None:
+                    #keyed by the snapshot as downloaded, before it is QC'ed
+                    digest = schedCache.file_digest(af.os.path.join(path_to_outdir, 'real_time_data.tsv'))
+                    fullSchedule_windows = cache.load(digest, windows)
+
+            except IOError: #is this the right error if s3_data_acquire fails?
+                print('ERROR 403: Could not access streaming data!')
+                flag = 403
+                return flag
             
-    #Determine broken run number, or get list of unhandled requests.
-    if broken_run is not None:
-        case = 'BROKEN_RUN'
-    elif bookingid is not None:
-        case = 'INDIVIDUAL_REQUESTS'
-        individual_requests = list(bookingid)
-
-    # this simply returns full schedule with time windows at the moment
-    sched_obj = af.aTWC.TimeWindowsCapacity(fullSchedule)
-    fullSchedule_windows = sched_obj.addtoRun_TimeCapacity(windows)
-    fS_w_copy = fullSchedule_windows.copy()
-
-    #this gets us all the URIDs for the broken run given the initial rescheduling time
-    #OR it will get us URIDs given specific bookingIds to be rescheduled
-    if case == 'BROKEN_RUN':
-        if broken_run not in list(set(fullSchedule_windows.Run.tolist())):
-            print('ERROR 404: Run number is not scheduled for today!')
-            flag = 404
-            return flag
-
-        if resched_init_time is not None:
-            resched_init_time = af.humanToSeconds(resched_init_time)
-
-        if resched_init_time is None:
-            t = af.datetime.datetime.now()
-            hr = str(t.hour)
-            if t.minute < 10:
-                m = str(0)+str(t.minute)
-            else:
-                m = str(t.minute)
-            t = hr+':'+m
-            resched_init_time = af.humanToSeconds(t)
-
-        URIDs = af.get_URID_Bus(fullSchedule_windows, broken_run, resched_init_time) 
-
-    else:
-        for i in range(len(individual_requests)):
-            if individual_requests[i] not in list(set(fullSchedule_windows.BookingId.tolist())):
-                print('ERROR 405: You have entered BookingIds not present in the schedule!')
-                flag = 405
+        #Determine broken run number, or get list of unhandled requests.
+        if broken_run is not None:
+            case = 'BROKEN_RUN'
+        elif bookingid is not None:
+            case = 'INDIVIDUAL_REQUESTS'
+            individual_requests = list(bookingid)
+
+        if stream is not None:
+            stream_path = None
+            if isinstance(stream, str):
+                #every run of the webapp is a new process, the previous snapshot is kept in path_to_outdir
+                stream_path = af.os.path.join(path_to_outdir, stream)
+                stream = streamSched.load(stream_path)
+            # the day is changed in place below, stream keeps its own copy for the next snapshot
+            fullSchedule_windows = stream.update(fullSchedule, windows).copy()
+            if stream_path is not None:
+                stream.save(stream_path)
+        elif fullSchedule_windows is None:
+            # this simply returns full schedule with time windows at the moment
+            sched_obj = af.aTWC.TimeWindowsCapacity(fullSchedule)
+            fullSchedule_windows = sched_obj.addtoRun_TimeCapacity(windows)
+            if cache is not None:
+                cache.save(digest, windows, fullSchedule_windows)
+        else:
+            print('Loaded the processed day from {0}.'.format(cache.path(digest, windows)))
+        spatial_idx = spIdx.SpatialIndex(fullSchedule_windows)
+        win_idx = winIdx.WindowIndex(fullSchedule_windows)
+        slack_idx = slckIdx.SlackIndex()
+        store = schedStore.ScheduleStore(fullSchedule_windows)
+        #the day is updated in place, log keeps what each update overwrites
+        log = schedStore.ScheduleLog()
+
+        #this gets us all the URIDs for the broken run given the initial rescheduling time
+        #OR it will get us URIDs given specific bookingIds to be rescheduled
+        if case == 'BROKEN_RUN':
+            if broken_run not in list(set(fullSchedule_windows.Run.tolist())):
+                print('ERROR 404: Run number is not scheduled for today!')
+                flag = 404
                 return flag
 
-        URIDs = af.get_URID_BookingIds(fullSchedule_windows, individual_requests)
+            if resched_init_time is not None:
+                resched_init_time = af.humanToSeconds(resched_init_time)
 
-    if not URIDs:
-        print('ERROR 406: There are no people to reschedule on bus {0} at time {1}'.format(broken_run, resched_init_time))
-        flag = 406
-        return flag
-
-    # for each URID we find the bus runs to check through a radius elimination.
-    # for each URID for each run we then want to check the capacity in the given time
-    # window and return the URID with updated insert points. This URID with updated
-    # insert points is fed to the feasibilty function, which we ultimately want to return
-    # a minimum cost run for the URID and that run updated with the new URID slotted in.
-    taxi_costs = []
-    delay_costs = []
-    best_buses = []
-    for i in range(len(URIDs)):
-        print('Rescheduling URID {0}'.format(i))
-        busRuns_tocheck = af.radius_Elimination(fullSchedule_windows, URIDs[i], radius=radius)
-        insert_stats = []
-
-        #iterate over all runs, find best one!
-        for run in busRuns_tocheck:
-
-            this_run = fullSchedule_windows[fullSchedule_windows['Run']==run]
-            capacity_obj = af.checkCap.CapacityInsertPts(this_run)
-
-            #Kristen's capacity checker:
-            URIDs[i].PickupInsert, URIDs[i].DropoffInsert = capacity_obj.return_inserts(URIDs[i])
+            if resched_init_time is None:
+                t = af.datetime.datetime.now()
+                hr = str(t.hour)
+                if t.minute < 10:
+                    m = str(0)+str(t.minute)
+                else:
+                    m = str(t.minute)
+                t = hr+':'+m
+                resched_init_time = af.humanToSeconds(t)
 
-            # IF THERE'S ROOM: TEST FEASIBILITY
-            if not af.np.isnan(URIDs[i].PickupInsert):
-                URIDs[i].PickupStart = URIDs[i].PickupInsert
-                URIDs[i].DropoffStart = URIDs[i].DropoffInsert
+            URIDs = af.get_URID_Bus(fullSchedule_windows, broken_run, resched_init_time) 
 
-                runSchedule = af.get_busRuns(fullSchedule_windows, run, None)
+        else:
+            for i in range(len(individual_requests)):
+                if individual_requests[i] not in list(set(fullSchedule_windows.BookingId.tolist())):
+                    print('ERROR 405: You have entered BookingIds not present in the schedule!')
+                    flag = 405
+                    return flag
 
-                print('Testing feasibility for run ' + run)
-                brokenwindows_dict =af.insertFeasibility(runSchedule, URIDs[i])
-                if not brokenwindows_dict:
-                    print('Run {0} infeasible without moving the return-to-garage row.'.format(run))
-                else:
-                    insert_stats.append(brokenwindows_dict)
+            URIDs = af.get_URID_BookingIds(fullSchedule_windows, individual_requests)
 
+        if not URIDs:
+            print('ERROR 406: There are no people to reschedule on bus {0} at time {1}'.format(broken_run, resched_init_time))
+            flag = 406
+            return flag
 
-        #ASSEMBLE and ORDER transit options.
-        if insert_stats:
-            #ORDER buses by lowest additional lag time, i.e. total_lag, and sequentially add total_lag's
-            ordered_inserts = sorted(insert_stats, key = af.operator.itemgetter('additional_time'))
-        
-            popme = []
-            for k in range(len(ordered_inserts)):
-                if ordered_inserts[k]['RunID']==broken_run:
-                    popme.append(k)
-            if popme:
-                ordered_inserts.pop(popme)
+        # for each URID we find the bus runs to check through a radius elimination.
+        # for each URID for each run we then want to check the capacity in the given time
+        # window and return the URID with updated insert points. This URID with updated
+        # insert points is fed to the feasibilty function, which we ultimately want to return
+        # a minimum cost run for the URID and that run updated with the new URID slotted in.
+        taxi_costs = []
+        delay_costs = []
+        best_buses = []
+        osrm_table = routing.OSRMTable()
+        if finalists is not None:
+            estimator = routing.HaversineRouter().fit(fullSchedule_windows)
+            print('Screening candidate runs at an estimated {0} m/s.'.format(round(estimator.speed, 2)))
+        if batch:
+            fullSchedule_windows, delay_costs, taxi_costs, best_buses = _batch_reschedule(fullSchedule_windows, URIDs,
+                broken_run, radius, path_to_outdir, spatial_idx, win_idx, store, estimator if finalists is not None else None,
+                finalists, workers, slack_idx, log)
+        else:
+            for i in range(len(URIDs)):
+                print('Rescheduling URID {0}'.format(i))
+                busRuns_tocheck = af.radius_Elimination(fullSchedule_windows, URIDs[i], radius=radius, index=spatial_idx, win_index=win_idx)
+                insert_stats = []
+                to_route = []
 
+                #iterate over all runs, find best one!
+                for run in busRuns_tocheck:
 
-            delay_costs.append(ordered_inserts[0]['additional_time'][0]*(48.09/3600)) #total dollars
-            best_buses.append(ordered_inserts[0]['RunID'])
+                    this_run = store.run(run)
+                    capacity_obj = af.checkCap.CapacityInsertPts(this_run)
 
-            #CALCULATE taxi cost
-            taxi_costs.append(af.taxi(URIDs[i]))
+                    #Kristen's capacity checker:
+                    URIDs[i].PickupInsert, URIDs[i].DropoffInsert = capacity_obj.return_inserts(URIDs[i])
 
-            #WRITE information about best insertions to text file
-            if len(ordered_inserts) >= 3:
-                af.write_insert_data(URIDs[i], ordered_inserts[0:3],
-                    path_to_outdir, taxi_costs[i])
-            else:
-                af.write_insert_data(URIDs[i], ordered_inserts[0:],
-                    path_to_outdir, taxi_costs[i])
+                    # IF THERE'S ROOM: TEST FEASIBILITY
+                    if not af.np.isnan(URIDs[i].PickupInsert):
+                        URIDs[i].PickupStart = URIDs[i].PickupInsert
+                        URIDs[i].DropoffStart = URIDs[i].DropoffInsert
 
+                        runSchedule = af.get_busRuns(fullSchedule_windows, run, None, store = store)
+                        #keep the URID's windows as they are for this run
+                        to_route.append((run, runSchedule, copy.copy(URIDs[i])))
 
-            #UPDATE whole day's schedule:
-            fullSchedule_windows = af.day_schedule_Update(data = fullSchedule_windows, top_Feasibility = ordered_inserts[0], URID = URIDs[i])
-            sched_obj_update = af.aTWC.TimeWindowsCapacity(fullSchedule_windows)
-            fullSchedule_windows = sched_obj_update.add_Capacity(update = True)
+                #offline estimate of every candidate run, keep the best few for exact routing
+                if finalists is not None:
+                    to_route = _screen(to_route, estimator, win_idx, finalists, slack_idx)
 
-            #SAVE just the updated run for each URID
-            fullSchedule_windows[fullSchedule_windows['Run'] == ordered_inserts[0]['RunID']].to_csv(af.os.path.join(path_to_outdir, str(str(int(URIDs[i].BookingId))+'_schedule.csv')), index = False)
+                if prune is not None:
+                    run_inserts = _prune(to_route, osrm_table, win_idx, prune, workers, slack_idx)
+                else:
+                    #one table request covers the pick up and drop off legs of every candidate run
+                    for run, runSchedule, run_URID in to_route:
+                        af.feasibility_legs(runSchedule, run_URID, osrm_table, win_idx)
+                    osrm_table.fetch()
+
+                    #best (pick up, drop off) pair on each run, in the same order as to_route either way
+                    run_inserts = _map_runs(to_route, osrm_table, win_idx, workers, slack_idx)
+
+                for (run, runSchedule, run_URID), brokenwindows_dicts in zip(to_route, run_inserts):
+                    if brokenwindows_dicts is None:
+                        #pruned, can't be one of the best prune runs
+                        continue
+                    if not brokenwindows_dicts:
+                        print('Run {0} infeasible without moving the return-to-garage row.'.format(run))
+                    else:
+                        insert_stats.append(brokenwindows_dicts[0])
+
+
+                #ASSEMBLE and ORDER transit options.
+                if insert_stats:
+                    #ORDER buses by lowest additional lag time, i.e. total_lag, and sequentially add total_lag's
+                    ordered_inserts = sorted(insert_stats, key = af.operator.itemgetter('additional_time'))
+        
+                    popme = []
+                    for k in range(len(ordered_inserts)):
+                        if ordered_inserts[k]['RunID']==broken_run:
+                            popme.append(k)
+                    if popme:
+                        ordered_inserts.pop(popme)
+
+
+                    delay_costs.append(ordered_inserts[0]['additional_time'][0]*(48.09/3600)) #total dollars
+                    best_buses.append(ordered_inserts[0]['RunID'])
+
+                    #CALCULATE taxi cost
+                    taxi_costs.append(af.taxi(URIDs[i]))
+
+                    #WRITE information about best insertions to text file
+                    if len(ordered_inserts) >= 3:
+                        af.write_insert_data(URIDs[i], ordered_inserts[0:3],
+                            path_to_outdir, taxi_costs[i])
+                    else:
+                        af.write_insert_data(URIDs[i], ordered_inserts[0:],
+                            path_to_outdir, taxi_costs[i])
+
+
+                    #UPDATE whole day's schedule:
+                    fullSchedule_windows = af.day_schedule_Update(data = fullSchedule_windows, top_Feasibility = ordered_inserts[0], URID = URIDs[i],
+                                                                  inplace = True, log = log)
+                    sched_obj_update = af.aTWC.TimeWindowsCapacity(fullSchedule_windows)
+                    fullSchedule_windows = sched_obj_update.update_Runs([URIDs[i].Run, ordered_inserts[0]['RunID']])
+                    spatial_idx = spIdx.SpatialIndex(fullSchedule_windows)
+                    win_idx = winIdx.WindowIndex(fullSchedule_windows)
+                    store = schedStore.ScheduleStore(fullSchedule_windows)
+                    slack_idx.update([URIDs[i].Run, ordered_inserts[0]['RunID']])
+
+                    #SAVE just the updated run for each URID
+                    store.run(ordered_inserts[0]['RunID']).to_csv(af.os.path.join(path_to_outdir, str(str(int(URIDs[i].BookingId))+'_schedule.csv')), index = False)
 
+                else:
+                    delay_costs.append(400000)
+                    taxi_costs.append(af.taxi(URIDs[i]))
+                    af.write_insert_data(URIDs[i], None, path_to_outdir, taxi_costs[i])
+                    best_buses.append('NA')
+
+        #WRITE csv of PREFERRED OPTIONS:
+        if case == 'BROKEN_RUN':
+            #broken run as it was before any URID was moved
+            runs = log.runs()
+            fullSchedule_windows = log.rollback(fullSchedule_windows)
+            fullSchedule_windows = af.aTWC.TimeWindowsCapacity(fullSchedule_windows).update_Runs(runs)
+            nrun_cost = af.newBusRun_cost(af.get_busRuns(fullSchedule_windows, broken_run, URIDs[0]), provider = 6)
         else:
-            delay_costs.append(400000)
-            taxi_costs.append(af.taxi(URIDs[i]))
-            af.write_insert_data(URIDs[i], None, path_to_outdir, taxi_costs[i])
-            best_buses.append('NA')
+            nrun_cost = None
+        pref_opt = af.preferred_options(URIDs, best_buses, delay_costs, taxi_costs, nrun_cost)
+        pref_opt.to_csv(af.os.path.join(path_to_outdir, 'preferred_options.csv'), index = False)
 
-    #WRITE csv of PREFERRED OPTIONS:
-    if case == 'BROKEN_RUN':
-        nrun_cost = af.newBusRun_cost(af.get_busRuns(fS_w_copy, broken_run, URIDs[0]), provider = 6)
-    else:
-        nrun_cost = None
-    pref_opt = af.preferred_options(URIDs, best_buses, delay_costs, taxi_costs, nrun_cost)
-    pref_opt.to_csv(af.os.path.join(path_to_outdir, 'preferred_options.csv'), index = False)
+        _shared.clear()
 
-    return flag
+        if prune is not None:
+            print('Pruned {pruned} of {runs} candidate runs before routing.'.format(**pruning))
+        if routing.get_cache() is not None:
+            print('Travel time cache: {0}'.format(routing.get_cache().stats()))
+
+        return flag
+    finally:
+        #the cache's connection is closed, not left open for the next run or inherited by forked processes
+        if travel_cache is not None:
+            routing.get_cache().close()
+            routing.set_cache(None)
 
 
 
@@ -223,7 +702,10 @@ def main():
         fout.write(str(flag))
         fout.close()
         
-    flag = busReschedule_run(demo_filename, accesskey, secretkey, broken_run, path_to_outdir, resched_init_time, bookingid, windows, radius)
+    #streaming snapshots are applied to the one the previous run processed, kept next to qc_streaming.csv
+    stream = 'streaming_schedule.npz' if accesskey is not None else None
+    flag = busReschedule_run(demo_filename, accesskey, secretkey, broken_run, path_to_outdir, resched_init_time, bookingid, windows, radius,
+                             stream = stream)
     fout = open(os.path.join(path_to_outdir,'flag.txt'), 'w')
     fout.write(str(flag))
     fout.close()
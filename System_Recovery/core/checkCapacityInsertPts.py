@@ -2,6 +2,66 @@ import numpy as np
 import pandas as pd 
 
 
+# am capacity allowed for a total wc capacity of 0, 1, 2 or 3, see CapacityInsertPts.amCapacitySwitch
+AM_LIMITS = np.array([14, 10, 6, 2])
+
+def am_limit(wcCapacityTotal):
+    """
+    Array version of CapacityInsertPts.amCapacitySwitch.
+
+    Args:
+    wcCapacityTotal (array): total wc capacity, i.e. wc capacity + URID.wcOn
+
+    Returns:
+    appropriate am capacity for each total, -1000 for totals other than 0-3
+    """
+
+    total = np.asarray(wcCapacityTotal, dtype=float)
+    with np.errstate(invalid='ignore'):
+        known = (total >= 0) & (total <= 3) & (total == np.floor(total))
+    return np.where(known, AM_LIMITS[np.where(known, total, 0).astype(int)], -1000)
+
+
+class RangeMax():
+    """
+    Sparse table over one capacity column of a run: the max over any block of consecutive
+    rows is the larger of two precomputed, overlapping power-of-two blocks. Nulls are skipped,
+    like Series.max().
+
+    Attributes:
+    levels (list): levels[k][i] is the max of rows i to i + 2**k - 1
+
+    """
+
+    def __init__(self, values):
+        """
+        Args:
+        values (array): capacity column of a single bus run
+
+        """
+
+        self.levels = [np.array(values, dtype=float)]
+        width = 1
+        while 2*width <= len(self.levels[0]):
+            prev = self.levels[-1]
+            self.levels.append(np.fmax(prev[:-width], prev[width:]))
+            width *= 2
+
+    def query(self, start, stop):
+        """
+        Args:
+        start/stop (int): positions of the first row and one past the last row
+
+        Returns:
+        max over rows start to stop - 1, NaN if there are none (or they are all null)
+        """
+
+        if stop <= start:
+            return np.nan
+        k = int(stop - start).bit_length() - 1
+        return np.fmax(self.levels[k][start], self.levels[k][stop - (1 << k)])
+
+
 class CapacityInsertPts():
     """
     Assumes that busRun df has wcCapacity, amCapacity columns, and that URID
@@ -39,6 +99,13 @@ class CapacityInsertPts():
         """
 
         self.busRun = busRun
+        self.eta = np.array(busRun['ETA'], dtype=float)
+        self.wcCapacity = np.array(busRun['wcCapacity'], dtype=float)
+        self.amCapacity = np.array(busRun['amCapacity'], dtype=float)
+        self.wcMax = RangeMax(self.wcCapacity)
+        self.amMax = RangeMax(self.amCapacity)
+        # runs are normally in ETA order, which lets windows be found by binary search
+        self.eta_sorted = bool(np.all(np.diff(self.eta) >= 0))
 
     def amCapacitySwitch(self, wcCapacityTotal):
         """
@@ -65,6 +132,57 @@ class CapacityInsertPts():
             '2': 6,
             '3': 2}.get(wcCapacityTotal,-1000)
 
+    def etaWindow(self, start, end, closed=True):
+        """
+        Args:
+        start/end (float): bounds on ETA
+        closed (bool): default True, include rows with ETA equal to start or end
+
+        Returns:
+        array of positions of rows with ETA in the window
+        """
+
+        if self.eta_sorted:
+            left = np.searchsorted(self.eta, start, side='left' if closed else 'right')
+            right = np.searchsorted(self.eta, end, side='right' if closed else 'left')
+            return np.arange(left, max(left, right))
+        if closed:
+            return np.where((self.eta >= start) & (self.eta <= end))[0]
+        return np.where((self.eta > start) & (self.eta < end))[0]
+
+    def windowMax(self, window):
+        """
+        Args:
+        window (array): positions of rows, i.e. PickupWindow/DropoffWindow
+
+        Returns:
+        max wc capacity and max am capacity over the window, NaN if the window is empty
+        """
+
+        if len(window) == 0:
+            return np.nan, np.nan
+        if window[-1] - window[0] + 1 == len(window):
+            return self.wcMax.query(window[0], window[-1] + 1), self.amMax.query(window[0], window[-1] + 1)
+        return np.fmax.reduce(self.wcCapacity[window]), np.fmax.reduce(self.amCapacity[window])
+
+    def fullAt(self, positions, URID, wcCapacityTotal=None):
+        """
+        Args:
+        positions (array): positions of rows to check
+        URID (class instance): contains all info for unscheduled request 
+        wcCapacityTotal (float): default None, wc total to look up the am limit with, else each row's own total
+
+        Returns:
+        bool array, True where the bus would be over capacity with the URID on board
+        """
+
+        wc_total = self.wcCapacity[positions] + URID.wcOn
+        if wcCapacityTotal is None:
+            wcCapacityTotal = wc_total
+        # null capacities are never full, as with the pandas comparisons
+        with np.errstate(invalid='ignore'):
+            return (wc_total > 3) & (self.amCapacity[positions] + URID.amOn > am_limit(wcCapacityTotal))
+
     def checkWindow(self, URID, window, pickupdropoffiloc, pickupdropoffindx):
         """
         
@@ -90,116 +208,72 @@ class CapacityInsertPts():
 
 
         """
-        max_wcCapacity = self.busRun['wcCapacity'].iloc[window].max()
-        max_amCapacity = self.busRun['amCapacity'].iloc[window].max()
-        full_bool = (max_wcCapacity + URID.wcOn > 3) & (max_amCapacity + URID.amOn > self.amCapacitySwitch(str(max_wcCapacity + URID.wcOn)))
-
-        if full_bool:
-            # first index where bus is full 
-            full_indx = np.array((self.busRun['wcCapacity'].iloc[window] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window] + URID.amOn > self.amCapacitySwitch(str(max_wcCapacity + URID.wcOn))))
-
-            # if index where bus is full is full is unique, check capacity at next index  
-            if len(self.busRun['wcCapacity'].iloc[window].loc[full_indx]) == 1:
-                next_full_bool = np.array((self.busRun['wcCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx] + URID.wcOn))))
-                # if the bus is still full at next index, start looping until it is not full (return index), or reach end (return null)
-                if next_full_bool:
-                    counter = pickupdropoffiloc
-                    # check for case of pick up 
-                    if (pickupdropoffiloc == 1) & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) < self.busRun['ETA'].iloc[window[-1]]):
-                        while int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) < self.busRun['ETA'].iloc[window[-1]]:
-                            counter += 1
-                            check_full_bools = np.array((self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + counter].loc[full_indx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx] + URID.wcOn))))
-                            if check_full_bools:
-                                continue
-                            elif check_full_bools & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) == self.busRun['ETA'].iloc[window[-1]]):
-                                #not enough time for pick up 
-                                return np.nan 
-                            elif not check_full_bools:
-                                return self.busRun['ETA'].iloc[window + counter].loc[full_indx]
-                    elif (pickupdropoffiloc == 1) & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) >= self.busRun['ETA'].iloc[window[-1]]):
-                        #not enough time for pick up 
-                        return np.nan
-                    # check for case of drop off, same as above, except return DropoffStart instead of null if still full
-                    # at final index 
-                    elif (pickupdropoffiloc == -1) & (int(self.busRun['ETA'].iloc[window+counter].loc[full_indx]) > self.busRun['ETA'].iloc[window[0]]):
-                        while int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) > self.busRun['ETA'].iloc[window[0]]:
-                            counter -= 1
-                            check_full_bools = np.array((self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + counter].loc[full_indx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx] + URID.wcOn))))
-                            if check_full_bools:
-                                continue
-                            elif check_full_bools & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx]) == self.busRun['ETA'].iloc[window[0]]):
-                                # Must be dropped off here 
-                                return URID.DropoffStart 
-                            elif not check_full_bools:
-                                return self.busRun['ETA'].iloc[window + counter].loc[full_indx]
-                    elif (pickupdropoffiloc == -1) & (int(self.busRun['ETA'].iloc[window+counter].loc[full_indx]) <= self.busRun['ETA'].iloc[window[0]]):
-                        # must be dropped off here 
-                        return URID.DropoffStart 
-                elif not next_full_bool:
-                        return self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx]
-
-            # if there are multiple places in PickupWindow where we go over max capacity
-            # choose one that is closest to PickupEnd or DropoffStart, otherwise same as above 
-            elif len(self.busRun['wcCapacity'].iloc[window].loc[full_indx]) > 1:
-                    next_full_bool = np.array((self.busRun['wcCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx] + URID.wcOn))))
-                    print next_full_bool
-                    if next_full_bool:
-                        counter = pickupdropoffiloc
-                        if (pickupdropoffiloc == 1) & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) < self.busRun['ETA'].iloc[window[-1]]):
-                            while int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) < self.busRun['ETA'].iloc[window[-1]]:
-                                counter += 1
-                                check_full_bools = np.array((self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.wcOn))))
-                                if check_full_bools:
-                                    continue
-                                elif check_full_bools & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) == self.busRun['ETA'].iloc[window[-1]]):
-                                    #not enough time for pick up 
-                                    return np.nan
-                                elif not check_full_bools:
-                                    return self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]
-                        elif (pickupdropoffiloc == 1) & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) >= self.busRun['ETA'].iloc[window[-1]]):
-                            return np.nan
-
-                        if (pickupdropoffiloc == -1) & (int(self.busRun['ETA'].iloc[window+counter].loc[full_indx][pickupdropoffindx]) > self.busRun['ETA'].iloc[window[0]]):
-                            while int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) > self.busRun['ETA'].iloc[window[0]]:
-                                counter -= 1
-                                check_full_bools = np.array((self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.wcOn > 3) & (self.busRun['amCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.amOn > self.amCapacitySwitch(str(self.busRun['wcCapacity'].iloc[window + counter].loc[full_indx][pickupdropoffindx] + URID.wcOn))))
-                                if check_full_bools:
-                                    continue
-                                elif check_full_bools & (int(self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]) == self.busRun['ETA'].iloc[window[0]]):
-                                    #return self.busRun['ETA'].iloc[window[0]]
-                                    return URID.DropoffStart 
-                                elif not check_full_bools:
-                                    return self.busRun['ETA'].iloc[window + counter].loc[full_indx][pickupdropoffindx]
-                        elif (pickupdropoffiloc == -1) & (int(self.busRun['ETA'].iloc[window+counter].loc[full_indx]) <= self.busRun['ETA'].iloc[window[0]]):
-                            return URID.DropoffStart
-                        
-                    # if it's not full at next index, return that index if not at end of window, otherwise return null (pick up)
-                    # or dropoffstart (drop off)
-                    elif not next_full_bool:
-                        if pickupdropoffiloc == 1:
-                            if int(self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]) >= self.busRun['ETA'].iloc[window[-1]]:
-                                # not enough time for pick unicp 
-                                return np.nan 
-                            elif int(self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]) < self.busRun['ETA'].iloc[window[-1]]:
-                                return self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]
-                        elif pickupdropoffiloc == -1:
-                            if int(self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]) <= self.busRun['ETA'].iloc[window[0]]:
-                                return URID.DropoffStart 
-                            elif int(self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]) > self.busRun['ETA'].iloc[window[0]]:
-                                return self.busRun['ETA'].iloc[window + pickupdropoffiloc].loc[full_indx][pickupdropoffindx]
+        step = pickupdropoffiloc
+        max_wcCapacity, max_amCapacity = self.windowMax(window)
+        full_bool = (max_wcCapacity + URID.wcOn > 3) & (max_amCapacity + URID.amOn > am_limit(max_wcCapacity + URID.wcOn))
 
         # if the bus is not full return full time window 
-        elif not full_bool:
-            # a drop off 
-            if pickupdropoffiloc == -1:
+        if not full_bool:
+            if step == -1:
                 return URID.DropoffEnd
-                #return self.busRun['ETA'][window[-1]]
-            # a pickup 
-            elif pickupdropoffiloc == 1:
-                return URID.PickupStart
-                #return self.busRun['ETA'][window[0]]
+            return URID.PickupStart
+
+        # index where bus is full, if not unique the one closest to PickupEnd or DropoffStart
+        full_indx = window[self.fullAt(window, URID, max_wcCapacity + URID.wcOn)]
+        unique = len(full_indx) == 1
+        nxt = full_indx[pickupdropoffindx] + step
+        # past the end of the run: no time for pick up, drop off must happen at DropoffStart
+        if (nxt < 0) or (nxt >= len(self.eta)):
+            return np.nan if step == 1 else URID.DropoffStart
+
+        # not full at next index: return it, checking it is still inside the window when the max wasn't unique
+        if not self.fullAt([nxt], URID)[0]:
+            if unique:
+                return self.eta[nxt]
+            if step == 1:
+                return np.nan if self.eta[nxt] >= self.eta[window[-1]] else self.eta[nxt]
+            return URID.DropoffStart if self.eta[nxt] <= self.eta[window[0]] else self.eta[nxt]
+
+        # still full at next index: move on until it is not full (return index), or reach end of window
+        if step == 1:
+            window_end = self.eta[window[-1]]
+            if self.eta[nxt] >= window_end:
+                #not enough time for pick up 
+                return np.nan
+            later = np.arange(nxt + 1, len(self.eta))
+            free = later[~self.fullAt(later, URID)]
+            # the walk can only step off rows that are before the end of the window
+            stop = nxt + np.flatnonzero(self.eta[nxt:] >= window_end)
+            if (free.size == 0) or (stop.size and stop[0] < free[0]):
+                #not enough time for pick up 
+                return np.nan
+            return self.eta[free[0]]
+        else:
+            window_start = self.eta[window[0]]
+            if self.eta[nxt] <= window_start:
+                # must be dropped off here 
+                return URID.DropoffStart
+            earlier = np.arange(0, nxt)
+            free = earlier[~self.fullAt(earlier, URID)]
+            stop = np.flatnonzero(self.eta[:nxt + 1] <= window_start)
+            if (free.size == 0) or (stop.size and stop[-1] > free[-1]):
+                # must be dropped off here 
+                return URID.DropoffStart
+            return self.eta[free[-1]]
+
+    def isFull(self, window, URID):
+        """
+        Args:
+        window (array): positions of rows to check
+        URID (class instance): contains all info for unscheduled request 
+
+        Returns:
+        True if the bus is over capacity somewhere in window with the URID on board
+        """
+
+        max_wcCapacity, max_amCapacity = self.windowMax(window)
+        return (max_wcCapacity + URID.wcOn > 3) & (max_amCapacity + URID.wcOn > am_limit(max_wcCapacity + URID.wcOn))
 
-        
     def return_inserts(self, URID):
         """
         Method to return URID insert pts for cases where DropoffStart < PickupEnd or DropoffStart > PickupEnd. 
@@ -212,27 +286,23 @@ class CapacityInsertPts():
         URID.PickupInsert, URID.DropoffInsert 
         """
 
-        restrictive_window, = np.where((self.busRun['ETA'] > URID.PickupEnd ) & (self.busRun['ETA'] < URID.DropoffStart))
-        PickupWindow, = np.where((self.busRun['ETA'] >= URID.PickupStart) & (self.busRun['ETA'] <= URID.PickupEnd))
-        DropoffWindow, = np.where((self.busRun['ETA'] >= URID.DropoffStart) & (self.busRun['ETA'] <= URID.DropoffEnd))
+        restrictive_window = self.etaWindow(URID.PickupEnd, URID.DropoffStart, closed=False)
+        PickupWindow = self.etaWindow(URID.PickupStart, URID.PickupEnd)
+        DropoffWindow = self.etaWindow(URID.DropoffStart, URID.DropoffEnd)
 
-        max_wcCapacity = self.busRun['wcCapacity'].iloc[restrictive_window].max()
-        max_amCapacity = self.busRun['amCapacity'].iloc[restrictive_window].max()
-        full = (max_wcCapacity + URID.wcOn > 3) & (max_amCapacity + URID.wcOn > self.amCapacitySwitch(str(max_wcCapacity + URID.wcOn)))
+        full = self.isFull(restrictive_window, URID)
         # likely to be most common case
         if URID.DropoffStart <= URID.PickupEnd:
             print "DropoffStart before PickupEnd"
-            max_wcCapacity_PU = self.busRun['wcCapacity'].iloc[PickupWindow].max()
-            max_amCapacity_PU = self.busRun['amCapacity'].iloc[PickupWindow].max()
-            full_PU = (max_wcCapacity_PU + URID.wcOn > 3) & (max_amCapacity_PU + URID.wcOn > self.amCapacitySwitch(str(max_wcCapacity_PU + URID.wcOn)))
-            max_wcCapacity_DO = self.busRun['wcCapacity'].iloc[DropoffWindow].max()
-            max_amCapacity_DO = self.busRun['amCapacity'].iloc[DropoffWindow].max()
-            full_DO = (max_wcCapacity_DO + URID.wcOn > 3) & (max_amCapacity_DO + URID.wcOn > self.amCapacitySwitch(str(max_wcCapacity_DO + URID.wcOn)))
+            full_PU = self.isFull(PickupWindow, URID)
+            full_DO = self.isFull(DropoffWindow, URID)
             # check pick up window and then all associated cases  
             if full_PU:
                 print "full somehere in pick up window "
-                tmpPU = int(self.checkWindow(URID,PickupWindow,1,-1))
-                if tmpPU == URID.PickupEnd:
+                tmpPU = self.checkWindow(URID,PickupWindow,1,-1)
+                if not np.isnan(tmpPU):
+                    tmpPU = int(tmpPU)
+                if np.isnan(tmpPU) or (tmpPU == URID.PickupEnd):
                     print "not enough time for pick up"
                     URID.PickupInsert, URID.DropoffInsert = np.nan, np.nan
                 elif (tmpPU < URID.PickupEnd) and (full_DO):
@@ -243,10 +313,10 @@ class CapacityInsertPts():
                         URID.PickupInsert, URID.DropoffInsert = np.nan, np.nan
                     elif tmpDO < URID.DropoffEnd:
                         print "returning pick up and drop off inserts"
-                        URID.PickupInsert, URID.DropoffInsert = int(self.checkWindow(URID,PickupWindow,1,-1)), int(self.checkWindow(URID, DropoffWindow,-1,0))
+                        URID.PickupInsert, URID.DropoffInsert = tmpPU, tmpDO
                 elif (tmpPU < URID.PickupEnd) and not (full_DO):
                     print "returning pick up and drop off inserts, drop off never full"
-                    URID.PickupInsert, URID.DropoffInsert = int(self.checkWindow(URID,PickupWindow,1,-1)), URID.DropoffEnd
+                    URID.PickupInsert, URID.DropoffInsert = tmpPU, URID.DropoffEnd
             elif not (full_PU) and (full_DO):
                 print "pick up never full, drop off full somewhere"
                 tmpDO = int(self.checkWindow(URID, DropoffWindow,-1,0))
@@ -255,7 +325,7 @@ class CapacityInsertPts():
                     URID.PickupInsert, URID.DropoffInsert = np.nan, np.nan
                 elif tmpDO < URID.DropoffEnd:
                     print "returning pick up and drop off inserts, pick up never full "
-                    URID.PickupInsert, URID.DropoffInsert = URID.PickupStart, int(self.checkWindow(URID, DropoffWindow,-1,0))
+                    URID.PickupInsert, URID.DropoffInsert = URID.PickupStart, tmpDO
             elif not full_PU and not full_DO:
                     print "entire window available!"
                     URID.PickupInsert, URID.DropoffInsert = URID.PickupStart, URID.DropoffEnd
@@ -267,12 +337,13 @@ class CapacityInsertPts():
                 # URID.PickupInsert, URID.DropoffInsert
                 URID.PickupInsert, URID.DropoffInsert =  np.nan, np.nan 
             elif not full:
-                if np.isnan(int(self.checkWindow(URID, PickupWindow,1,-1))):
+                tmpPU = self.checkWindow(URID, PickupWindow,1,-1)
+                if np.isnan(tmpPU):
                     print "pick up not feasible"
                     URID.PickupInsert, URID.DropoffInsert = np.nan, np.nan
                 else:
                     print "returning pick up and drop off inserts"
-                    URID.PickupInsert, URID.DropoffInsert = int(self.checkWindow(URID, PickupWindow,1,-1)), int(self.checkWindow(URID, DropoffWindow,-1,0))
+                    URID.PickupInsert, URID.DropoffInsert = int(tmpPU), int(self.checkWindow(URID, DropoffWindow,-1,0))
 
         return URID.PickupInsert, URID.DropoffInsert 
         
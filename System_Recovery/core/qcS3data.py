@@ -12,15 +12,93 @@ import sys
 import re
 import time
 import os
+import numpy as np
 import pandas as pd
 import read_fwf
+import s3_listing
 
-def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name = 'qc_streaming.csv'):
+
+#lat/lon constraints:
+UPPER_RIGHT = [49.020430, -116.998768]
+LOWER_LEFT = [45.606961, -124.974842]
+
+#QC rules, each run failing one of them is eliminated
+QC_RULES = ['out_of_bounds', 'two_rows', 'doesnt_move', 'no_garage']
+
+
+def qc_runs(data, qc_file_name = None):
+
+    '''
+    QC of streaming data a la the R QCing script, in one pass over every run of providers 5 and 6.
+    Runs are eliminated if they have bad lat/lon data (out_of_bounds), just 2 rows of data (two_rows),
+    don't move (doesnt_move), or don't leave a garage and return to a garage (no_garage).
+
+    Args:
+        data (dataframe): streaming data, from read_fwf
+        qc_file_name (string): default None, path of a csv file to also write the cleaned data to
+
+    Returns:
+        (cleaned dataframe, report): the rows of the good runs, run after run in the order runs first
+        appear, and a dataframe with a row per run: its number of rows, a column per rule in QC_RULES
+        (True if the run breaks it) and kept.
+    '''
+
+    data56 = data.loc[(data.ProviderId == 5.) | (data.ProviderId == 6.)]
+    if 'ServiceDate' in data56.columns:
+        data56 = data56.drop('ServiceDate', axis = 1)
+
+    codes, rides = pd.factorize(np.asarray(data56.Run))
+    data56 = data56.iloc[np.flatnonzero(codes >= 0)]
+    codes = codes[codes >= 0]
+    activity = np.asarray(data56.Activity).astype('int')
+    lats = np.asarray(data56.LAT, dtype = float)
+    lons = np.asarray(data56.LON, dtype = float)
+
+    #rows of each run together, first and last row of each run
+    n = len(rides)
+    size = np.bincount(codes, minlength = n)
+    order = np.argsort(codes, kind = 'mergesort')
+    ends = np.cumsum(size)
+    first, last = order[ends - size], order[ends - 1]
+
+    def count(rows):
+        return np.bincount(codes, weights = rows, minlength = n)
+
+    with np.errstate(invalid = 'ignore'):
+        outside = (lats < LOWER_LEFT[0]) | (lats > UPPER_RIGHT[0]) | (lons < LOWER_LEFT[1]) | (lons > UPPER_RIGHT[1])
+        report = pd.DataFrame({'rows': size,
+                               'out_of_bounds': count(outside) > 0,
+                               'two_rows': size == 2,
+                               'doesnt_move': (count(lats == lats[first][codes]) == size) | (count(lons == lons[first][codes]) == size),
+                               'no_garage': (activity[first] != 4) | (activity[last] != 3)},
+                              index = pd.Index(rides, name = 'Run'), columns = ['rows'] + QC_RULES)
+    report['kept'] = ~report[QC_RULES].any(axis = 1)
+
+    keep = order[report.kept.values[codes[order]]]
+    ret = data56.iloc[keep].copy()
+    ret['Activity'] = activity[keep]
+
+    #same types reading the cleaned data back from csv gives
+    for col in ret.columns:
+        if ret[col].dtype.name == 'category':
+            ret[col] = np.asarray(ret[col], dtype = object)
+        elif ret[col].dtype.kind in 'iuf':
+            ret[col] = ret[col].astype(ret[col].dtype.kind.replace('u', 'i') + '8')
+    ret.index = range(0, ret.shape[0])
+
+    if not qc_file_name is None:
+        ret.to_csv(qc_file_name, index = False)
+
+    return ret, report
+
+
+def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name = 'qc_streaming.csv', return_report = False):
 
     '''
     For establishing connection, use access and secret keys sent by Valentina.
+    qc_file_name = None doesn't write the cleaned data, return_report = True also returns the qc_runs report.
     '''
-    if os.path.isfile(os.path.join(path_to_data, qc_file_name)):
+    if (qc_file_name is not None) and os.path.isfile(os.path.join(path_to_data, qc_file_name)):
         os.remove(os.path.join(path_to_data, qc_file_name))
 
     #STEP 1: Access S3 and download relevant streaming data file
@@ -31,79 +109,42 @@ def s3_data_acquire(AWS_ACCESS_KEY, AWS_SECRET_KEY, path_to_data, qc_file_name =
 
     bucket = conn.get_bucket('paratransitdata')
 
-    #print bucket contents:
-    rs = bucket.list()
-
-    #get list of streaming_data files for today's date
-    file_ls = []
-    for key in rs:
-        if re.search('streaming_data/Schedules_'+ time.strftime('%Y%m%d'),key.name.encode('ascii')):
-            file_ls.append(key.name.encode('ascii'))
+    #list only today's snapshots, and only the ones added since the last run (listing kept in path_to_data)
+    listing = s3_listing.snapshot_listing(bucket, s3_listing.day_prefix(), path = os.path.join(path_to_data, 's3_listing.json'))
 
-    if not file_ls:
+    if not listing.keys:
         print('There are no files from '+ str(time.strftime('%Y/%m/%d'))+ '!')
         return -1
-        quit()
-        
-    #select relevant streaming_data file: watch out, hopefully the [-1] file isn't zero bytes!
-    data_key = bucket.get_key(file_ls[-1])
+
+    #select the newest streaming_data file that isn't zero bytes
+    newest = listing.newest()
+    if newest is None:
+        print('All {0} files from {1} are empty!'.format(len(listing.keys), time.strftime('%Y/%m/%d')))
+        return -1
+    data_key = bucket.get_key(newest)
     move_to_me = os.path.join(path_to_data,'real_time_data.tsv')
     data_key.get_contents_to_filename(move_to_me)
-    print('Saving {0} from S3 bucket.'.format(file_ls[-1]))
+    print('Saving {0} from S3 bucket.'.format(newest))
 
     #STEP 2: change this file from fixed width formatted to tab delimitted
-    data = read_fwf.read(move_to_me)
+    data = read_fwf.read_fast(move_to_me)
+    if data.empty:
+        print('{0} has no rows!'.format(newest))
+        return -1
     print('Successfully converted fwf file.')
 
     #STEP 3: QC this file a la the R QCing script
+    if not qc_file_name is None:
+        qc_file_name = os.path.join(path_to_data, qc_file_name)
+    ret, report = qc_runs(data, qc_file_name)
+    print('QC kept {0} of {1} runs.'.format(int(report.kept.sum()), report.shape[0]))
 
-    data56 = data.loc[(data.ProviderId == 5.) | (data.ProviderId == 6.)]
-    rides = data56.Run.unique()
-    data56.loc[:,'Activity'] = data56.loc[:,'Activity'].astype('int')
-
-    #lat/lon constraints:
-    upper_right = [49.020430, -116.998768]
-    lower_left = [45.606961, -124.974842]
-    minlat = lower_left[0]; maxlat = upper_right[0]
-    minlon = lower_left[1]; maxlon = upper_right[1]
-
-
-    #Write the cleaned up data:
-    ctr = 0
-    qc_file_name = os.path.join(path_to_data, qc_file_name)
-    for ride in rides:
-        temp_ride = data56.loc[data56.Run == ride]
-        if 'ServiceDate' in temp_ride.columns:
-            temp_ride = temp_ride.drop('ServiceDate', axis = 1)
-        
-        flag = 1 #1 == good, 0 == eliminate.
-        lats = temp_ride.LAT; lons = temp_ride.LON
-        #eliminate runs from roster that have bad lat/lon data:
-        if(any(lats < minlat) | any(lats>maxlat) | any(lons<minlon) | any(lons > maxlon)):
-            flag = 0
-        #eliminate runs with just 2 rows of data:
-        if temp_ride.shape[0] == 2:
-            flag = 0
-        #eliminate runs that don't move
-        if(all(lats == lats.iloc[0]) | all(lons == lons.iloc[0])):
-            flag = 0
-        #eliminate runs that don't leave a garage and return to a garage
-        if (temp_ride.Activity.iloc[0] != 4) | (temp_ride.Activity.iloc[-1] != 3):
-            flag = 0
-
-        if (ctr != 0) & (flag == 1) :
-            temp_ride.to_csv(qc_file_name, mode = 'a', header = False, index = False)
-        if (ctr == 0) & (flag == 1):
-            temp_ride.to_csv(qc_file_name, mode = 'a', header = True, index = False)
-            ctr = 1
-
-    read_me = os.path.join(path_to_data, qc_file_name)
-    ret = pd.read_csv(read_me)
-    
-    #resolve indexing issues if index column is type timedate, or something else
-    if not set(ret.index)==set(range(0, ret.shape[0])):
-        ret.index = range(0, ret.shape[0])
-    
+    if ret.empty:
+        print('No runs passed QC!')
+        return -1
+
+    if return_report:
+        return ret, report
     return ret
 
 
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
+import mmap
+import os
 import sys
+import time
 
 
 
@@ -29,10 +32,22 @@ Note: The types are hard-coded: you can modify usage based on your needs
 
 Warning: this relies on the structure of files not changing
 
+Large and multi-day files: read_fast (or stream, to go through the file chunksize rows at a time)
+memory-maps the file and slices the fields out of every record at once with NumPy, with compact
+types (see DTYPES) instead of object columns.
+
       
 """
 
 
+# creating the widths of each column
+WIDTHS = [12,21,12,12,12,9,12,12,21,255,255,25,25,12,12,12,12,17,51,51,12]
+
+# types for read_fast/stream, other columns are numbers if they all parse and strings if not
+DTYPES = {'ETA': 'int32', 'SchTime': 'int32', 'LAT': 'float32', 'LON': 'float32',
+          'Run': 'category', 'SpaceOn': 'category', 'MobAids': 'category'}
+
+
 def main():
 
     filename = sys.argv[1]
@@ -45,6 +60,20 @@ def main():
     if len(sys.argv)>2:
         data.to_csv(sys.argv[2],sep = '\t')
 
+def colspecs(widths = WIDTHS):
+    """
+        starting and ending point [) of each column, excluding the commas
+    """
+
+    # creating colspecs (containing starting and ending point [) of a column)
+    cumsum = [sum(widths[:i+1]) for i in range(len(widths))]
+
+    # excluding the commas
+    cumsum0 = [0]+cumsum[:-1]
+    cumsum_short = [item-1 for item in cumsum]
+    return list(zip(cumsum0,cumsum_short))
+
+
 def read(filename):
     """ 
       
@@ -56,20 +85,9 @@ def read(filename):
                 and cannot be automatically converted to integers)
     """    
     
-    # creating the widths of each column
-    widths = [12,21,12,12,12,9,12,12,21,255,255,25,25,12,12,12,12,17,51,51,12]
-    
-    # creating colspecs (containing starting and ending point [) of a column)
-    cumsum = [sum(widths[:i+1]) for i in range(len(widths))]
-    
-    # excluding the commas
-    cumsum0 = [0]+cumsum[:-1]
-    cumsum_short = [item-1 for item in cumsum]
-    colspecs = list(zip(cumsum0,cumsum_short))
-    
     # reading the file
     try:
-        data = pd.read_fwf(filename,colspecs = colspecs,skiprows = [1])
+        data = pd.read_fwf(filename,colspecs = colspecs(),skiprows = [1])
     except(IOError):
         print('This file does not exist. Please, check the filename or the directory.')
         sys.exit()
@@ -81,6 +99,154 @@ def read(filename):
     return(data)
 
 
+def _text(values):
+    # bytes of a field to str (the same thing in python 2)
+    if str is bytes:
+        return values
+    return np.char.decode(values, 'latin-1')
+
+
+def _convert(field, dtype):
+    """
+        converts the stripped bytes of a column to dtype, blank fields are NaN.
+        int columns with blanks or fractions are float, like pd.read_fwf gives.
+    """
+
+    blank = field == b''
+
+    if dtype == 'category':
+        categories, codes = np.unique(field, return_inverse = True)
+        if blank.any():
+            # b'' sorts first
+            categories, codes = categories[1:], codes - 1
+        return pd.Categorical.from_codes(codes, _text(categories))
+
+    numbers = np.full(field.shape[0], np.nan)
+    try:
+        numbers[~blank] = field[~blank].astype(float)
+    except ValueError:
+        if dtype is None:
+            return np.where(blank, np.nan, _text(field).astype(object))
+        numbers[~blank] = pd.to_numeric(_text(field[~blank]), errors = 'coerce')
+
+    whole = not np.isnan(numbers).any() and (numbers == np.round(numbers)).all()
+    if dtype is None:
+        dtype = 'int64' if whole else 'float64'
+    elif np.dtype(dtype).kind in 'iu' and not whole:
+        return numbers
+    return numbers.astype(dtype)
+
+
+def _frame(records, names, specs, dtypes):
+    # records: one row of bytes per record, fields at specs
+    columns = []
+    for name, (start, end) in zip(names, specs):
+        block = np.array(records[:, start:end])
+        # trailing spaces to NUL, which numpy leaves out of the bytes
+        block[np.logical_and.accumulate(block[:, ::-1] == 32, axis = 1)[:, ::-1]] = 0
+        field = block.view('S%d' % (end - start)).ravel()
+        lead = block[:, 0] == 32
+        if lead.any():
+            field = field.copy()
+            field[lead] = np.char.lstrip(field[lead])
+        columns.append(_convert(field, dtypes.get(name)))
+    return pd.DataFrame(dict(zip(names, columns)), columns = names)
+
+
+def stream(filename, chunksize = 100000, dtypes = DTYPES):
+    """
+
+        reads a fwf file chunksize records at a time, without loading the whole file
+
+        Usage: for data in stream(filename): ...
+
+        Note: prints the rows read and the throughput in MB/s at the end
+    """
+
+    specs = colspecs()
+    width = specs[-1][1]
+    started = time.time()
+
+    try:
+        f = open(filename, 'rb')
+    except(IOError):
+        print('This file does not exist. Please, check the filename or the directory.')
+        sys.exit()
+
+    with f:
+        if os.path.getsize(filename) == 0:
+            # a zero-byte snapshot has no rows, and an empty file can't be memory-mapped
+            print('Read 0 rows, {0} is empty.'.format(filename))
+            return
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        header = mm.readline()
+        names = [str(_text(np.array([header[start:end].strip()]))[0]) for start, end in specs]
+        # skipping the dashes under the header
+        mm.readline()
+        body = np.frombuffer(mm, dtype = np.uint8)
+        pos, total, rows = mm.tell(), body.shape[0], 0
+        newline = mm.find(b'\n', pos)
+        reclen = newline - pos + 1 if newline >= 0 else total - pos
+
+        try:
+            while pos < total:
+                window = body[pos:min(pos + (chunksize + 1)*reclen, total)]
+                ends = np.flatnonzero(window == 10)[:chunksize] + 1
+                if (pos + window.shape[0] == total) and (ends.shape[0] < chunksize) and (ends[-1:] != window.shape[0]).all():
+                    # last line without a newline
+                    ends = np.r_[ends, window.shape[0]]
+                starts = np.r_[0, ends[:-1]]
+
+                if (reclen >= width) and (ends - starts == reclen).all():
+                    records = window[:ends[-1]].reshape(-1, reclen)
+                else:
+                    # lines of different lengths (e.g. trailing spaces cut off): pad with spaces
+                    records = np.full((ends.shape[0], max(width, (ends - starts).max())), 32, dtype = np.uint8)
+                    for k in range(ends.shape[0]):
+                        line = window[starts[k]:ends[k]]
+                        line = line[:line.shape[0] - ((line[-2:] == 10) | (line[-2:] == 13)).sum()]
+                        records[k, :line.shape[0]] = line
+                pos += ends[-1]
+
+                records = records[:, :width]
+                # skipping blank lines
+                records = records[~np.all((records == 32) | (records == 10) | (records == 13), axis = 1)]
+                if records.shape[0]:
+                    rows += records.shape[0]
+                    yield _frame(records, names, specs, dtypes)
+        finally:
+            # _frame copies the fields out, so only these views still use the mapping
+            body = window = records = line = None
+            mm.close()
+
+    elapsed = max(time.time() - started, 1e-9)
+    size = total/1e6
+    print('Read {0} rows, {1} MB in {2} s ({3} MB/s).'.format(rows, round(size, 1), round(elapsed, 2), round(size/elapsed, 1)))
+
+
+def read_fast(filename, chunksize = 100000):
+    """
+
+        reads a fwf file into a pandas data frame with the compact types in DTYPES
+
+        Usage: data = read_fast(filename)
+
+        Note: ETA and SchTime are float if some are blank or not whole seconds
+    """
+
+    chunks = list(stream(filename, chunksize))
+    if not chunks:
+        # empty file, or no records under the header
+        return pd.DataFrame(dict((col, pd.Series([], dtype = dtype)) for col, dtype in DTYPES.items()),
+                            columns = sorted(DTYPES))
+    data = pd.concat(chunks, ignore_index = True)
+    # categories can differ between chunks
+    for col in data.columns:
+        if DTYPES.get(col) == 'category' and data[col].dtype.name != 'category':
+            data[col] = data[col].astype('category')
+    return data
+
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,749 @@
+import os
+import numpy as np
+import requests
+import sqlite3
+import time
+
+
+"""
+Routing helpers for the rescheduler.
+
+OSRMTable collects the legs that insertFeasibility needs (schedule node -> URID location and
+URID location -> schedule node) and resolves them with OSRM's many-to-many table service, so a
+candidate run, or every candidate run of a URID, costs one HTTP request instead of one route
+request per outbound/inbound node pair.
+
+Usage:  table = OSRMTable()
+        table.add(URID_location, inbound, outbound)
+        table.fetch()
+        time_matrix = table.round_trips(URID_location, inbound, outbound)
+
+Routing engines are swappable: OSRMRouter talks to the public demo server or, with
+LOCAL_OSRM_URL, to a local osrm-routed instance; HaversineRouter is a fully offline estimator
+(haversine distance x detour factor / speed fitted from the schedule's own leg times). Install
+one with set_router(router); OSRMTable and the all_functions routing calls use it.
+
+TravelTimeCache keeps every leg that has been routed in a SQLite file, keyed by the 6-decimal
+rounded coordinate pair, so repeated reschedules of the same day (each one a separate
+busRescheduler.py process started by the webapp) hardly touch the routing server. Install one
+with set_cache(TravelTimeCache(path)); OSRMTable and the all_functions routing calls pick it up.
+"""
+
+
+OSRM_URL = "http://router.project-osrm.org"
+LOCAL_OSRM_URL = "http://127.0.0.1:5000"
+
+#travel time used when OSRM finds no route between two points (same as all_functions.osrm)
+NO_ROUTE = 50000000000
+
+
+#module wide travel time cache and routing engine, see set_cache and set_router
+_cache = None
+_router = None
+
+
+def coord_key(lat, lon):
+
+    """
+    Args:
+        lat/lon (float): coordinate pair
+
+    Returns:
+        (lat, lon) tuple rounded to 6 decimals, used as dictionary key for a location
+    """
+
+    return (round(float(lat), 6), round(float(lon), 6))
+
+
+def set_cache(cache):
+
+    """
+    Args:
+        cache (object): instance of TravelTimeCache shared by all routing calls, or None to turn caching off
+
+    Returns:
+        None
+    """
+
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+
+    """
+    Returns:
+        TravelTimeCache installed with set_cache, or None
+    """
+
+    return _cache
+
+
+def set_router(router):
+
+    """
+    Args:
+        router (object): instance of OSRMRouter or HaversineRouter used by all routing calls
+
+    Returns:
+        None
+    """
+
+    global _router
+    _router = router
+
+
+def get_router():
+
+    """
+    Returns:
+        router installed with set_router, by default an OSRMRouter on the public demo server
+    """
+
+    global _router
+    if _router is None:
+        _router = OSRMRouter()
+    return _router
+
+
+def haversine_matrix(origins, destinations):
+
+    """
+    Args:
+        origins (array): n x 2 array of lats and lons
+        destinations (array): m x 2 array of lats and lons
+
+    Returns:
+        n x m array of great circle distances in meters
+    """
+
+    origins = np.radians(np.asarray(origins, dtype = float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype = float).reshape(-1, 2))
+    dlat = destinations[:, 0][np.newaxis, :] - origins[:, 0][:, np.newaxis]
+    dlon = destinations[:, 1][np.newaxis, :] - origins[:, 1][:, np.newaxis]
+    h = np.sin(dlat/2)**2 + np.cos(origins[:, 0])[:, np.newaxis]*np.cos(destinations[:, 0])[np.newaxis, :]*np.sin(dlon/2)**2
+    return 2*6371008.8*np.arcsin(np.sqrt(np.minimum(h, 1.)))
+
+
+class OSRMRouter():
+
+    """
+    Routing engine backed by an OSRM server.
+
+    Attributes:
+    osrm_url (str): base url of OSRM server, without the service path. OSRM_URL for the public
+    demo server, LOCAL_OSRM_URL for an osrm-routed instance on this machine.
+    max_coords (int): maximum number of coordinates the server accepts in one table request
+    workers (int): number of route requests all_functions.osrm sends at once
+    timeout (float): seconds to wait for the server on each request
+    retries (int): number of times a failed request is tried again
+    backoff (float): seconds to wait before the first retry, doubled on each further retry
+    session (object): requests.Session shared by all requests, keeps connections to the server alive
+    cacheable (bool): True, results are exact and can go into a TravelTimeCache
+    requests_made (int): number of route and table requests sent to the server
+
+    """
+
+    cacheable = True
+
+    def __init__(self, osrm_url = OSRM_URL, max_coords = 100, workers = 8, timeout = 10., retries = 3, backoff = 0.5):
+
+        """
+        Args:
+        osrm_url (str): base url of OSRM server
+        max_coords (int): maximum number of coordinates in one table request
+        workers (int): default 8, concurrency limit for route requests
+        timeout (float): default 10., per request timeout in seconds
+        retries (int): default 3, retries of a request that timed out, failed to connect or got a 429/5xx
+        backoff (float): default 0.5, seconds before the first retry
+
+        """
+
+        self.osrm_url = osrm_url.rstrip('/')
+        self.max_coords = max_coords
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = max(1, workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests_made = 0
+
+    def get_json(self, url):
+
+        """
+        Args:
+        url (str): OSRM request
+
+        Returns:
+        json object of the response, retrying with exponential backoff. Raises the last
+        requests.exceptions.RequestException if every try failed, also when the server kept
+        answering with something that isn't json (e.g. a proxy's HTML error page).
+        """
+
+        for attempt in range(self.retries + 1):
+            self.requests_made += 1
+            try:
+                response = self.session.get(url, timeout = self.timeout)
+                #OSRM answers NoRoute etc. with a 400 and a json body, only retry server trouble
+                if (response.status_code == 429) or (response.status_code >= 500):
+                    response.raise_for_status()
+                try:
+                    return response.json()
+                except ValueError:
+                    raise requests.exceptions.RequestException('response is not json (status {0}): {1!r}'.format(
+                        response.status_code, response.text[:80]), response = response)
+            except requests.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+    def route(self, coords):
+
+        """
+        Args:
+        coords (list): (lat, lon) waypoints, in driving order
+
+        Returns:
+        json object of OSRM's route service, with one entry in 'legs' per pair of waypoints
+        """
+
+        route_url = self.osrm_url + "/route/v1/driving/" + ";".join([str(lon) + "," + str(lat) for lat, lon in coords]) + "?overview=false"
+        return self.get_json(route_url)
+
+    def table(self, sources, destinations):
+
+        """
+        Args:
+        sources (list): (lat, lon) origins
+        destinations (list): (lat, lon) destinations
+
+        Returns:
+        len(sources) x len(destinations) list of travel times, None where OSRM found no route
+        """
+
+        coords = list(sources) + list(destinations)
+        table_url = self.osrm_url + "/table/v1/driving/" + ";".join([str(lon) + "," + str(lat) for lat, lon in coords])
+        table_url += "?sources=" + ";".join([str(k) for k in range(len(sources))])
+        table_url += "&destinations=" + ";".join([str(k) for k in range(len(sources), len(coords))])
+        try:
+            table_results = self.get_json(table_url)
+        except requests.exceptions.RequestException as e:
+            print("TABLE REQUEST ERROR: {0}".format(e))
+            table_results = {}
+        if not table_results or table_results.get('code', 'Ok') != 'Ok':
+            print("TABLE REQUEST FAILED FOR {0} SOURCES AND {1} DESTINATIONS".format(len(sources), len(destinations)))
+            return [[None]*len(destinations) for k in range(len(sources))]
+
+        return table_results['durations']
+
+
+class HaversineRouter():
+
+    """
+    Offline routing estimator: street distance is taken as haversine distance times a detour factor,
+    travel time as that distance over an average speed. Needs no network, so every candidate run
+    can be screened before spending OSRM requests on the best few.
+
+    Attributes:
+    detour (float): ratio of street network distance to great circle distance
+    speed (float): average driving speed in meters per second
+    max_coords (None): no limit on table size
+    cacheable (bool): False, estimates must not go into a TravelTimeCache
+
+    """
+
+    cacheable = False
+    max_coords = None
+
+    def __init__(self, detour = 1.3, speed = 10.):
+
+        """
+        Args:
+        detour (float): default 1.3, ratio of street distance to great circle distance
+        speed (float): default 10. m/s (about 22 mph), average driving speed
+
+        """
+
+        self.detour = detour
+        self.speed = speed
+
+    def fit(self, data, min_time = 60., min_dist = 200.):
+
+        """
+        Fit speed from the leg times of a schedule: consecutive stops of a run, ETA difference
+        less dwell time at the first stop, against detour x haversine distance.
+
+        Args:
+        data (dataframe): one or more days of schedule with Run, ETA, DwellTime, LAT and LON columns
+        min_time (float): legs shorter than this many seconds are ignored
+        min_dist (float): legs shorter than this many meters are ignored
+
+        Returns:
+        self, with speed updated if there were usable legs
+        """
+
+        same_run = np.array(data.Run)[1:] == np.array(data.Run)[:-1]
+        eta = np.array(data.ETA, dtype = float)
+        dwell = np.nan_to_num(np.array(data.DwellTime, dtype = float))
+        leg_time = eta[1:] - eta[:-1] - dwell[:-1]
+        coords = np.column_stack((np.array(data.LAT, dtype = float), np.array(data.LON, dtype = float)))
+        lat1, lon1, lat2, lon2 = map(np.radians, [coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]])
+        h = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+        leg_dist = self.detour*2*6371008.8*np.arcsin(np.sqrt(np.minimum(h, 1.)))
+
+        ok = same_run & (leg_time > min_time) & (leg_dist > min_dist) & np.isfinite(leg_time) & np.isfinite(leg_dist)
+        if ok.any():
+            #median of leg speeds, so long waits that are scheduled into a leg don't drag it down
+            self.speed = float(np.median(leg_dist[ok]/leg_time[ok]))
+        return self
+
+    def route(self, coords):
+
+        """
+        Args:
+        coords (list): (lat, lon) waypoints, in driving order
+
+        Returns:
+        dictionary shaped like OSRM's route service output
+        """
+
+        coords = np.asarray(coords, dtype = float)
+        dist = [float(self.detour*haversine_matrix(coords[k], coords[k+1])[0, 0]) for k in range(coords.shape[0] - 1)]
+        legs = [{'distance': d, 'duration': d/self.speed} for d in dist]
+        return {'code': 'Ok', 'routes': [{'distance': sum(dist), 'duration': sum(dist)/self.speed, 'legs': legs}]}
+
+    def table(self, sources, destinations):
+
+        """
+        Args:
+        sources (list): (lat, lon) origins
+        destinations (list): (lat, lon) destinations
+
+        Returns:
+        len(sources) x len(destinations) array of estimated travel times
+        """
+
+        return self.detour*haversine_matrix(sources, destinations)/self.speed
+
+
+class TravelTimeCache():
+
+    """
+    Persistent travel time store backed by a SQLite file. Several processes can share one file.
+
+    The connection is opened on first use by each process, so worker processes forked while a
+    cache is installed open their own instead of sharing the parent's; close it when the run ends.
+    Lookups don't write: the access times least recently used eviction goes by are kept in memory
+    and written with the next put (or on close).
+
+    Attributes:
+    path (str): location of the SQLite file
+    ttl (float): seconds after which a cached leg is routed again
+    max_entries (int): number of legs kept; least recently used legs are dropped past this size
+    hits (int): lookups answered from the cache by this process
+    misses (int): lookups that had to go to the routing server
+    entries (int): legs in the file as of the last count, plus the legs put since (an upper bound)
+    touched (dict): leg key -> time of the lookups not yet written to the file
+
+    """
+
+    def __init__(self, path, ttl = 30*24*3600., max_entries = 500000):
+
+        """
+        Args:
+        path (str): location of the SQLite file, created if it doesn't exist
+        ttl (float): seconds a cached leg stays valid
+        max_entries (int): size bound of the cache
+
+        """
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = 0
+        self.touched = {}
+        self._conn = None
+        self._pid = None
+        self.conn.execute('CREATE TABLE IF NOT EXISTS legs (leg TEXT PRIMARY KEY, duration REAL, distance REAL, created REAL, accessed REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS legs_accessed ON legs (accessed)')
+        self.conn.commit()
+        self.entries = self.conn.execute('SELECT COUNT(*) FROM legs').fetchone()[0]
+
+    @property
+    def conn(self):
+
+        """
+        Returns:
+        sqlite3 connection of this process, opened if there isn't one yet
+        """
+
+        if (self._conn is None) or (self._pid != os.getpid()):
+            if (self._conn is not None) and (self._pid != os.getpid()):
+                #inherited through fork: it belongs to the parent, so it is kept (closing it here could
+                #upset the parent's locks) but not used, and the parent writes its own access times
+                self._inherited = self._conn
+                self.touched = {}
+            self._conn = sqlite3.connect(self.path, timeout = 30.)
+            self._pid = os.getpid()
+            #write ahead log lets concurrent rescheduler processes read while one writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        return self._conn
+
+    def close(self):
+
+        """
+        Writes pending access times and closes this process's connection. The cache can still be
+        used afterwards, it opens a new connection.
+
+        """
+
+        if (self._conn is not None) and (self._pid == os.getpid()):
+            self.flush()
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def flush(self):
+
+        """
+        Writes the access times of the lookups since the last flush.
+
+        """
+
+        if self.touched:
+            self.conn.executemany('UPDATE legs SET accessed = ? WHERE leg = ?', [(t, key) for key, t in self.touched.items()])
+            self.conn.commit()
+            self.touched = {}
+
+    def key(self, origin, destination):
+
+        """
+        Args:
+        origin (tuple): (lat, lon) where leg starts
+        destination (tuple): (lat, lon) where leg ends
+
+        Returns:
+        string key "lat,lon;lat,lon" with coordinates rounded to 6 decimals
+        """
+
+        o = coord_key(*origin); d = coord_key(*destination)
+        return '%.6f,%.6f;%.6f,%.6f' % (o[0], o[1], d[0], d[1])
+
+    def get_many(self, legs, need_distance = False):
+
+        """
+        Args:
+        legs (list): (origin, destination) tuples
+        need_distance (bool): default False, make True to only count legs with a cached distance as hits
+
+        Returns:
+        dictionary leg -> (duration, distance) for the legs found in the cache and not expired
+        """
+
+        legs = list(legs)
+        keys = dict([(self.key(*leg), leg) for leg in legs])
+        now = time.time()
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i+500]
+            rows = self.conn.execute('SELECT leg, duration, distance FROM legs WHERE created > ? AND leg IN (' +
+                                     ','.join(['?']*len(chunk)) + ')', [now - self.ttl] + chunk).fetchall()
+            for leg, duration, distance in rows:
+                #a NaN time stored before put_many skipped them
+                if (duration is None) or (need_distance and distance is None):
+                    continue
+                found[keys[leg]] = (duration, distance)
+
+        for leg in found:
+            self.touched[self.key(*leg)] = now
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, origin, destination, need_distance = False):
+
+        """
+        Args:
+        origin (tuple): (lat, lon) where leg starts
+        destination (tuple): (lat, lon) where leg ends
+        need_distance (bool): default False, make True to only accept legs with a cached distance
+
+        Returns:
+        (duration, distance) tuple, or None if the leg isn't cached
+        """
+
+        leg = (coord_key(*origin), coord_key(*destination))
+        return self.get_many([leg], need_distance).get(leg)
+
+    def put_many(self, values):
+
+        """
+        Args:
+        values (list): (origin, destination, duration, distance) tuples, distance may be None
+
+        Returns:
+        None
+        """
+
+        now = time.time()
+        rows = []
+        for origin, destination, duration, distance in values:
+            #don't remember failed requests, or NaN times (sqlite keeps NaN as NULL, which reads back as None)
+            if duration is None or not duration < NO_ROUTE:
+                continue
+            key = self.key(origin, destination)
+            rows.append((key, duration, distance, key, now, now))
+        if not rows:
+            return None
+
+        #a table request only gives durations, keep any distance we already know
+        self.conn.executemany('INSERT OR REPLACE INTO legs VALUES (?, ?, COALESCE(?, (SELECT distance FROM legs WHERE leg = ?)), ?, ?)', rows)
+        self.flush()
+        self.conn.commit()
+        #replaced legs are counted too, so the table is only counted again once it may be over size
+        self.entries += len(rows)
+        if self.entries > self.max_entries:
+            self.evict()
+        return None
+
+    def put(self, origin, destination, duration, distance = None):
+
+        """
+        Args:
+        origin (tuple): (lat, lon) where leg starts
+        destination (tuple): (lat, lon) where leg ends
+        duration (float): travel time in seconds
+        distance (float): default None, travel distance in meters
+
+        Returns:
+        None
+        """
+
+        return self.put_many([(origin, destination, duration, distance)])
+
+    def evict(self):
+
+        """
+        Drop expired legs, then least recently used legs past 90% of max_entries, so the puts that
+        follow don't have to evict again right away.
+
+        Returns:
+        number of legs removed
+        """
+
+        self.flush()
+        removed = self.conn.execute('DELETE FROM legs WHERE created <= ?', [time.time() - self.ttl]).rowcount
+        self.entries = self.conn.execute('SELECT COUNT(*) FROM legs').fetchone()[0]
+        extra = self.entries - int(0.9*self.max_entries)
+        if extra > 0:
+            dropped = self.conn.execute('DELETE FROM legs WHERE leg IN (SELECT leg FROM legs ORDER BY accessed LIMIT ?)', [extra]).rowcount
+            self.entries -= dropped
+            removed += dropped
+        self.conn.commit()
+        return removed
+
+    def stats(self):
+
+        """
+        Returns:
+        dictionary with hits, misses and number of legs stored
+        """
+
+        self.entries = self.conn.execute('SELECT COUNT(*) FROM legs').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self.entries}
+
+
+class OSRMTable():
+
+    """
+    Batches origin/destination legs into table requests of a routing engine.
+
+    Attributes:
+    router (object): OSRMRouter or HaversineRouter answering the table requests
+    cache (object): TravelTimeCache for exact routers, None for estimators
+    durations (dict): (origin, destination) -> travel time in seconds for every leg fetched so far
+    pending (set): legs that have been added but not fetched yet
+    requests_made (int): number of table requests sent to the router
+
+    """
+
+    def __init__(self, router = None, cache = None):
+
+        """
+        Args:
+        router (object): routing engine, default None uses the one from set_router
+        cache (object): TravelTimeCache to read from and write to, default None uses the one from set_cache
+
+        """
+
+        self.router = router if router is not None else get_router()
+        self.cache = cache if cache is not None else get_cache()
+        if not self.router.cacheable:
+            self.cache = None
+        self.durations = {}
+        self.pending = set()
+        self.requests_made = 0
+
+    def add_leg(self, origin, destination):
+
+        """
+        Args:
+        origin (tuple): (lat, lon) where leg starts
+        destination (tuple): (lat, lon) where leg ends
+
+        """
+
+        leg = (coord_key(*origin), coord_key(*destination))
+        if leg not in self.durations:
+            self.pending.add(leg)
+
+    def add(self, URID_location, inbound, outbound):
+
+        """
+        Queue legs from every outbound node to the URID location and from the URID location to every
+        inbound node, i.e. everything round_trips needs for the same arguments.
+
+        Args:
+        URID_location (list): lat/lon of URID pick up or drop off
+        inbound (array): stores inbound node lats and lons
+        outbound (array): stores outbound node lats and lons
+
+        """
+
+        for k in range(outbound.shape[0]):
+            self.add_leg(outbound[k, :], URID_location)
+        for k in range(inbound.shape[0]):
+            self.add_leg(URID_location, inbound[k, :])
+
+    def blocks(self, sources, destinations):
+
+        """
+        Args:
+        sources (list): (lat, lon) origins
+        destinations (list): (lat, lon) destinations
+
+        Returns:
+        list of (sources, destinations) chunks that each fit in one table request. The shorter
+        list is kept whole where possible so star shaped legs (many nodes to one URID) need few requests.
+        """
+
+        max_coords = self.router.max_coords
+        if (max_coords is None) or (len(sources) + len(destinations) <= max_coords):
+            return [(sources, destinations)]
+
+        half = max(1, max_coords // 2)
+        if min(len(sources), len(destinations)) <= half:
+            size = max_coords - min(len(sources), len(destinations))
+            if len(sources) <= len(destinations):
+                return [(sources, destinations[i:i+size]) for i in range(0, len(destinations), size)]
+            return [(sources[i:i+size], destinations) for i in range(0, len(sources), size)]
+
+        return [(sources[i:i+half], destinations[j:j+half])
+                for i in range(0, len(sources), half) for j in range(0, len(destinations), half)]
+
+    def fetch(self):
+
+        """
+        Resolve all pending legs. Legs are split into several table requests only if there are more
+        than max_coords distinct coordinates: legs heading into a few shared locations are grouped
+        apart from legs leaving a few shared locations.
+
+        Returns:
+        number of table requests made
+        """
+
+        if self.pending and self.cache is not None:
+            for leg, value in self.cache.get_many(self.pending).items():
+                self.durations[leg] = value[0]
+            self.pending = set([leg for leg in self.pending if leg not in self.durations])
+
+        if not self.pending:
+            return 0
+
+        sources = set([leg[0] for leg in self.pending])
+        destinations = set([leg[1] for leg in self.pending])
+        if (self.router.max_coords is None) or (len(sources) + len(destinations) <= self.router.max_coords):
+            groups = [self.pending]
+        else:
+            n_from = dict(); n_to = dict()
+            for leg in self.pending:
+                n_from[leg[0]] = n_from.get(leg[0], 0) + 1
+                n_to[leg[1]] = n_to.get(leg[1], 0) + 1
+            into_hubs = set([leg for leg in self.pending if n_to[leg[1]] >= n_from[leg[0]]])
+            groups = [into_hubs, self.pending - into_hubs]
+
+        ctr = 0
+        for legs in groups:
+            if not legs:
+                continue
+            sources = sorted(set([leg[0] for leg in legs]))
+            destinations = sorted(set([leg[1] for leg in legs]))
+            for src, dst in self.blocks(sources, destinations):
+                #skip blocks that contain none of the legs we asked for
+                if not any([(o, d) in legs for o in src for d in dst]):
+                    continue
+                times = self.router.table(src, dst)
+                self.requests_made += 1
+                ctr += 1
+                for i in range(len(src)):
+                    for j in range(len(dst)):
+                        self.durations[(src[i], dst[j])] = NO_ROUTE if times[i][j] is None else times[i][j]
+
+        if self.cache is not None:
+            self.cache.put_many([(leg[0], leg[1], self.durations[leg], None) for leg in self.pending])
+        self.pending = set()
+        return ctr
+
+    def duration(self, origin, destination):
+
+        """
+        Args:
+        origin (tuple): (lat, lon) where leg starts
+        destination (tuple): (lat, lon) where leg ends
+
+        Returns:
+        travel time in seconds, fetching the leg first if it hasn't been requested yet
+        """
+
+        leg = (coord_key(*origin), coord_key(*destination))
+        if leg not in self.durations:
+            self.pending.add(leg)
+            self.fetch()
+        return self.durations[leg]
+
+    def round_trips(self, URID_location, inbound, outbound):
+
+        """
+        Same output as all_functions.osrm, built from the table.
+
+        Args:
+        URID_location (list): lat/lon for URID locations both inbound and outbound
+        inbound (array): stores inbound node lats and lons
+        outbound (array): stores outbound node lats and lons
+
+        Returns:
+        (n,1) array of total travel times outbound[k] -> URID -> inbound[k]
+        """
+
+        self.add(URID_location, inbound, outbound)
+        self.fetch()
+
+        total_times = []
+        for k in range(outbound.shape[0]):
+            leg_out = self.duration(outbound[k, :], URID_location)
+            leg_in = self.duration(URID_location, inbound[k, :])
+            if (leg_out == NO_ROUTE) | (leg_in == NO_ROUTE):
+                print("FOUND NO ROUTE FROM INDEX {0} to URID location".format((outbound[k,0], outbound[k,1])))
+                total_times += [NO_ROUTE]
+            else:
+                total_times += [leg_out + leg_in]
+
+        a = np.array([total_times])
+
+        return(a.T)
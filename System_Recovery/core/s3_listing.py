@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+import time
+
+
+"""
+Listing of the streaming snapshots in the paratransitdata S3 bucket.
+
+Snapshots are written to streaming_data/Schedules_YYYYMMDD..., so today's files are listed by
+asking S3 for that prefix only, not by listing the whole bucket and filtering the names. S3 lists
+keys in name order, so once a day's prefix has been listed, the next call only asks for the keys
+after the last one seen (marker); the cost of a call grows with the snapshots written since the
+last one, not with the bucket's history.
+
+Snapshots can be uploaded empty, so the one to use is the newest (last_modified, then name) that
+isn't smaller than min_size, rather than the last name on the list.
+
+    bucket = S3Connection(AWS_ACCESS_KEY, AWS_SECRET_KEY).get_bucket('paratransitdata')
+    listing = snapshot_listing(bucket, day_prefix(), path = os.path.join(path_to_outdir, 's3_listing.json'))
+    name = listing.newest()
+
+The webapp reschedules in a new process every time, so the listing is kept in a file (path) for
+the next process to go on from; without path it is only kept for as long as this process runs.
+"""
+
+
+PREFIX = 'streaming_data/Schedules_'
+
+#bucket name -> SnapshotListing of the day last asked for, for calls without path
+_listings = {}
+
+
+def day_prefix(day = None):
+
+    """
+    Args:
+    day (struct_time): default None for today (local time)
+
+    Returns:
+    key prefix of the day's streaming snapshots, e.g. streaming_data/Schedules_20161005
+    """
+
+    if day is None:
+        day = time.localtime()
+    return PREFIX + time.strftime('%Y%m%d', day)
+
+
+class SnapshotListing():
+
+    """
+    Attributes:
+    bucket (boto Bucket): bucket the snapshots are in
+    prefix (str): key prefix listed
+    keys (dict): key name -> (size in bytes, last_modified as listed, ISO 8601)
+    calls (int): number of list requests made in this process
+    listed (int): number of keys S3 returned over all of them
+
+    """
+
+    def __init__(self, bucket, prefix):
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.keys = {}
+        self.calls = 0
+        self.listed = 0
+
+    def marker(self):
+
+        """
+        Returns:
+        name to list after: the last key seen, or the key before the first empty one, since an
+        empty snapshot can be written over with its contents later ('' to list the whole prefix)
+        """
+
+        names = sorted(self.keys)
+        marker = ''
+        for name in names:
+            if self.keys[name][0] == 0:
+                break
+            marker = name
+        return marker
+
+    def refresh(self):
+
+        """
+        Lists the keys under prefix after marker() and adds them to keys.
+
+        Returns:
+        number of keys listed
+        """
+
+        marker = self.marker()
+        count = 0
+        for key in self.bucket.list(prefix = self.prefix, marker = marker):
+            self.keys[key.name] = (int(key.size), key.last_modified)
+            count += 1
+        self.calls += 1
+        self.listed += count
+        return count
+
+    def newest(self, min_size = 1):
+
+        """
+        Args:
+        min_size (int): default 1, snapshots smaller than this many bytes are skipped
+
+        Returns:
+        name of the newest snapshot of at least min_size bytes, None if there isn't one
+        """
+
+        names = [name for name, (size, modified) in self.keys.items() if size >= min_size]
+        if not names:
+            return None
+        return max(names, key = lambda name: (self.keys[name][1], name))
+
+    def save(self, path):
+
+        """
+        Writes prefix and keys to path, for load to go on from.
+
+        Args:
+        path (str): JSON file, replaced if it exists
+
+        """
+
+        state = {'bucket': self.bucket.name, 'prefix': self.prefix,
+                 'keys': dict((name, list(value)) for name, value in self.keys.items())}
+        #written under a temporary name and renamed, so a process started meanwhile never reads half a file
+        fd, tmp = tempfile.mkstemp(suffix = '.json', dir = os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #Windows won't rename over an existing file
+            os.remove(path)
+            os.rename(tmp, path)
+
+
+def load(bucket, path):
+
+    """
+    Args:
+    bucket (boto Bucket): bucket the snapshots are in
+    path (str): file written by SnapshotListing.save
+
+    Returns:
+    SnapshotListing saved in path, None if there is none for bucket or it can't be read
+    """
+
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        if state['bucket'] != bucket.name:
+            return None
+        listing = SnapshotListing(bucket, str(state['prefix']))
+        listing.keys = dict((str(name), (int(size), str(modified))) for name, (size, modified) in state['keys'].items())
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+    return listing
+
+
+def snapshot_listing(bucket, prefix, refresh = True, path = None):
+
+    """
+    Args:
+    bucket (boto Bucket): bucket the snapshots are in
+    prefix (str): key prefix, e.g. day_prefix()
+    refresh (bool): default True, list the keys added since the last call
+    path (str): default None, JSON file the listing is kept in between processes, e.g. in
+    path_to_outdir. None keeps it in this process only.
+
+    Returns:
+    SnapshotListing of prefix, kept between calls (a new prefix for the bucket, e.g. the next day,
+    starts a new one)
+    """
+
+    listing = _listings.get(bucket.name) if path is None else load(bucket, path)
+    if (listing is None) or (listing.prefix != prefix):
+        listing = SnapshotListing(bucket, prefix)
+    if path is None:
+        _listings[bucket.name] = listing
+    #each call may come with a new connection
+    listing.bucket = bucket
+    if refresh:
+        listing.refresh()
+    if path is not None:
+        listing.save(path)
+    return listing
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+"""
+On-disk cache of processed day schedules (time windows and wc/am capacity, as
+TimeWindowsCapacity.addtoRun_TimeCapacity gives them), so rescheduling the same snapshot again,
+e.g. a dispatcher trying another broken run, loads the day instead of reading and processing it.
+
+Entries are keyed by the SHA-1 of the source file's contents and the time window size, and
+stored column by column in a NumPy .npz file: numeric columns as they are, object columns (Run,
+SpaceOn, ...) as integer codes plus their distinct strings, so nothing is pickled. Strings are kept
+as they are, bytes on python 2 (which may not be ASCII, e.g. in MobAids) and text on python 3.
+
+    cache = ScheduleCache(os.path.join(path_to_outdir, 'schedule_cache'))
+    digest = file_digest(schedule_filename)
+    fullSchedule_windows = cache.load(digest, windows)
+    if fullSchedule_windows is None:
+        fullSchedule_windows = aTWC.TimeWindowsCapacity(data).addtoRun_TimeCapacity(windows)
+        cache.save(digest, windows, fullSchedule_windows)
+"""
+
+
+#bump when the processing of the day changes, so older entries aren't loaded
+VERSION = 1
+
+#numpy type of str: bytes on python 2, so strings that aren't ASCII are stored without decoding them
+STR = 'S' if str is bytes else 'U'
+
+
+def file_digest(filename, blocksize = 1 << 20):
+
+    """
+    Args:
+    filename (str): file to hash
+    blocksize (int): bytes read at a time
+
+    Returns:
+    SHA-1 hex digest of the file's contents
+    """
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            digest.update(block)
+            block = f.read(blocksize)
+    return digest.hexdigest()
+
+
+def to_arrays(data):
+
+    """
+    Args:
+    data (dataframe): schedule, one row per position (RangeIndex)
+
+    Returns:
+    dict of arrays for np.savez, None if a column can't be stored without pickling
+    """
+
+    arrays = {'columns': np.array([str(col) for col in data.columns], dtype = STR)}
+    for k, col in enumerate(data.columns):
+        values = np.asarray(data[col])
+        if values.dtype != object:
+            arrays['c%d' % k] = values
+            continue
+        codes, names = pd.factorize(values)
+        if not all(isinstance(name, str) for name in names):
+            return None
+        arrays['c%d.codes' % k] = codes
+        arrays['c%d.names' % k] = np.array(list(names), dtype = STR)
+    return arrays
+
+
+def from_arrays(arrays):
+
+    """
+    Args:
+    arrays (mapping): as to_arrays gives them, e.g. a loaded .npz
+
+    Returns:
+    dataframe of the schedule, object columns holding str and NaN for nulls
+    """
+
+    columns = [str(col) for col in arrays['columns']]
+    values = {}
+    for k, col in enumerate(columns):
+        if 'c%d' % k in arrays:
+            values[col] = arrays['c%d' % k]
+        else:
+            codes = arrays['c%d.codes' % k]
+            names = np.array([str(name) for name in arrays['c%d.names' % k]] + [np.nan], dtype = object)
+            # code -1 (null) picks the trailing NaN
+            values[col] = names[codes]
+    return pd.DataFrame(values, columns = columns)
+
+
+class ScheduleCache():
+
+    """
+    Attributes:
+    directory (str): where the .npz entries are kept
+    keep (int): number of entries kept; the least recently used are removed past this
+    hits (int): loads answered from the cache
+    misses (int): loads that found no entry
+
+    """
+
+    def __init__(self, directory, keep = 32):
+
+        """
+        Args:
+        directory (str): where the .npz entries are kept, created if it doesn't exist
+        keep (int): size bound of the cache, in entries
+
+        """
+
+        self.directory = directory
+        self.keep = keep
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, digest, windows):
+
+        """
+        Args:
+        digest (str): file_digest of the source file
+        windows (float): pickup/dropoff time window in seconds
+
+        Returns:
+        path of the entry for the source processed with windows
+        """
+
+        return os.path.join(self.directory, 'schedule_v{0}_{1}_{2!r}.npz'.format(VERSION, digest, float(windows)))
+
+    def load(self, digest, windows):
+
+        """
+        Args:
+        digest (str): file_digest of the source file
+        windows (float): pickup/dropoff time window in seconds
+
+        Returns:
+        processed schedule saved for the source and windows, None if there isn't one
+        """
+
+        path = self.path(digest, windows)
+        try:
+            with np.load(path) as arrays:
+                data = from_arrays(arrays)
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        #keeps recently used entries from being pruned
+        os.utime(path, None)
+        self.hits += 1
+        return data
+
+    def save(self, digest, windows, data):
+
+        """
+        Args:
+        digest (str): file_digest of the source file
+        windows (float): pickup/dropoff time window in seconds
+        data (dataframe): schedule of the source processed with windows
+
+        Returns:
+        path of the entry, None if data can't be cached
+        """
+
+        arrays = to_arrays(data)
+        if (arrays is None) or not data.index.equals(pd.RangeIndex(data.shape[0])):
+            return None
+        path = self.path(digest, windows)
+        #written under a temporary name and renamed, so concurrent rescheduler processes never load half an entry
+        fd, tmp = tempfile.mkstemp(suffix = '.npz', dir = self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #another process saved the same entry first (Windows won't rename over it)
+            os.remove(tmp)
+        self.prune()
+        return path
+
+    def prune(self):
+
+        """
+        Removes the least recently used entries past keep.
+
+        """
+
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.startswith('schedule_') and name.endswith('.npz')]
+        entries.sort(key = os.path.getmtime, reverse = True)
+        for path in entries[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
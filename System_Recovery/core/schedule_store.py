@@ -0,0 +1,269 @@
+import numpy as np
+import pandas as pd
+
+
+"""
+Run-partitioned view of a day's schedule, so a run or a booking's rows are found with a dictionary
+lookup instead of a boolean scan of the whole day (data[data['Run'] == run]).
+
+The day stays one DataFrame, with its columns kept as NumPy arrays. Rows of a run are normally
+consecutive, so a run is a slice of those arrays (and an iloc slice of the frame); runs that are
+split up fall back to an array of row positions.
+
+Build it when the schedule is loaded, and again after all_functions.day_schedule_Update
+rearranges it, like the spatial and window indexes:
+    store = ScheduleStore(fullSchedule_windows)
+    this_run = store.run(run)
+    runSchedule = get_busRuns(fullSchedule_windows, run, None, store = store)
+
+ScheduleLog keeps what day_schedule_Update(inplace = True) changes, the URID's two rows and the
+ETAs of the run it went to, so the day as it was loaded can be had back with rollback instead of
+copying it up front. The capacity of the runs involved is recomputed afterwards:
+    log = ScheduleLog()
+    fullSchedule_windows = day_schedule_Update(fullSchedule_windows, top_Feasibility, URID, inplace = True, log = log)
+    ...
+    runs = log.runs()
+    fullSchedule_windows = log.rollback(fullSchedule_windows)
+    fullSchedule_windows = TimeWindowsCapacity(fullSchedule_windows).update_Runs(runs)
+"""
+
+
+def group_rows(keys):
+
+    """
+    Args:
+    keys (array): key of each row, e.g. Run; null keys are left out
+
+    Returns:
+    dict key -> slice of the rows with that key if they are consecutive, else array of their positions
+    """
+
+    codes, names = pd.factorize(np.asarray(keys))
+    order = np.argsort(codes, kind = 'mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+    groups = {}
+    for k in range(len(names)):
+        positions = order[bounds[k]:bounds[k + 1]]
+        if positions[-1] - positions[0] + 1 == positions.shape[0]:
+            groups[names[k]] = slice(positions[0], positions[-1] + 1)
+        else:
+            groups[names[k]] = positions
+    return groups
+
+
+def move_rows(data, rows, targets):
+
+    """
+    Takes rows out of data and puts them back in at targets, in place. The rows between shift by
+    one position for each row moved past them; every other row stays where it is.
+
+    Args:
+    data (dataframe): schedule, one row per position (RangeIndex)
+    rows (list): positions of the rows to move, ascending
+    targets (list): positions the rows end up at, ascending, same length as rows
+
+    Returns:
+    (lo, hi), the positions that changed are lo:hi
+    """
+
+    rows, targets = np.asarray(rows, dtype = int), np.asarray(targets, dtype = int)
+    lo = min(rows[0], targets[0])
+    hi = max(rows[-1], targets[-1]) + 1
+    order = np.delete(np.arange(lo, hi), rows - lo)
+    for row, target in zip(rows, targets):
+        order = np.insert(order, target - lo, row)
+    for col in data.columns:
+        #the column's values are a view of the frame, so this writes into data
+        values = data[col].values
+        values[lo:hi] = values[order]
+    return lo, hi
+
+
+class ScheduleStore():
+
+    """
+    Attributes:
+    frame (dataframe): the day's schedule, for code that needs a DataFrame
+    columns (dict): column name -> NumPy array of that column
+    runs (dict): Run -> slice (or positions) of its rows
+    bookings (dict): BookingId -> slice (or positions) of its rows
+
+    """
+
+    def __init__(self, data):
+
+        """
+        Args:
+        data (dataframe): day's schedule with Run and BookingId columns, one row per position (RangeIndex)
+
+        """
+
+        self.frame = data
+        self.columns = dict((col, np.asarray(data[col])) for col in data.columns)
+        self.runs = group_rows(self.columns['Run'])
+        self.bookings = group_rows(self.columns['BookingId'])
+
+    def positions(self, run):
+
+        """
+        Args:
+        run (str): bus run
+
+        Returns:
+        array of row positions of the run, empty if it isn't in the schedule
+        """
+
+        rows = self.runs.get(run)
+        if rows is None:
+            return np.array([], dtype = int)
+        if isinstance(rows, slice):
+            return np.arange(rows.start, rows.stop)
+        return rows
+
+    def run(self, run):
+
+        """
+        Args:
+        run (str): bus run
+
+        Returns:
+        dataframe of the run's rows, same as data[data['Run'] == run]
+        """
+
+        return self.frame.iloc[self.runs.get(run, slice(0, 0))]
+
+    def column(self, run, col):
+
+        """
+        Args:
+        run (str): bus run
+        col (str): column name
+
+        Returns:
+        array of col for the run's rows
+        """
+
+        return self.columns[col][self.runs.get(run, slice(0, 0))]
+
+    def booking(self, BookingId):
+
+        """
+        Args:
+        BookingId (float): booking
+
+        Returns:
+        dataframe of the booking's rows (pick up and drop off), same as data[data['BookingId'] == BookingId]
+        """
+
+        return self.frame.iloc[self.bookings.get(BookingId, slice(0, 0))]
+
+    def bus_run(self, run, URID = None):
+
+        """
+        Same rows as all_functions.get_busRuns: from the start of the run (or the URID's pick up)
+        to the row before the bus heads back to base (activity 6 or 3).
+
+        Args:
+        run (str): bus run
+        URID (object): default None, instance of URID class
+
+        Returns:
+        dataframe for specific bus run from day's schedule
+        """
+
+        positions = self.positions(run)
+        if URID is None:
+            leave = positions[0]
+        else:
+            leave = positions[(self.columns['LAT'][positions] == URID.PickUpCoords[0])
+                              & (self.columns['LON'][positions] == URID.PickUpCoords[1])
+                              & (self.columns['BookingId'][positions] == URID.BookingId)].min()
+
+        activity = self.columns['Activity']
+        base = positions[activity[positions] == 3][0]
+        if (base - 1 >= positions[0]) and (activity[base - 1] == 6):
+            base -= 1
+
+        return self.frame.iloc[leave:(base + 1)]
+
+
+class ScheduleLog():
+
+    """
+    Versioned undo log of all_functions.day_schedule_Update(inplace = True), so the day can be rolled
+    back without keeping a full copy of it. Each update keeps the URID's two rows as they were and
+    the ETAs of the receiving run's rows it shifted.
+
+    Attributes:
+    entries (list): (rows, rows as they were, targets, (start, stop), ETAs, (old run, new run)) for each
+    update: positions the URID's rows were moved from and to, and the positions start:stop whose ETAs
+    were shifted with their ETAs before the shift
+
+    """
+
+    def __init__(self):
+
+        self.entries = []
+
+    @property
+    def version(self):
+
+        """
+        Returns:
+        number of updates recorded so far, 0 for the schedule as it was loaded
+        """
+
+        return len(self.entries)
+
+    def record(self, rows, moved, targets, start, stop, eta, runs):
+
+        """
+        Args:
+        rows (list): positions of the URID's rows before the update
+        moved (dataframe): copy of those rows before the update
+        targets (list): positions the rows were moved to
+        start/stop (int): positions, after the move, of the rows whose ETAs are shifted
+        eta (array): ETAs of rows start:stop before the shift
+        runs (tuple): (run the URID left, run it was put on)
+
+        Returns:
+        version of the schedule after the change
+        """
+
+        self.entries.append((list(rows), moved, list(targets), (start, stop), eta, tuple(runs)))
+        return self.version
+
+    def runs(self, version = 0):
+
+        """
+        Args:
+        version (int): default 0, version rollback would go back to
+
+        Returns:
+        list of runs changed since version, whose capacity has to be recomputed after rolling back
+        """
+
+        runs = []
+        for entry in self.entries[version:]:
+            runs += [run for run in entry[5] if run not in runs]
+        return runs
+
+    def rollback(self, data, version = 0):
+
+        """
+        Args:
+        data (dataframe): day's schedule the updates were made on
+        version (int): default 0, version to go back to
+
+        Returns:
+        data, changed in place back to how it was at version, except for the capacity of the
+        runs(version), which TimeWindowsCapacity.update_Runs recomputes
+        """
+
+        while self.version > version:
+            rows, moved, targets, (start, stop), eta, runs = self.entries.pop()
+            data.iloc[start:stop, data.columns.get_loc('ETA')] = eta
+            move_rows(data, targets, rows)
+            for col in moved.columns:
+                data.iloc[rows, data.columns.get_loc(col)] = moved[col].values
+        return data
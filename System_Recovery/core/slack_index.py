@@ -0,0 +1,170 @@
+import numpy as np
+
+
+"""
+Forward time slack of bus runs, used by all_functions.insertPairs to count the time windows a
+delay breaks.
+
+A stop's slack is how many seconds later the bus could get there without breaking its window
+(max(PickupEnd, DropoffEnd) - ETA, infinite for stops that all_functions.late_scores never counts
+as late: ones that aren't pick ups or drop offs, or have no ETA or window). Pushing
+every stop from position i on back by lag seconds breaks a window exactly when lag is more than
+the forward slack, the smallest slack from i on, and breaks as many windows as there are slacks
+below lag in that suffix. The forward slack is one suffix minimum per run, so most delays are
+answered with a lookup, and only the ones that break something count slacks.
+
+When day_schedule_Update changes a run, its rows before the insertion point keep their slack, so
+the run's suffix minimum is patched from there back instead of built again:
+    slack_idx = SlackIndex()
+    inserts = insertPairs(Run_Schedule, URID, slack_index = slack_idx)
+    ...
+    slack_idx.update([URID.Run, inserts[0]['RunID']])
+"""
+
+
+def run_slack(eta, bound, active):
+
+    """
+    Args:
+    eta/bound/active (array): rows of a run, as returned by all_functions.window_bounds
+
+    Returns:
+    slack of each row in seconds, inf for the rows no delay makes late
+    """
+
+    slack = bound - eta
+    # a NaN ETA or bound never compares as late
+    return np.where(active & ~np.isnan(slack), slack, np.inf)
+
+
+class RunSlack():
+
+    """
+    Attributes:
+    slack (array): slack of each row of the run, in seconds
+    forward (array): forward[i] is the smallest slack from row i on, inf past the last row
+
+    """
+
+    def __init__(self, eta, bound, active):
+
+        """
+        Args:
+        eta/bound/active (array): rows of a run, as returned by all_functions.window_bounds
+
+        """
+
+        self.slack = run_slack(eta, bound, active)
+        self.forward = np.r_[np.minimum.accumulate(self.slack[::-1])[::-1], np.inf]
+
+    def patch(self, eta, bound, active):
+
+        """
+        Brings slack and forward up to date with the run's rows as they are now. Rows are compared
+        to the old ones to find the first that changed; forward is recomputed from the end of the
+        run down to it, and then only as far back as the new minimum reaches.
+
+        Args:
+        eta/bound/active (array): rows of the run as it is now, as returned by all_functions.window_bounds
+
+        Returns:
+        position of the first row whose slack changed (the number of rows if none did)
+        """
+
+        slack = run_slack(eta, bound, active)
+        m = min(slack.shape[0], self.slack.shape[0])
+        changed = np.flatnonzero(slack[:m] != self.slack[:m])
+        start = changed[0] if changed.shape[0] else m
+        if (start == slack.shape[0]) and (start == self.slack.shape[0]):
+            return start
+
+        tail = np.r_[np.minimum.accumulate(slack[start:][::-1])[::-1], np.inf]
+        old, new = self.forward[start], tail[0]
+        #forward is non-decreasing: rows whose old minimum is below both the old and the new
+        #minimum from start on get it from rows before start, which haven't changed
+        stop = np.searchsorted(self.forward[:start], min(old, new), side = 'left')
+        head = np.minimum(np.minimum.accumulate(slack[stop:start][::-1])[::-1], new)
+        self.forward = np.r_[self.forward[:stop], head, tail]
+        self.slack = slack
+        return start
+
+    def breaks_any(self, start, lag):
+
+        """
+        Args:
+        start (int): position of the first row that is delayed
+        lag (float): seconds every row from start on is delayed by
+
+        Returns:
+        True if the delay breaks a time window
+        """
+
+        return lag > self.forward[start]
+
+    def broken(self, starts, lags):
+
+        """
+        Args:
+        starts (array): positions of the first delayed row
+        lags (array): seconds every row from the matching start on is delayed by, same shape as starts
+
+        Returns:
+        int array, number of time windows each delay breaks
+        """
+
+        starts, lags = np.broadcast_arrays(np.asarray(starts, dtype = int), np.asarray(lags, dtype = float))
+        counts = np.zeros(starts.shape, dtype = int)
+        #most delays fit in the slack and break nothing
+        hit = lags > self.forward[starts]
+        for start in np.unique(starts[hit]):
+            rows = hit & (starts == start)
+            counts[rows] = (self.slack[start:][None, :] < lags[rows][:, None]).sum(axis = 1)
+        return counts
+
+
+class SlackIndex():
+
+    """
+    RunSlack of every run evaluated so far, built the first time a run is asked for.
+
+    Attributes:
+    runs (dict): run -> RunSlack
+    stale (set): runs changed since their RunSlack was last brought up to date
+
+    """
+
+    def __init__(self):
+
+        self.runs = {}
+        self.stale = set()
+
+    def get(self, Run_Schedule, bounds):
+
+        """
+        Args:
+        Run_Schedule (dataframe): schedule for a single run, from all_functions.get_busRuns
+        bounds (tuple): all_functions.window_bounds(Run_Schedule)
+
+        Returns:
+        RunSlack of the run
+        """
+
+        run = Run_Schedule.Run.iloc[0]
+        cached = self.runs.get(run)
+        if cached is None:
+            cached = RunSlack(*bounds)
+            self.runs[run] = cached
+        elif (run in self.stale) or (cached.slack.shape[0] != Run_Schedule.shape[0]):
+            cached.patch(*bounds)
+        self.stale.discard(run)
+        return cached
+
+    def update(self, runs):
+
+        """
+        Args:
+        runs (list): runs whose rows or ETAs changed, patched the next time they are asked for
+
+        """
+
+        self.stale.update(runs)
@@ -0,0 +1,141 @@
+import numpy as np
+
+
+"""
+Grid index over the stops of a day's schedule, used by all_functions.radius_Elimination.
+
+Stops are bucketed into square cells of about cell_miles on a side (a geohash-like grid on
+lat/lon), so a radius query only measures the stops in the cells the circle touches, and does
+so with one vectorized haversine instead of one haversine.haversine call per stop.
+
+Build it once when the schedule is loaded, and again whenever the schedule's rows are
+rearranged (e.g. after all_functions.day_schedule_Update):
+    idx = SpatialIndex(fullSchedule_windows)
+    runs = radius_Elimination(fullSchedule_windows, URID, radius, index = idx)
+"""
+
+
+#same constants as the haversine package, so distances match radius_Elimination's old results
+AVG_EARTH_RADIUS = 6371.
+KM_TO_MILES = 0.621371
+
+
+def haversine_miles(lat, lon, point):
+
+    """
+    Args:
+        lat/lon (array): latitudes and longitudes of stops, in degrees
+        point (list): lat/lon of a single location, in degrees
+
+    Returns:
+        array of great circle distances in miles between each stop and point
+    """
+
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(point[0]), np.radians(point[1])
+    d = np.sin((lat2 - lat1)*0.5)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)*0.5)**2
+    return 2*AVG_EARTH_RADIUS*np.arcsin(np.sqrt(d))*KM_TO_MILES
+
+
+class SpatialIndex():
+
+    """
+    Lat/lon grid over the rows of one schedule.
+
+    Attributes:
+    index (Index): row labels of the schedule the index was built on
+    lat/lon (array): stop coordinates rounded to 6 decimals, same order as index
+    runs (array): Run of every row
+    cell_lat/cell_lon (float): cell size in degrees
+    cells (dict): (lat cell, lon cell) -> array of row positions in that cell
+
+    """
+
+    def __init__(self, data, cell_miles = 1.):
+
+        """
+        Args:
+        data (dataframe): day's schedule, must have Run, LAT and LON columns
+        cell_miles (float): default 1., approximate width of a grid cell in miles
+
+        """
+
+        self.index = data.index
+        self.lat = np.round(np.array(data.LAT, dtype = float), 6)
+        self.lon = np.round(np.array(data.LON, dtype = float), 6)
+        self.runs = np.array(data.Run)
+
+        #degrees per mile: ~69 miles per degree of latitude, shrinking with cos(lat) for longitude
+        mid_lat = np.nanmedian(self.lat) if np.isfinite(self.lat).any() else 0.
+        self.cell_lat = cell_miles/69.05
+        self.cell_lon = cell_miles/(69.17*max(np.cos(np.radians(mid_lat)), 0.01))
+
+        ok, = np.where(np.isfinite(self.lat) & np.isfinite(self.lon))
+        keys = np.column_stack((np.floor(self.lat[ok]/self.cell_lat), np.floor(self.lon[ok]/self.cell_lon))).astype(int)
+        self.cells = {}
+        if ok.shape[0]:
+            order = np.lexsort((keys[:, 1], keys[:, 0]))
+            keys, ok = keys[order], ok[order]
+            bounds = np.where(np.any(np.diff(keys, axis = 0) != 0, axis = 1))[0] + 1
+            for start, end in zip(np.r_[0, bounds], np.r_[bounds, ok.shape[0]]):
+                self.cells[(keys[start, 0], keys[start, 1])] = ok[start:end]
+
+    def query_radius(self, point, radius, rows = None):
+
+        """
+        Args:
+        point (list): lat/lon of URID location
+        radius (float): search radius in miles
+        rows (list): default None, only consider these row labels of the schedule
+
+        Returns:
+        (positions, distances): row positions of stops strictly within radius of point, and their distance in miles
+        """
+
+        point = [round(point[0], 6), round(point[1], 6)]
+        reach_lat = int(np.ceil(radius*1.01/69.05/self.cell_lat))
+        reach_lon = int(np.ceil(radius*1.01/(69.17*max(np.cos(np.radians(point[0])), 0.01))/self.cell_lon))
+        c_lat = int(np.floor(point[0]/self.cell_lat)); c_lon = int(np.floor(point[1]/self.cell_lon))
+
+        found = [self.cells[(i, j)] for i in range(c_lat - reach_lat, c_lat + reach_lat + 1)
+                 for j in range(c_lon - reach_lon, c_lon + reach_lon + 1) if (i, j) in self.cells]
+        positions = np.concatenate(found) if found else np.array([], dtype = int)
+
+        if rows is not None:
+            allowed = self.index.get_indexer(rows)
+            positions = np.intersect1d(positions, allowed[allowed >= 0])
+
+        dist = haversine_miles(self.lat[positions], self.lon[positions], point)
+        near = dist < radius
+        return positions[near], dist[near]
+
+    def nearest_runs(self, point, radius, rows = None, max_runs = 30):
+
+        """
+        Runs that have a stop within radius of point. If there are more than max_runs such runs the
+        radius is shrunk one mile at a time until there aren't, as radius_Elimination used to do by recursion.
+
+        Args:
+        point (list): lat/lon of URID location
+        radius (float): search radius in miles
+        rows (list): default None, only consider these row labels of the schedule
+        max_runs (int): default 30, most runs to return
+
+        Returns:
+        list of runs
+        """
+
+        positions, dist = self.query_radius(point, radius, rows)
+        if positions.shape[0] == 0:
+            return []
+
+        #distance from point to each run's closest stop
+        runs = self.runs[positions]
+        order = np.argsort(dist, kind = 'mergesort')
+        run_names, first = np.unique(runs[order], return_index = True)
+        run_dist = dist[order][first]
+
+        sorted_dist = np.sort(run_dist)
+        while (radius > 0) & (np.searchsorted(sorted_dist, radius, side = 'left') > max_runs):
+            radius -= 1
+        return list(set(run_names[run_dist < radius].tolist()))
@@ -0,0 +1,224 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import add_TimeWindowsCapacity as aTWC
+import schedule_cache as schedCache
+
+
+"""
+Processed schedule (time windows and capacity) kept between 15 minute streaming snapshots.
+
+Consecutive snapshots differ in few rows, so instead of running addtoRun_TimeCapacity on every
+snapshot, the rows of a new snapshot are matched to the previous one by (Run, BookingId, Activity)
+and only the runs with added, removed, changed or reordered rows get their time windows and
+capacity recomputed (TimeWindowsCapacity.update_Runs). Every other row keeps its processed values.
+
+Keep one StreamingSchedule for as long as snapshots keep coming in:
+    stream = StreamingSchedule()
+    fullSchedule_windows = stream.update(s3_data_acquire(...), windows)
+    print(stream.metrics)
+
+or, when every snapshot is rescheduled in a new process (the webapp runs busRescheduler.py once per
+request), keep it in a file between them:
+    stream = load(os.path.join(path_to_outdir, 'streaming_schedule.npz'))
+    fullSchedule_windows = stream.update(s3_data_acquire(...), windows)
+    stream.save(os.path.join(path_to_outdir, 'streaming_schedule.npz'))
+"""
+
+
+#columns a row is matched on between snapshots
+KEYS = ['Run', 'BookingId', 'Activity']
+
+
+def row_keys(data):
+
+    """
+    Args:
+    data (dataframe): snapshot with KEYS columns
+
+    Returns:
+    MultiIndex of (Run, BookingId, Activity, occurrence) for each row, null BookingId as -1 and
+    occurrence numbering rows with the same (Run, BookingId, Activity), e.g. a run's breaks, in order
+    """
+
+    keys = pd.DataFrame({'Run': np.asarray(data['Run'], dtype = object),
+                         'BookingId': pd.Series(np.asarray(data['BookingId'], dtype = float)).fillna(-1.).values,
+                         'Activity': np.asarray(data['Activity'])}, columns = KEYS)
+    occurrence = keys.groupby(KEYS, sort = False).cumcount()
+    return pd.MultiIndex.from_arrays([keys[col].values for col in KEYS] + [occurrence.values])
+
+
+def load(path):
+
+    """
+    Args:
+    path (str): file written by StreamingSchedule.save
+
+    Returns:
+    StreamingSchedule going on from the snapshot saved in path, a new one if there is none or it can't
+    be read (its first update then processes the whole day)
+    """
+
+    stream = StreamingSchedule()
+    try:
+        with np.load(path) as arrays:
+            if int(arrays['version']) != schedCache.VERSION:
+                return stream
+            part = lambda prefix: dict((name[len(prefix):], arrays[name]) for name in arrays.files if name.startswith(prefix))
+            raw, schedule = schedCache.from_arrays(part('raw.')), schedCache.from_arrays(part('schedule.'))
+            windows = float(arrays['windows'])
+    except (IOError, OSError, KeyError, ValueError):
+        return stream
+    stream.raw, stream.keys, stream.schedule, stream.windows = raw, row_keys(raw), schedule, windows
+    return stream
+
+
+def same_values(new, old):
+
+    """
+    Args:
+    new/old (array): values of a column, same shape
+
+    Returns:
+    bool array, True where they are equal or both null
+    """
+
+    with np.errstate(invalid = 'ignore'):
+        return (new == old) | (pd.isnull(new) & pd.isnull(old))
+
+
+class StreamingSchedule():
+
+    """
+    Attributes:
+    raw (dataframe): previous snapshot, as it was passed to update
+    keys (MultiIndex): row_keys(raw)
+    schedule (dataframe): raw with time windows and capacity, as addtoRun_TimeCapacity gives
+    windows (float): pickup/dropoff time window in seconds schedule was processed with
+    metrics (dict): rows and runs the last update touched
+    history (list): metrics of every update made in this process
+
+    """
+
+    def __init__(self):
+
+        self.raw = None
+        self.keys = None
+        self.schedule = None
+        self.windows = None
+        self.metrics = {}
+        self.history = []
+
+    def update(self, data, windows):
+
+        """
+        Args:
+        data (dataframe): newest snapshot, QC'ed (e.g. by qcS3data.qc_runs), one row per position (RangeIndex)
+        windows (float): pickup/dropoff time window in seconds
+
+        Returns:
+        processed schedule of data, same as aTWC.TimeWindowsCapacity(data).addtoRun_TimeCapacity(windows).
+        It is kept for the next update: copy it before changing it.
+        """
+
+        keys = row_keys(data)
+        if (self.raw is None) or (self.raw.shape[0] == 0) or (windows != self.windows) or (list(data.columns) != list(self.raw.columns)):
+            schedule = aTWC.TimeWindowsCapacity(data.copy()).addtoRun_TimeCapacity(windows)
+            runs = pd.unique(np.asarray(data['Run'], dtype = object))
+            metrics = {'rows': data.shape[0], 'runs': len(runs), 'rows_added': data.shape[0], 'rows_removed': 0,
+                       'rows_changed': 0, 'runs_touched': len(runs), 'rows_touched': data.shape[0]}
+        else:
+            schedule, metrics = self._apply(data, keys)
+
+        self.raw, self.keys, self.schedule, self.windows = data, keys, schedule, windows
+        self.metrics = metrics
+        self.history.append(metrics)
+        print('Snapshot: {rows_added} rows added, {rows_removed} removed, {rows_changed} changed; '
+              '{runs_touched} of {runs} runs ({rows_touched} rows) reprocessed.'.format(**metrics))
+        return schedule
+
+    def save(self, path):
+
+        """
+        Writes the previous snapshot and its processed schedule to path, for load to go on from.
+
+        Args:
+        path (str): .npz file, replaced if it exists
+
+        Returns:
+        path, None if there is no snapshot yet or a column can't be stored without pickling
+        """
+
+        if self.raw is None:
+            return None
+        raw, schedule = schedCache.to_arrays(self.raw), schedCache.to_arrays(self.schedule)
+        if (raw is None) or (schedule is None):
+            return None
+        arrays = dict([('raw.' + name, values) for name, values in raw.items()] +
+                      [('schedule.' + name, values) for name, values in schedule.items()])
+        arrays['windows'] = np.array(self.windows, dtype = float)
+        arrays['version'] = np.array(schedCache.VERSION)
+        #written under a temporary name and renamed, so a run started meanwhile never loads half a file
+        fd, tmp = tempfile.mkstemp(suffix = '.npz', dir = os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #Windows won't rename over an existing file
+            os.remove(path)
+            os.rename(tmp, path)
+        return path
+
+    def _apply(self, data, keys):
+
+        """
+        Args:
+        data (dataframe): newest snapshot, same columns as raw
+        keys (MultiIndex): row_keys(data)
+
+        Returns:
+        (processed schedule of data, metrics)
+        """
+
+        # position of each new row in the previous snapshot, -1 for new rows
+        pos = self.keys.get_indexer(keys)
+        matched = np.flatnonzero(pos >= 0)
+        added = pos < 0
+        changed = np.zeros(data.shape[0], dtype = bool)
+        for col in data.columns:
+            changed[matched] |= ~same_values(np.asarray(data[col])[matched], np.asarray(self.raw[col])[pos[matched]])
+        removed = np.ones(self.raw.shape[0], dtype = bool)
+        removed[pos[matched]] = False
+
+        run = np.asarray(data['Run'], dtype = object)
+        touched = set(run[added | changed]) | set(np.asarray(self.raw['Run'], dtype = object)[removed])
+        # capacity counts depend on the order of a run's rows too
+        order = np.argsort(pd.factorize(run[matched])[0], kind = 'mergesort')
+        runs_m, pos_m = run[matched][order], pos[matched][order]
+        touched |= set(runs_m[1:][(runs_m[1:] == runs_m[:-1]) & (pos_m[1:] < pos_m[:-1])])
+
+        # processed columns of untouched rows as they were, touched runs are recomputed below
+        schedule = data.copy()
+        stale = np.flatnonzero(added | changed)
+        fill = np.where(added, 0, pos)
+        for col in self.schedule.columns:
+            if col not in data.columns:
+                schedule[col] = np.asarray(self.schedule[col])[fill]
+        for col in ['SpaceOn', 'SpaceOff']:
+            values = np.asarray(self.schedule[col], dtype = object)[fill]
+            # no shows don't take up space
+            values[stale] = np.where(np.asarray(data['SchedStatus'])[stale] != 1., np.nan,
+                                     np.asarray(data[col], dtype = object)[stale])
+            schedule[col] = values
+        for col, space, k in [('wcOn', 'SpaceOn', 0), ('wcOff', 'SpaceOff', 0), ('amOn', 'SpaceOn', 1), ('amOff', 'SpaceOff', 1)]:
+            schedule.iloc[stale, schedule.columns.get_loc(col)] = aTWC.space_counts(np.asarray(schedule[space])[stale])[:, k]
+
+        if touched:
+            schedule = aTWC.TimeWindowsCapacity(schedule).update_Runs(list(touched), windows = self.windows)
+
+        metrics = {'rows': data.shape[0], 'runs': len(pd.unique(run)), 'rows_added': int(added.sum()),
+                   'rows_removed': int(removed.sum()), 'rows_changed': int(changed.sum()), 'runs_touched': len(touched),
+                   'rows_touched': int(np.in1d(run, list(touched)).sum())}
+        return schedule, metrics
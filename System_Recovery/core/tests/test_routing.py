@@ -0,0 +1,155 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import routing
+
+
+"""
+OSRMRouter and OSRMTable against a stand-in for the OSRM server: FakeSession answers table
+requests with haversine distance / 10 m/s, so no network is needed.
+
+Run from System_Recovery/core:  python -m unittest discover -s tests
+"""
+
+
+def response(status, body, content_type = 'application/json'):
+
+    resp = requests.models.Response()
+    resp.status_code = status
+    resp._content = body.encode('utf-8')
+    resp.headers['Content-Type'] = content_type
+    return resp
+
+
+class FakeSession():
+
+    """
+    Attributes:
+    urls (list): every url requested
+    failures (list): responses given, in order, before the server starts answering properly
+
+    """
+
+    def __init__(self, failures = ()):
+
+        self.urls = []
+        self.failures = list(failures)
+
+    def get(self, url, timeout = None):
+
+        self.urls.append(url)
+        if self.failures:
+            return self.failures.pop(0)
+        path, query = url.split('?')
+        coords = [c.split(',') for c in path.split('/table/v1/driving/')[1].split(';')]
+        latlon = np.array([[float(lat), float(lon)] for lon, lat in coords])
+        params = dict(p.split('=') for p in query.split('&'))
+        src = [int(k) for k in params['sources'].split(';')]
+        dst = [int(k) for k in params['destinations'].split(';')]
+        durations = routing.haversine_matrix(latlon[src], latlon[dst])/10.
+        return response(200, '{"code": "Ok", "durations": %s}' % durations.tolist())
+
+
+def coords_in(url):
+
+    return len(url.split('?')[0].split('/table/v1/driving/')[1].split(';'))
+
+
+class OSRMTableTest(unittest.TestCase):
+
+    def setUp(self):
+
+        routing.set_cache(None)
+        rng = np.random.RandomState(0)
+        self.URID_location = [47.6, -122.3]
+        self.outbound = np.column_stack((47.5 + rng.rand(30)*0.2, -122.4 + rng.rand(30)*0.2))
+        self.inbound = np.column_stack((47.5 + rng.rand(30)*0.2, -122.4 + rng.rand(30)*0.2))
+
+    def router(self, session, max_coords = 100):
+
+        router = routing.OSRMRouter('http://osrm.test', max_coords = max_coords, backoff = 0.)
+        router.session = session
+        return router
+
+    def expected(self, origin, destination):
+
+        return routing.haversine_matrix(routing.coord_key(*origin), routing.coord_key(*destination))[0, 0]/10.
+
+    def test_legs_of_a_URID_fit_one_request(self):
+
+        session = FakeSession()
+        table = routing.OSRMTable(self.router(session))
+        table.add(self.URID_location, self.inbound, self.outbound)
+        self.assertEqual(table.fetch(), 1)
+        self.assertEqual(len(session.urls), 1)
+        for k in range(30):
+            self.assertAlmostEqual(table.durations[(routing.coord_key(*self.outbound[k]), routing.coord_key(*self.URID_location))],
+                                   self.expected(self.outbound[k], self.URID_location), places = 6)
+            self.assertAlmostEqual(table.durations[(routing.coord_key(*self.URID_location), routing.coord_key(*self.inbound[k]))],
+                                   self.expected(self.URID_location, self.inbound[k]), places = 6)
+        #fetched legs aren't asked for again
+        table.add(self.URID_location, self.inbound, self.outbound)
+        self.assertEqual(table.fetch(), 0)
+        self.assertEqual(len(session.urls), 1)
+
+    def test_requests_split_at_max_coords(self):
+
+        session = FakeSession()
+        table = routing.OSRMTable(self.router(session, max_coords = 10))
+        table.add(self.URID_location, self.inbound, self.outbound)
+        made = table.fetch()
+        self.assertEqual(made, len(session.urls))
+        self.assertTrue(all(coords_in(url) <= 10 for url in session.urls))
+        #30 nodes into the URID and 30 out of it, 9 nodes and the URID per request
+        self.assertEqual(made, 8)
+        self.assertEqual(len(table.durations), 60)
+
+    def test_html_error_page_is_retried(self):
+
+        session = FakeSession([response(502, '<html>Bad Gateway</html>', 'text/html'),
+                               response(200, '<html>maintenance</html>', 'text/html')])
+        router = self.router(session)
+        times = router.table([routing.coord_key(*self.outbound[0])], [routing.coord_key(*self.URID_location)])
+        self.assertEqual(len(session.urls), 3)
+        self.assertAlmostEqual(times[0][0], self.expected(self.outbound[0], self.URID_location), places = 6)
+
+    def test_html_every_try_falls_back_to_no_route(self):
+
+        session = FakeSession([response(200, '<html>maintenance</html>', 'text/html')]*4)
+        router = self.router(session)
+        self.assertRaises(requests.exceptions.RequestException, router.get_json, 'http://osrm.test/table/v1/driving/0,0;1,1')
+        session.failures = [response(200, '<html>maintenance</html>', 'text/html')]*4
+        self.assertEqual(router.table([(47.6, -122.3)], [(47.7, -122.2), (47.5, -122.4)]), [[None, None]])
+        self.assertEqual(len(session.urls), 8)
+
+
+
+class TravelTimeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.cache = routing.TravelTimeCache(os.path.join(self.directory, 'travel_times.sqlite'))
+
+    def tearDown(self):
+
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_missing_times_are_not_cached(self):
+
+        origin, destination = (47.6, -122.3), (47.7, -122.2)
+        #a leg to a stop without coordinates comes back NaN, which sqlite would keep as NULL
+        self.cache.put_many([(origin, destination, np.nan, None), (destination, origin, None, None),
+                             (origin, origin, routing.NO_ROUTE, None), (destination, destination, 60., None)])
+        self.assertEqual(self.cache.get_many([(origin, destination), (destination, origin), (origin, origin)]), {})
+        self.assertEqual(self.cache.get_many([(destination, destination)]), {(destination, destination): (60., None)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import s3_listing
+
+
+"""
+s3_listing against a stand-in for the paratransitdata bucket: FakeBucket lists its FakeKeys in
+name order after marker, the way S3 does, and records the markers asked for, so no network or
+AWS keys are needed.
+
+Run from System_Recovery/core:  python -m unittest discover -s tests
+"""
+
+
+PREFIX = s3_listing.PREFIX + '20161005'
+
+
+class FakeKey():
+
+    def __init__(self, name, size, last_modified):
+
+        self.name = name
+        self.size = size
+        self.last_modified = last_modified
+
+
+class FakeBucket():
+
+    """
+    Attributes:
+    name (str): bucket name
+    keys (dict): key name -> FakeKey
+    markers (list): marker of every list request, in order
+
+    """
+
+    def __init__(self, name = 'paratransitdata'):
+
+        self.name = name
+        self.keys = {}
+        self.markers = []
+
+    def put(self, name, size, last_modified):
+
+        self.keys[name] = FakeKey(name, size, last_modified)
+
+    def list(self, prefix = '', marker = ''):
+
+        self.markers.append(marker)
+        return [self.keys[name] for name in sorted(self.keys) if name.startswith(prefix) and name > marker]
+
+
+def snapshot(hhmm):
+
+    return PREFIX + hhmm + '.txt'
+
+
+class SnapshotListingTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 's3_listing.json')
+        s3_listing._listings.clear()
+        self.bucket = FakeBucket()
+        #yesterday's snapshot isn't under the prefix
+        self.bucket.put(s3_listing.PREFIX + '201610042345.txt', 100, '2016-10-04T23:45:00.000Z')
+        self.bucket.put(snapshot('0600'), 100, '2016-10-05T06:00:00.000Z')
+        self.bucket.put(snapshot('0615'), 100, '2016-10-05T06:15:00.000Z')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+    def test_lists_after_the_last_key_seen(self):
+
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX)
+        self.assertEqual(sorted(listing.keys), [snapshot('0600'), snapshot('0615')])
+        self.bucket.put(snapshot('0630'), 100, '2016-10-05T06:30:00.000Z')
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX)
+        self.assertEqual(self.bucket.markers, ['', snapshot('0615')])
+        self.assertEqual((listing.calls, listing.listed), (2, 3))
+        self.assertEqual(listing.newest(), snapshot('0630'))
+
+    def test_empty_snapshot_is_listed_again(self):
+
+        self.bucket.put(snapshot('0630'), 0, '2016-10-05T06:30:00.000Z')
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX)
+        self.assertEqual(listing.newest(), snapshot('0615'))
+        #the empty snapshot is written over with its contents
+        self.bucket.put(snapshot('0630'), 100, '2016-10-05T06:31:00.000Z')
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX)
+        self.assertEqual(self.bucket.markers[-1], snapshot('0615'))
+        self.assertEqual(listing.newest(), snapshot('0630'))
+
+    def test_newest_non_empty_snapshot(self):
+
+        self.bucket.put(snapshot('0630'), 0, '2016-10-05T06:30:00.000Z')
+        #uploaded late, its name isn't the last one
+        self.bucket.put(snapshot('0610'), 100, '2016-10-05T06:20:00.000Z')
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX)
+        self.assertEqual(listing.newest(), snapshot('0610'))
+        self.assertEqual(listing.newest(min_size = 101), None)
+
+    def test_kept_in_path_between_processes(self):
+
+        s3_listing.snapshot_listing(self.bucket, PREFIX, path = self.path)
+        self.assertTrue(os.path.isfile(self.path))
+        self.bucket.put(snapshot('0630'), 100, '2016-10-05T06:30:00.000Z')
+        #a new process only has the file
+        s3_listing._listings.clear()
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX, path = self.path)
+        self.assertEqual(self.bucket.markers, ['', snapshot('0615')])
+        self.assertEqual((listing.calls, listing.listed), (1, 1))
+        self.assertEqual(sorted(listing.keys), [snapshot('0600'), snapshot('0615'), snapshot('0630')])
+        self.assertEqual(listing.newest(), snapshot('0630'))
+
+    def test_next_day_starts_over(self):
+
+        s3_listing.snapshot_listing(self.bucket, PREFIX, path = self.path)
+        self.bucket.put(s3_listing.PREFIX + '201610060600.txt', 100, '2016-10-06T06:00:00.000Z')
+        listing = s3_listing.snapshot_listing(self.bucket, s3_listing.PREFIX + '20161006', path = self.path)
+        self.assertEqual(self.bucket.markers, ['', ''])
+        self.assertEqual(list(listing.keys), [s3_listing.PREFIX + '201610060600.txt'])
+
+    def test_unreadable_file_lists_the_prefix(self):
+
+        with open(self.path, 'w') as f:
+            f.write('{"bucket": "paratransitdata", "pref')
+        listing = s3_listing.snapshot_listing(self.bucket, PREFIX, path = self.path)
+        self.assertEqual(self.bucket.markers, [''])
+        self.assertEqual(listing.newest(), snapshot('0615'))
+
+
+if __name__ == '__main__':
+    unittest.main()
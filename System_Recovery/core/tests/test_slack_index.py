@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import all_functions as af
+import slack_index
+
+
+"""
+RunSlack against all_functions.late_scores, which counts the windows a delay breaks row by row,
+on random runs with missing ETAs and windows.
+
+Run from System_Recovery/core:  python -m unittest discover -s tests
+"""
+
+
+def random_run(rng, n):
+
+    eta = np.cumsum(rng.randint(60, 900, n)).astype(float)
+    bound = eta + rng.randint(-300, 1200, n)
+    eta[rng.rand(n) < .1] = np.nan
+    bound[rng.rand(n) < .1] = np.nan
+    active = rng.rand(n) < .8
+    return eta, bound, active
+
+
+def late_count(eta, bound, active, start, lag):
+
+    return int(af.late_scores(eta[start:], bound[start:], active[start:], lag)[0].sum())
+
+
+class RunSlackTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.rng = np.random.RandomState(0)
+
+    def test_nan_rows_are_never_late(self):
+
+        slack = slack_index.RunSlack(np.array([100., 200., 300.]), np.array([150., np.nan, 310.]), np.ones(3, dtype = bool))
+        self.assertEqual(list(slack.broken([0], [60.])), [2])
+        self.assertTrue(slack.breaks_any(0, 60.))
+
+    def test_broken_matches_late_scores(self):
+
+        for trial in range(200):
+            n = self.rng.randint(1, 40)
+            eta, bound, active = random_run(self.rng, n)
+            slack = slack_index.RunSlack(eta, bound, active)
+            starts = self.rng.randint(0, n + 1, 20)
+            lags = self.rng.rand(20)*1500
+            want = [late_count(eta, bound, active, start, lag) for start, lag in zip(starts, lags)]
+            self.assertEqual(list(slack.broken(starts, lags)), want)
+            self.assertEqual([slack.breaks_any(start, lag) for start, lag in zip(starts, lags)], [k > 0 for k in want])
+
+    def test_patch_matches_fresh(self):
+
+        for trial in range(200):
+            n = self.rng.randint(2, 40)
+            eta, bound, active = random_run(self.rng, n)
+            slack = slack_index.RunSlack(eta, bound, active)
+            at = self.rng.randint(0, n + 1)
+            if trial % 2:
+                #an insertion: two rows added, and the ETAs from the pick up on pushed back
+                new_eta, new_bound, new_active = random_run(self.rng, 2)
+                eta = np.r_[eta[:at], new_eta, eta[at:]]
+                bound = np.r_[bound[:at], new_bound, bound[at:]]
+                active = np.r_[active[:at], new_active, active[at:]]
+                eta[at:] += self.rng.rand()*600
+            else:
+                #a URID taken off: two rows removed
+                keep = np.ones(n, dtype = bool)
+                keep[self.rng.choice(n, 2, replace = False)] = False
+                eta, bound, active = eta[keep], bound[keep], active[keep]
+            slack.patch(eta, bound, active)
+            fresh = slack_index.RunSlack(eta, bound, active)
+            np.testing.assert_array_equal(slack.slack, fresh.slack)
+            np.testing.assert_array_equal(slack.forward, fresh.forward)
+
+
+if __name__ == '__main__':
+    unittest.main()
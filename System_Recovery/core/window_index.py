@@ -0,0 +1,82 @@
+import numpy as np
+
+
+"""
+Sorted interval index over the time windows of a schedule, used by all_functions.time_overlap.
+
+Each row's window is [max(PickupStart, DropoffStart), max(PickupEnd, DropoffEnd)]. Rows are kept
+sorted by window start, so the rows that can overlap a URID's window are found with one
+binary search and checked with NumPy masks instead of a Python loop over the whole day.
+
+Build it once per schedule version (when the schedule is loaded, and again after
+all_functions.day_schedule_Update rearranges it) and pass it to time_overlap:
+    win_idx = WindowIndex(fullSchedule_windows)
+    nodes = time_overlap(Run_Schedule, URID, index = win_idx)
+"""
+
+
+class WindowIndex():
+
+    """
+    Attributes:
+    labels (array): row labels of the schedule, sorted by window start
+    runs (array): Run of each row, same order as labels
+    win_start/win_end (array): window of each row, same order as labels
+    inverted (array): positions of rows whose window ends before it starts
+
+    """
+
+    def __init__(self, data):
+
+        """
+        Args:
+        data (dataframe): schedule with Run and time window columns
+
+        """
+
+        win_start = np.maximum(np.array(data.PickupStart, dtype = float), np.array(data.DropoffStart, dtype = float))
+        win_end = np.maximum(np.array(data.PickupEnd, dtype = float), np.array(data.DropoffEnd, dtype = float))
+        order = np.argsort(win_start, kind = 'mergesort')
+
+        self.labels = np.array(data.index)[order]
+        self.runs = np.array(data.Run)[order]
+        self.win_start = win_start[order]
+        self.win_end = win_end[order]
+        self.inverted, = np.where(self.win_end < self.win_start)
+
+    def overlap(self, Start, End, rows = None, exclude_run = None):
+
+        """
+        Args:
+        Start/End (float): URID's pick up or drop off window
+        rows (list): default None, only return these row labels
+        exclude_run (str): default None, leave out rows of this run
+
+        Returns:
+        sorted array of labels of rows whose window overlaps [Start, End]
+        """
+
+        #every overlap case needs win_start <= max(Start, End), except a window
+        #inside [Start, End] that ends before it starts
+        stop = np.searchsorted(self.win_start, max(Start, End), side = 'right')
+        cand = np.union1d(np.arange(stop), self.inverted).astype(int)
+        WinSt = self.win_start[cand]; WinEnd = self.win_end[cand]
+
+        #simple, unequal overlap
+        hit = (WinEnd > Start) & (WinSt < End)
+        # equal or strictly within [WinSt, WinEnd]
+        hit |= (WinEnd <= End) & (WinSt >= Start)
+        # [Start, End] completely covered by [WinSt, WinEnd] and then some on both sides
+        hit |= (WinEnd > End) & (WinSt < Start)
+        # [Start, End] completely covered and then some only on left side
+        hit |= (WinEnd == End) & (WinSt < Start)
+        # [Start, End] completely covered and then some only on right side
+        hit |= (WinEnd > End) & (WinSt == Start)
+
+        cand = cand[hit]
+        if exclude_run is not None:
+            cand = cand[self.runs[cand] != exclude_run]
+        labels = self.labels[cand]
+        if rows is not None:
+            labels = labels[np.in1d(labels, np.array(rows))]
+        return np.sort(labels)